@@ -1,35 +1,49 @@
+import time
+_IMPORT_STARTED_AT = time.perf_counter()
 import tkinter as tk
-from tkinter import messagebox, Toplevel
+from tkinter import messagebox, Toplevel, filedialog
 from tkinter import ttk
 import tkinter.font as tkfont
 import keyboard
 import pyperclip
-import time
 import json
 import os
 import shutil
-from pystray import Icon, MenuItem, Menu
-from PIL import Image, ImageDraw, ImageFont
+import tempfile
+import sqlite3
+import mmap
+import struct
+import zlib
 import sys
 import atexit
 import customtkinter as ctk
 from customtkinter import CTkFont
 import threading
-import psutil
-from typing import Dict, Optional, Any
-from collections import defaultdict
-from screeninfo import get_monitors
-from ctypes import windll, c_int, c_uint, byref, sizeof, c_void_p
+import queue
+import bisect
+import heapq
+import re
+from array import array
+from typing import Dict, Optional, Any, List, Tuple, Iterable
+from collections import defaultdict, deque, OrderedDict
+import contextlib
+import csv
+import itertools
+import math
+import ctypes
+import ctypes.util
+import select
+from ctypes import c_int, c_uint, byref, sizeof, c_void_p
+try:
+    from ctypes import windll
+except ImportError:  # Fora do Windows (benchmarks e ferramentas headless); todo uso de windll checa os.name.
+    windll = None
+# pystray, PIL, psutil e screeninfo são importados só quando usados (bandeja, ícone, cleanup e
+# posicionamento do popup), fora do caminho de inicialização.
 import logging
+import logging.handlers
+import argparse
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(threadName)s - %(message)s',
-    handlers=[
-        logging.FileHandler('macro_manager.log', mode='w', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
 ctk.set_appearance_mode("dark")
@@ -59,6 +73,103 @@ def get_user_data_dir(app_name="MacroManagerV3"):
             path = os.getcwd()
     return path
 
+SETTINGS_FILE_NAME = "settings.json"
+LOG_FILE_NAME = "macro_manager.log"
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(threadName)s - %(message)s'
+LOG_MAX_BYTES = 2 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+DEFAULT_LOG_LEVEL = "INFO"
+
+def load_settings(data_dir: Optional[str] = None) -> Dict[str, Any]:
+    settings_path = os.path.join(data_dir or get_user_data_dir(), SETTINGS_FILE_NAME)
+    try:
+        with open(settings_path, "r", encoding="utf-8") as f:
+            settings = json.load(f)
+        return settings if isinstance(settings, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Could not read settings from {settings_path}: {e}. Using defaults.")
+        return {}
+
+
+class _DeferredFormatQueueHandler(logging.handlers.QueueHandler):
+    # O QueueHandler padrão formata a mensagem na thread que loga; aqui o registro vai intacto
+    # para a fila e só é formatado (e escrito em disco) pela thread do QueueListener.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup_logging(level: Optional[str] = None, data_dir: Optional[str] = None) -> str:
+    global _log_listener
+    data_dir = data_dir or get_user_data_dir()
+    level_name = (level or os.getenv("MACRO_MANAGER_LOG_LEVEL") or load_settings(data_dir).get("log_level") or DEFAULT_LOG_LEVEL).upper()
+    numeric_level = logging.getLevelName(level_name)
+    if not isinstance(numeric_level, int):
+        level_name, numeric_level = DEFAULT_LOG_LEVEL, logging.getLevelName(DEFAULT_LOG_LEVEL)
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers: List[logging.Handler] = []
+    try:
+        file_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(data_dir, LOG_FILE_NAME), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+            encoding="utf-8", delay=True)
+        handlers.append(file_handler)
+    except OSError as e:
+        print(f"Could not open log file in {data_dir}: {e}", file=sys.stderr)
+    if sys.stderr is not None: # Executável sem console (PyInstaller --windowed) não tem stderr.
+        handlers.append(logging.StreamHandler())
+    for handler in handlers: handler.setFormatter(formatter)
+
+    if _log_listener is not None: _log_listener.stop()
+    log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers): root_logger.removeHandler(handler)
+    root_logger.addHandler(_DeferredFormatQueueHandler(log_queue))
+    root_logger.setLevel(numeric_level)
+    logging.getLogger("PIL").setLevel(max(numeric_level, logging.INFO))
+    atexit.register(shutdown_logging)
+    return level_name
+
+def shutdown_logging() -> None:
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+class StartupProfiler:
+    # Tempos por fase da inicialização (--profile-startup). Desativado, phase() só executa o bloco.
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.phases: List[Tuple[str, float]] = []
+        self._reported = False
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield; return
+        start = time.perf_counter()
+        try: yield
+        finally: self.phases.append((name, time.perf_counter() - start))
+
+    def record(self, name: str, seconds: float) -> None:
+        if self.enabled: self.phases.append((name, seconds))
+
+    def report(self) -> None:
+        if not self.enabled or self._reported: return
+        self._reported = True
+        lines = ["Startup profile (ms):"]
+        lines += [f"  {name:<32} {seconds * 1000:9.1f}" for name, seconds in self.phases]
+        lines.append(f"  {'total since interpreter imports':<32} {(time.perf_counter() - _IMPORT_STARTED_AT) * 1000:9.1f}")
+        report = "\n".join(lines)
+        print(report, flush=True)
+        logger.info(report)
+
+
 def is_admin():
     if os.name == 'nt':
         try:
@@ -103,97 +214,2317 @@ class WindowsAPI:
                 else:
                     value_backdrop = c_int(3) # Tentar Acrylic para tema claro (ou Mica normal)
 
-                # Para maior compatibilidade, pode ser melhor usar 0 (desabilitado) ou 1 (automático)
-                # ou um valor como 4 (DWMSBT_TABBEDWINDOW) que é mais sutil.
-                # value_backdrop = c_int(4)
-                set_window_attribute(hwnd, WindowsAPI.DWMWA_SYSTEMBACKDROP_TYPE, byref(value_backdrop), sizeof(value_backdrop))
-        except Exception as e: logger.error(f"Error applying Windows API window style: {e}")
+                # Para maior compatibilidade, pode ser melhor usar 0 (desabilitado) ou 1 (automático)
+                # ou um valor como 4 (DWMSBT_TABBEDWINDOW) que é mais sutil.
+                # value_backdrop = c_int(4)
+                set_window_attribute(hwnd, WindowsAPI.DWMWA_SYSTEMBACKDROP_TYPE, byref(value_backdrop), sizeof(value_backdrop))
+        except Exception as e: logger.error(f"Error applying Windows API window style: {e}")
+
+
+def configurar_tema(root: tk.Tk) -> None:
+    try: logger.info("Tk scaling call has been commented out/skipped in configurar_tema.")
+    except Exception as e: logger.warning(f"Could not set Tk scaling (or call was already commented out): {e}")
+
+    if hasattr(sys, '_MEIPASS'): base_path = sys._MEIPASS
+    else: base_path = os.path.dirname(os.path.abspath(__file__))
+    theme_package_name = 'azure'
+    possible_theme_package_base_paths = [ base_path, os.path.join(base_path, 'libs'), os.path.dirname(base_path) ]
+    tcl_auto_path_to_add = None
+    for p_path in possible_theme_package_base_paths:
+        if os.path.isdir(os.path.join(p_path, 'theme')) and os.path.exists(os.path.join(p_path, 'theme', 'pkgIndex.tcl')):
+            tcl_auto_path_to_add = p_path; logger.info(f"Found Azure theme structure with 'theme' folder in: {tcl_auto_path_to_add}"); break
+        if os.path.basename(p_path) == 'theme' and os.path.exists(os.path.join(p_path, 'pkgIndex.tcl')):
+            tcl_auto_path_to_add = os.path.dirname(p_path); logger.info(f"Found Azure theme structure where base_path pointed into 'theme'. Auto_path set to parent: {tcl_auto_path_to_add}"); break
+        if os.path.exists(os.path.join(p_path, f'{theme_package_name}.tcl')) and os.path.isdir(os.path.join(p_path, 'theme')) and os.path.exists(os.path.join(p_path, 'theme', 'pkgIndex.tcl')):
+            tcl_auto_path_to_add = p_path; logger.info(f"Found {theme_package_name}.tcl and 'theme' subfolder in: {tcl_auto_path_to_add}"); break
+    if not tcl_auto_path_to_add: tcl_auto_path_to_add = base_path; logger.warning(f"Could not definitively locate Azure theme structure. Defaulting Tcl auto_path to: {tcl_auto_path_to_add}")
+    logger.info(f"Adding to Tcl auto_path: {tcl_auto_path_to_add}")
+    try: root.tk.call('lappend', 'auto_path', tcl_auto_path_to_add)
+    except tk.TclError as e:
+        logger.error(f"Failed to lappend to Tcl auto_path: {e}"); ctk.set_default_color_theme("blue"); logger.info("Falling back to default CustomTkinter theme as Tcl auto_path configuration failed.")
+        default_font_tuple = ('Segoe UI', 10); root.option_add('*Font', default_font_tuple); style = ttk.Style(root)
+        style.configure('Treeview', rowheight=28, font=default_font_tuple); style.configure('Treeview.Heading', font=('Segoe UI', 10, 'bold'))
+        if os.name == 'nt': WindowsAPI.apply_window_style(root); return
+    try:
+        logger.info(f"Attempting to 'package require {theme_package_name}'")
+        root.tk.call('package', 'require', theme_package_name)
+        root.tk.call('set_theme', ctk.get_appearance_mode().lower())
+        logger.info(f"{theme_package_name.capitalize()} Tcl theme loaded and set to {ctk.get_appearance_mode().lower()}.")
+    except tk.TclError as e:
+        logger.error(f"Failed to load or set {theme_package_name.capitalize()} Tcl theme: {e}. Using default CustomTkinter theme.")
+        ctk.set_default_color_theme("blue")
+    style = ttk.Style(root); default_font_tuple = ('Segoe UI', 10); bold_font_tuple = ('Segoe UI', 10, 'bold')
+    root.option_add('*Font', default_font_tuple)
+    style.configure('Treeview', rowheight=28, font=default_font_tuple, borderwidth=0, relief="flat")
+    style.configure('Treeview.Heading', font=bold_font_tuple, padding=(5, 5))
+    style.configure('TButton', padding=6, font=default_font_tuple); style.configure('TLabel', padding=4, font=default_font_tuple)
+    try:
+        appearance_mode = ctk.get_appearance_mode()
+        idx = 1 if appearance_mode == "Dark" else 0
+
+        # Correção para ctk.ThemeManager.THEME_DATA (para CTk < 5.x) ou ctk.ThemeManager.get_theme() (para CTk >= 5.x)
+        theme_data = {}
+        if hasattr(ctk.ThemeManager, 'get_theme') and callable(ctk.ThemeManager.get_theme):
+            theme_name_or_path = ctk.ThemeManager.get_currently_used_theme()
+            if isinstance(theme_name_or_path, str) and os.path.exists(theme_name_or_path): # Se for um path para JSON
+                with open(theme_name_or_path, 'r') as f:
+                    theme_data = json.load(f)
+            else: # Se for um nome de tema embutido
+                theme_data = ctk.ThemeManager.get_theme(theme_name_or_path)
+        elif hasattr(ctk.ThemeManager, 'THEME_DATA'): # Para versões mais antigas
+            theme_data = ctk.ThemeManager.THEME_DATA
+
+        bg_color_tuple = theme_data.get("CTkFrame", {}).get("fg_color", ("#DBDBDB", "#2B2B2B"))
+        text_color_tuple = theme_data.get("CTkLabel", {}).get("text_color", ("#101010", "#DCE4EE"))
+
+        final_bg_color = bg_color_tuple[idx] if isinstance(bg_color_tuple, (list, tuple)) and len(bg_color_tuple) > idx else bg_color_tuple
+        final_text_color = text_color_tuple[idx] if isinstance(text_color_tuple, (list, tuple)) and len(text_color_tuple) > idx else text_color_tuple
+
+        style.configure('TScrollbar', troughcolor=final_bg_color, bordercolor=final_bg_color, arrowcolor=final_text_color, background=final_bg_color)
+    except Exception as e_style: logger.warning(f"Could not apply CTk-based styles to TScrollbar: {e_style}.")
+    root.attributes('-alpha', 1.0); root.overrideredirect(False)
+    if os.name == 'nt': WindowsAPI.apply_window_style(root)
+
+
+# Maior code point possível: "prefixo + _PREFIX_SENTINEL" é maior que qualquer atalho que comece com o prefixo.
+_PREFIX_SENTINEL = "\U0010ffff"
+
+
+def _sorted_contains(keys: Tuple[str, ...], key: str) -> bool:
+    i = bisect.bisect_left(keys, key)
+    return i < len(keys) and keys[i] == key
+
+
+def _prefix_range(keys: Tuple[str, ...], prefix: str, lo: int = 0, hi: Optional[int] = None) -> Tuple[int, int]:
+    if hi is None: hi = len(keys)
+    start = bisect.bisect_left(keys, prefix, lo, hi)
+    return start, bisect.bisect_left(keys, prefix + _PREFIX_SENTINEL, start, hi)
+
+
+class MacroLibrarySnapshot:
+    # Versão imutável da biblioteca, lida sem lock pelo hook, popup, lista e threads de injeção/recarga.
+    # A base (tupla ordenada de atalhos + dict de corpos) é compartilhada entre versões e nunca é
+    # alterada; as mutações desde o último rebase ficam num overlay pequeno:
+    #   overlay: atalhos novos ou alterados -> corpo (None quando o store não é residente)
+    #   added:   atalhos do overlay que não existem na base (tupla ordenada)
+    #   removed: atalhos da base removidos (tupla ordenada)
+    # Publicar uma mutação custa O(tamanho do overlay), não O(n).
+    __slots__ = ("version", "base_keys", "base_bodies", "overlay", "added", "removed")
+
+    def __init__(self, version: int, base_keys: Tuple[str, ...], base_bodies: Optional[Dict[str, str]],
+                 overlay: Dict[str, Optional[str]], added: Tuple[str, ...], removed: Tuple[str, ...]) -> None:
+        self.version = version
+        self.base_keys = base_keys
+        self.base_bodies = base_bodies
+        self.overlay = overlay
+        self.added = added
+        self.removed = removed
+
+    @property
+    def overlay_size(self) -> int:
+        return len(self.overlay) + len(self.removed)
+
+    def __len__(self) -> int:
+        return len(self.base_keys) - len(self.removed) + len(self.added)
+
+    def __contains__(self, key: str) -> bool:
+        if key in self.overlay: return True
+        return _sorted_contains(self.base_keys, key) and not _sorted_contains(self.removed, key)
+
+    def get_body(self, key: str) -> Optional[str]:
+        if key in self.overlay: return self.overlay[key]
+        if self.base_bodies is None or _sorted_contains(self.removed, key): return None
+        return self.base_bodies.get(key)
+
+    def ranges(self, prefix: str, within: Optional[Tuple[int, ...]] = None) -> Tuple[int, ...]:
+        # (base_lo, base_hi, added_lo, added_hi, removed_lo, removed_hi) do prefixo; `within` limita a
+        # busca às faixas de um prefixo anterior (cursor do hook).
+        blo, bhi, alo, ahi, rlo, rhi = within or (0, len(self.base_keys), 0, len(self.added), 0, len(self.removed))
+        return (_prefix_range(self.base_keys, prefix, blo, bhi) + _prefix_range(self.added, prefix, alo, ahi)
+                + _prefix_range(self.removed, prefix, rlo, rhi))
+
+    @staticmethod
+    def count_in(r: Tuple[int, ...]) -> int:
+        return (r[1] - r[0]) + (r[3] - r[2]) - (r[5] - r[4])
+
+    def count(self, prefix: str) -> int:
+        return self.count_in(self.ranges(prefix))
+
+    def _merge(self, b: int, bhi: int, a: int, ahi: int) -> Iterable[str]:
+        base = self.base_keys; removed = self.removed
+        if removed: base_iter = (base[i] for i in range(b, bhi) if not _sorted_contains(removed, base[i]))
+        else: base_iter = (base[i] for i in range(b, bhi))
+        if a >= ahi: return base_iter
+        return heapq.merge(base_iter, (self.added[j] for j in range(a, ahi)))
+
+    def matches_in(self, r: Tuple[int, ...], limit: Optional[int] = None) -> List[str]:
+        return list(itertools.islice(self._merge(r[0], r[1], r[2], r[3]), limit))
+
+    def matches(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        return self.matches_in(self.ranges(prefix), limit)
+
+    def iter_keys(self) -> Iterable[str]:
+        return self._merge(0, len(self.base_keys), 0, len(self.added))
+
+    def position(self, key: str) -> int:
+        return (bisect.bisect_left(self.base_keys, key) - bisect.bisect_left(self.removed, key)
+                + bisect.bisect_left(self.added, key))
+
+    def keys_in_range(self, lo: int, hi: int) -> List[str]:
+        # Posições na visão mesclada sem materializá-la: busca binária pelo primeiro índice da base
+        # cuja posição mesclada é >= lo e desconta os atalhos novos que ficam antes dele.
+        if hi <= lo: return []
+        base, added, removed = self.base_keys, self.added, self.removed
+        n = len(base)
+
+        def merged_position(b: int) -> int:
+            if b == n: return n - len(removed) + len(added)
+            key = base[b]
+            return b - bisect.bisect_left(removed, key) + bisect.bisect_left(added, key)
+
+        b_lo, b_hi = 0, n
+        while b_lo < b_hi:
+            mid = (b_lo + b_hi) // 2
+            if merged_position(mid) >= lo: b_hi = mid
+            else: b_lo = mid + 1
+        added_before = bisect.bisect_left(added, base[b_lo]) if b_lo < n else len(added)
+        a = max(0, added_before - (merged_position(b_lo) - lo))
+        return list(itertools.islice(self._merge(b_lo, n, a, len(added)), hi - lo))
+
+    def to_dict(self) -> Dict[str, str]:
+        # Só para stores residentes (gravação do snapshot em disco, comparação na recarga).
+        return {key: self.get_body(key) for key in self.iter_keys()}
+
+    def with_set(self, key: str, body: Optional[str]) -> "MacroLibrarySnapshot":
+        overlay = dict(self.overlay); overlay[key] = body
+        added, removed = self.added, self.removed
+        if _sorted_contains(self.base_keys, key):
+            if _sorted_contains(removed, key): removed = tuple(k for k in removed if k != key)
+        elif not _sorted_contains(added, key):
+            added_list = list(added); bisect.insort(added_list, key); added = tuple(added_list)
+        return MacroLibrarySnapshot(self.version + 1, self.base_keys, self.base_bodies, overlay, added, removed)
+
+    def with_removed(self, key: str) -> "MacroLibrarySnapshot":
+        overlay = dict(self.overlay); overlay.pop(key, None)
+        added, removed = self.added, self.removed
+        if _sorted_contains(self.base_keys, key):
+            removed_list = list(removed); bisect.insort(removed_list, key); removed = tuple(removed_list)
+        else:
+            added = tuple(k for k in added if k != key)
+        return MacroLibrarySnapshot(self.version + 1, self.base_keys, self.base_bodies, overlay, added, removed)
+
+    def rebased(self) -> "MacroLibrarySnapshot":
+        keys = tuple(self.iter_keys())
+        bodies = {key: self.get_body(key) for key in keys} if self.base_bodies is not None else None
+        return MacroLibrarySnapshot(self.version + 1, keys, bodies, {}, (), ())
+
+
+class MacroLibrary:
+    # Publica os snapshots. Escritores (thread do Tk, carga inicial) se serializam pelo lock e trocam
+    # self.snapshot numa única atribuição; leitores pegam a referência uma vez e nunca travam.
+    # Quando o overlay passa de max(MIN_REBASE, sqrt(n)) entradas, a base é refeita (O(n) amortizado).
+    MIN_REBASE = 64
+
+    def __init__(self) -> None:
+        self._write_lock = threading.Lock()
+        self.snapshot = MacroLibrarySnapshot(0, (), {}, {}, (), ())
+        self.rebases = 0
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    def __len__(self) -> int:
+        return len(self.snapshot)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.snapshot
+
+    def rebuild(self, keys: Iterable[str], bodies: Optional[Dict[str, str]]) -> None:
+        # bodies passa a pertencer ao snapshot: quem chama não pode mais alterá-lo.
+        base_keys = tuple(sorted(keys))
+        with self._write_lock:
+            self.snapshot = MacroLibrarySnapshot(self.snapshot.version + 1, base_keys, bodies, {}, (), ())
+
+    def set(self, key: str, body: Optional[str]) -> None:
+        with self._write_lock:
+            self.snapshot = self._maybe_rebase(self.snapshot.with_set(key, body))
+
+    def remove(self, key: str) -> bool:
+        with self._write_lock:
+            if key not in self.snapshot: return False
+            self.snapshot = self._maybe_rebase(self.snapshot.with_removed(key))
+            return True
+
+    def _maybe_rebase(self, snapshot: MacroLibrarySnapshot) -> MacroLibrarySnapshot:
+        if snapshot.overlay_size <= max(self.MIN_REBASE, math.isqrt(len(snapshot.base_keys))): return snapshot
+        self.rebases += 1
+        return snapshot.rebased()
+
+    def matches(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        return self.snapshot.matches(prefix, limit)
+
+    def count(self, prefix: str) -> int:
+        return self.snapshot.count(prefix)
+
+    def position(self, key: str) -> int:
+        return self.snapshot.position(key)
+
+    def keys_in_range(self, lo: int, hi: int) -> List[str]:
+        return self.snapshot.keys_in_range(lo, hi)
+
+    def cursor(self) -> "MacroLibraryCursor":
+        return MacroLibraryCursor(self)
+
+
+class MacroLibraryCursor:
+    # Acompanha o texto digitado: cada caractere estreita as faixas anteriores e o backspace
+    # apenas desempilha as faixas salvas (O(1)). Usado somente pela thread do hook de teclado.
+    def __init__(self, library: MacroLibrary) -> None:
+        self.library = library
+        self.prefix: str = ""
+        self._stack: List[Tuple[int, ...]] = []
+        self._snapshot: Optional[MacroLibrarySnapshot] = None
+
+    def reset(self, prefix: str) -> int:
+        snapshot = self.library.snapshot
+        r = snapshot.ranges(prefix)
+        self.prefix = prefix
+        self._stack = [r]
+        self._snapshot = snapshot
+        return snapshot.count_in(r)
+
+    def seek(self, prefix: str) -> int:
+        snapshot = self._snapshot
+        if snapshot is not self.library.snapshot or not self._stack:
+            return self.reset(prefix)
+        current = self.prefix
+        if prefix == current:
+            return snapshot.count_in(self._stack[-1])
+        if len(prefix) == len(current) + 1 and prefix.startswith(current):
+            r = snapshot.ranges(prefix, self._stack[-1])
+            self._stack.append(r)
+            self.prefix = prefix
+            return snapshot.count_in(r)
+        if len(prefix) == len(current) - 1 and current.startswith(prefix) and len(self._stack) > 1:
+            self._stack.pop()
+            self.prefix = prefix
+            return snapshot.count_in(self._stack[-1])
+        return self.reset(prefix)
+
+    def count(self) -> int:
+        if not self._stack: return 0
+        return self._snapshot.count_in(self._stack[-1])
+
+    def matches(self) -> List[str]:
+        if not self._stack or self._snapshot is not self.library.snapshot:
+            return self.library.matches(self.prefix)
+        return self._snapshot.matches_in(self._stack[-1])
+
+
+class MacroMatcher:
+    # Busca aproximada (subsequência) sobre um blob único "atalho\natalho\n..." dos atalhos da base do
+    # snapshot. O regex varre o blob inteiro em C e só os K melhores ficam num heap limitado. O blob
+    # só é refeito quando a base muda (carga ou rebase); os atalhos do overlay (novos ou alterados)
+    # são varridos num blob pequeno a cada busca e os removidos são ignorados.
+    BODY_PENALTY = 500.0
+
+    def __init__(self, library: MacroLibrary, first_line_getter: Optional[callable] = None) -> None:
+        self.library = library
+        self.first_line_getter = first_line_getter
+        self._base: Optional[Tuple[str, ...]] = None
+        self._blob: str = ""
+        self._offsets = array('L')
+        self._body_base: Optional[Tuple[str, ...]] = None
+        self._body_blob: str = ""
+        self._body_offsets = array('L')
+
+    @staticmethod
+    def _build_blob(lines: List[str]):
+        offsets = array('L'); pos = 0
+        for line in lines:
+            offsets.append(pos); pos += len(line) + 1
+        return "\n".join(lines).lower() + "\n", offsets
+
+    def _body_lines(self, keys: Iterable[str]) -> List[str]:
+        # Quebras de linha extras no corpo iriam desalinhar as linhas do blob.
+        return [self.first_line_getter(k).replace("\n", " ") for k in keys]
+
+    def _ensure_built(self, snapshot: MacroLibrarySnapshot, include_body: bool) -> None:
+        base = snapshot.base_keys
+        if self._base is not base:
+            self._blob, self._offsets = self._build_blob(base)
+            self._base = base
+        if include_body and self._body_base is not base and self.first_line_getter:
+            self._body_blob, self._body_offsets = self._build_blob(self._body_lines(base))
+            self._body_base = base
+
+    @staticmethod
+    def _subsequence_pattern(query: str) -> "re.Pattern":
+        # "a[^b\n]*b[^c\n]*c": as classes negadas tornam o casamento linear (sem backtracking),
+        # não atravessam linhas e deixam o re usar a busca rápida pelo primeiro literal.
+        parts = [re.escape(query[0])]
+        for ch in query[1:]:
+            parts.append("[^\\n" + ("\\" + ch if ch in "\\]^-[" else ch) + "]*" + re.escape(ch))
+        return re.compile("".join(parts))
+
+    def _scan(self, pattern, query_len: int, blob: str, offsets, keys, skip: set, penalty: float, heap: list, seen: set, limit: int) -> None:
+        bisect_right = bisect.bisect_right; heappush = heapq.heappush; heapreplace = heapq.heapreplace
+        last = len(offsets) - 1; blob_len = len(blob)
+        for match in pattern.finditer(blob):
+            start = match.start()
+            i = bisect_right(offsets, start) - 1
+            key = keys[i]
+            if key in skip or key in seen: continue
+            seen.add(key)
+            line_start = offsets[i]
+            line_len = (offsets[i + 1] if i < last else blob_len) - line_start - 1
+            inner_gaps = match.end() - start - query_len
+            score = 1000.0 - 10.0 * (start - line_start) - 5.0 * inner_gaps - 0.5 * line_len - penalty
+            if inner_gaps == 0: score += 300.0
+            entry = (score, -i, key)
+            if len(heap) < limit: heappush(heap, entry)
+            elif entry > heap[0]: heapreplace(heap, entry)
+
+    def search(self, query: str, limit: int = 100, include_body: bool = False) -> List[str]:
+        # Prefixos exatos vêm primeiro, em ordem alfabética (direto do snapshot); o restante das
+        # K vagas é preenchido pelas melhores correspondências aproximadas.
+        snapshot = self.library.snapshot
+        r = snapshot.ranges(query)
+        if snapshot.count_in(r) >= limit or not query.strip("/"):
+            return snapshot.matches_in(r, limit)
+        results = snapshot.matches_in(r)
+        self._ensure_built(snapshot, include_body)
+        heap: list = []; seen: set = set(); remaining = limit - len(results)
+        exact = set(results)
+        # Atalhos do overlay são varridos à parte (texto atual); removidos não aparecem.
+        base_skip = exact.union(snapshot.removed, snapshot.overlay)
+        overlay_keys = sorted(snapshot.overlay)
+        # Todo atalho começa com "/", então só o restante da consulta é casado aproximadamente.
+        fuzzy_query = query.lower().lstrip("/")
+        pattern = self._subsequence_pattern(fuzzy_query)
+        self._scan(pattern, len(fuzzy_query), self._blob, self._offsets, self._base, base_skip, 0.0, heap, seen, remaining)
+        if overlay_keys:
+            blob, offsets = self._build_blob(overlay_keys)
+            self._scan(pattern, len(fuzzy_query), blob, offsets, overlay_keys, exact, 0.0, heap, seen, remaining)
+        if include_body and self.first_line_getter:
+            self._scan(pattern, len(fuzzy_query), self._body_blob, self._body_offsets, self._body_base, base_skip, self.BODY_PENALTY, heap, seen, remaining)
+            if overlay_keys:
+                blob, offsets = self._build_blob(self._body_lines(overlay_keys))
+                self._scan(pattern, len(fuzzy_query), blob, offsets, overlay_keys, exact, self.BODY_PENALTY, heap, seen, remaining)
+        results.extend(key for _, _, key in sorted(heap, reverse=True))
+        return results
+
+
+class SuggestionCommandQueue:
+    # Canal entre a thread do hook e a thread do Tk. Comandos consecutivos são fundidos:
+    # "update" mantém só o filtro mais novo (e descarta navegações anteriores, pois o update
+    # reseta a seleção) e "navigate" soma os deslocamentos. O Tk drena a fila uma vez por frame.
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pending: List[list] = []
+        self.enqueued: int = 0
+        self.merged: int = 0
+        self.dropped: int = 0
+        self.drains: int = 0
+
+    def put(self, command: str, data: Optional[Any] = None) -> None:
+        with self._lock:
+            self.enqueued += 1
+            pending = self._pending
+            if command in ("update", "hide"):
+                while pending and pending[-1][0] == "navigate":
+                    pending.pop(); self.dropped += 1
+            if pending:
+                last = pending[-1]
+                if command == "navigate" and last[0] == "navigate":
+                    last[1] += data; self.merged += 1; return
+                if command == "update" and last[0] in ("update", "show"):
+                    last[1] = data; self.merged += 1; return
+                if command == "hide" and last[0] == "update":
+                    pending.pop(); self.dropped += 1
+            pending.append([command, data])
+
+    def drain(self) -> List[list]:
+        with self._lock:
+            if not self._pending: return []
+            items, self._pending = self._pending, []
+            self.drains += 1
+            return items
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"enqueued": self.enqueued, "merged": self.merged, "dropped": self.dropped,
+                    "drains": self.drains, "pending": len(self._pending)}
+
+
+_MODIFIER_KEYS = frozenset({"ctrl", "alt", "shift", "left ctrl", "right ctrl", "left alt", "right alt", "left shift", "right shift", "caps lock", "cmd", "option", "windows"})
+_HOTKEY_COMPONENT_KEYS = frozenset({"ctrl", "left ctrl", "right ctrl", "space", "alt", "left alt", "right alt", "shift", "left shift", "right shift"})
+_DIRECT_MODE_IGNORED_KEYS = _HOTKEY_COMPONENT_KEYS | {"caps lock", "esc", "cmd", "option", "windows"}
+_SELECTION_KEYS = frozenset({"space", "enter", "tab"})
+_NAVIGATION_DELTAS = {"up": -1, "down": 1}
+
+
+class LatencyHistogram:
+    # Histograma de buckets fixos (em microssegundos); record() não aloca nada além do float recebido.
+    BOUNDS_US = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._bounds = tuple(b / 1_000_000 for b in self.BOUNDS_US)
+        self.counts = [0] * (len(self._bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self._bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max: self.max = seconds
+
+    def percentile_us(self, fraction: float) -> Optional[float]:
+        if not self.count: return None
+        target = fraction * self.count; seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return float(self.BOUNDS_US[i]) if i < len(self.BOUNDS_US) else self.max * 1_000_000
+        return self.max * 1_000_000
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "name": self.name, "count": self.count,
+            "mean_us": (self.total / self.count * 1_000_000) if self.count else None,
+            "p50_us": self.percentile_us(0.50), "p99_us": self.percentile_us(0.99),
+            "max_us": self.max * 1_000_000,
+            "buckets_us": {(f"<={b}" if i < len(self.BOUNDS_US) else f">{self.BOUNDS_US[-1]}"): n
+                           for i, (b, n) in enumerate(zip(self.BOUNDS_US + (None,), self.counts))},
+        }
+
+
+class MetricCounter:
+    __slots__ = ("name", "value")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class MetricGauge:
+    __slots__ = ("name", "value")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.value: Optional[float] = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _NullMetric:
+    # Devolvido pelo registro desativado: os pontos de instrumentação chamam inc/set/record sem testar nada.
+    __slots__ = ()
+    name = "null"
+
+    def inc(self, amount: int = 1) -> None: pass
+    def set(self, value: float) -> None: pass
+    def record(self, seconds: float) -> None: pass
+
+
+_NULL_METRIC = _NullMetric()
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class MetricsRegistry:
+    # Contadores, gauges e histogramas (LatencyHistogram) em processo. Desativado, counter/gauge/
+    # histogram devolvem um objeto compartilhado sem efeito e timer() um nullcontext reutilizado, de
+    # modo que o custo no caminho quente é uma chamada vazia. Os objetos são criados uma vez e
+    # guardados por quem instrumenta; só a criação passa pelo lock. Métricas registradas com
+    # add_histogram (latências que o manager já mede sempre) entram no snapshot mesmo desativado.
+    EXPORT_FILE_NAME = "metrics.json"
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: Dict[str, MetricCounter] = {}
+        self._gauges: Dict[str, MetricGauge] = {}
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._collectors: Dict[str, callable] = {}
+        self.started_at = time.time()
+
+    def _get(self, table: Dict[str, Any], name: str, factory: callable):
+        with self._lock:
+            metric = table.get(name)
+            if metric is None: metric = table[name] = factory(name)
+            return metric
+
+    def counter(self, name: str):
+        return self._get(self._counters, name, MetricCounter) if self.enabled else _NULL_METRIC
+
+    def gauge(self, name: str):
+        return self._get(self._gauges, name, MetricGauge) if self.enabled else _NULL_METRIC
+
+    def histogram(self, name: str):
+        return self._get(self._histograms, name, LatencyHistogram) if self.enabled else _NULL_METRIC
+
+    def add_histogram(self, histogram: LatencyHistogram) -> LatencyHistogram:
+        with self._lock: self._histograms[histogram.name] = histogram
+        return histogram
+
+    def add_collector(self, name: str, collector: callable) -> None:
+        # collector() -> dict, chamado só na exportação (estatísticas que já existem em outros objetos).
+        with self._lock: self._collectors[name] = collector
+
+    @contextlib.contextmanager
+    def _timed(self, histogram: LatencyHistogram):
+        start = time.perf_counter()
+        try: yield
+        finally: histogram.record(time.perf_counter() - start)
+
+    def timer(self, name: str):
+        if not self.enabled: return _NULL_TIMER
+        return self._timed(self.histogram(name))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {name: c.value for name, c in self._counters.items()}
+            gauges = {name: g.value for name, g in self._gauges.items()}
+            histograms = list(self._histograms.values())
+            collectors = list(self._collectors.items())
+        collected: Dict[str, Any] = {}
+        for name, collector in collectors:
+            try: collected[name] = collector()
+            except Exception as e: collected[name] = {"error": str(e)}
+        return {"enabled": self.enabled, "timestamp": time.time(), "uptime_seconds": round(time.time() - self.started_at, 1),
+                "counters": counters, "gauges": gauges, "histograms": {h.name: h.summary() for h in histograms},
+                "collectors": collected}
+
+    def render_text(self) -> str:
+        # Uma linha "nome valor" por série (estilo Prometheus), fácil de ler com curl/grep.
+        snap = self.snapshot(); lines = []
+        for name, value in sorted(snap["counters"].items()): lines.append(f"{name} {value}")
+        for name, value in sorted(snap["gauges"].items()): lines.append(f"{name} {value if value is not None else 'nan'}")
+        for name, summary in sorted(snap["histograms"].items()):
+            for field in ("count", "mean_us", "p50_us", "p99_us", "max_us"):
+                value = summary[field]
+                lines.append(f"{name}_{field} {round(value, 3) if value is not None else 'nan'}")
+        for name, stats in sorted(snap["collectors"].items()):
+            if isinstance(stats, dict):
+                for field, value in sorted(stats.items()):
+                    if isinstance(value, (int, float)): lines.append(f"{name}_{field} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, directory: Optional[str] = None) -> str:
+        path = os.path.join(directory or get_user_data_dir(), self.EXPORT_FILE_NAME)
+        _write_json_atomic(path, self.snapshot(), indent=2)
+        logger.info(f"Métricas exportadas para {path}")
+        return path
+
+
+class MetricsServer:
+    # Endpoint HTTP só em 127.0.0.1: GET /metrics (texto) e GET /metrics.json. Thread própria, daemon.
+    def __init__(self, registry: MetricsRegistry, port: int) -> None:
+        self.registry = registry
+        self.port = port
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> bool:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path in ("/", "/metrics"): body, content_type = registry.render_text(), "text/plain; charset=utf-8"
+                elif path == "/metrics.json": body, content_type = json.dumps(registry.snapshot(), ensure_ascii=False), "application/json"
+                else: self.send_error(404); return
+                payload = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                logger.debug("MetricsServer: " + format, *args)
+
+        try:
+            self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        except OSError as e:
+            logger.error(f"Não foi possível abrir o endpoint de métricas na porta {self.port}: {e}")
+            return False
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MetricsServerThread", daemon=True)
+        self._thread.start()
+        logger.info(f"Endpoint de métricas em http://127.0.0.1:{self.port}/metrics")
+        return True
+
+    def stop(self) -> None:
+        if self._server is None: return
+        self._server.shutdown(); self._server.server_close(); self._server = None
+        if self._thread is not None: self._thread.join(timeout=1.0)
+
+
+class InjectionJob:
+    # Uma expansão pendente: apagar N caracteres, colar o corpo e restaurar o estado, com tempos por etapa.
+    _ids = itertools.count(1)
+    __slots__ = ("job_id", "macro_key", "text", "chars_to_delete", "hide_popup_first", "backend",
+                 "enqueued_at", "started_at", "finished_at", "stages", "ok", "error")
+
+    def __init__(self, macro_key: str, text: Optional[str], chars_to_delete: int, hide_popup_first: bool) -> None:
+        self.job_id = next(self._ids)
+        self.macro_key = macro_key
+        self.text = text
+        self.chars_to_delete = chars_to_delete
+        self.hide_popup_first = hide_popup_first
+        self.backend: Optional[str] = None
+        self.enqueued_at = time.perf_counter()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+        self.ok = False
+        self.error: Optional[str] = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try: yield
+        finally: self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def total_seconds(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.enqueued_at
+
+    def stage_summary(self) -> Dict[str, float]:
+        summary = {"queued": round(((self.started_at or self.enqueued_at) - self.enqueued_at) * 1000, 2)}
+        summary.update({name: round(seconds * 1000, 2) for name, seconds in self.stages.items()})
+        return summary
+
+
+class InjectionBackend:
+    # Interface dos backends de injeção: apagar o atalho digitado e inserir o corpo da macro.
+    name = "base"
+
+    def delete_chars(self, count: int, job: Optional[InjectionJob] = None) -> None:
+        raise NotImplementedError
+
+    def insert_text(self, text: str, job: Optional[InjectionJob] = None) -> None:
+        raise NotImplementedError
+
+    @staticmethod
+    def _stage(job: Optional[InjectionJob], name: str):
+        return job.stage(name) if job is not None else contextlib.nullcontext()
+
+
+class KeyboardInjectionBackend(InjectionBackend):
+    def delete_chars(self, count: int, job: Optional[InjectionJob] = None) -> None:
+        with self._stage(job, "delete"):
+            for _ in range(count):
+                keyboard.send("backspace")
+
+
+class TypingInjectionBackend(KeyboardInjectionBackend):
+    # Digita o texto diretamente: sem área de transferência e sem pausas fixas.
+    name = "typing"
+
+    def insert_text(self, text: str, job: Optional[InjectionJob] = None) -> None:
+        with self._stage(job, "type"): keyboard.write(text, delay=0)
+
+
+class DeferredClipboardRestore:
+    # Salva/restaura a área de transferência do usuário fora do caminho crítico da expansão:
+    # - se uma restauração ainda está pendente e a área de transferência continua com o que
+    #   colamos, o original salvo continua valendo e as restaurações seguidas viram uma só (se o
+    #   usuário copiou algo nesse meio tempo, é isso que passa a ser restaurado);
+    # - se a área de transferência já contém o texto da macro, não há cópia nem restauração;
+    # - a restauração roda num Timer e só sobrescreve se o conteúdo ainda for o que colamos; um
+    #   Timer cancelado tarde demais (já esperando o lock) é descartado pela geração.
+    def __init__(self, paste: Optional[callable] = None, copy: Optional[callable] = None, restore_delay: float = 0.3) -> None:
+        self._paste = paste or (lambda: pyperclip.paste())
+        self._copy = copy or (lambda text: pyperclip.copy(text))
+        self.restore_delay = restore_delay
+        self._lock = threading.Lock()
+        self._saved: Optional[str] = None
+        self._owned_text: Optional[str] = None
+        self._timer: Optional[threading.Timer] = None
+        self._generation = 0
+        self.stats: Dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def _same(a: Optional[str], b: Optional[str]) -> bool:
+        # hash() de str é calculado uma vez e fica em cache no objeto; comprimento primeiro evita comparar payloads grandes.
+        return a is not None and b is not None and len(a) == len(b) and hash(a) == hash(b) and a == b
+
+    def put(self, text: str, job: Optional[InjectionJob] = None) -> bool:
+        # Coloca 'text' na área de transferência. Retorna True se houve cópia de fato.
+        with self._lock:
+            pending = self._cancel_timer_locked() and self._owned_text is not None
+            with InjectionBackend._stage(job, "clipboard_save"): current = self._paste()
+            if pending and self._same(current, self._owned_text):
+                self.stats["restores_coalesced"] += 1
+                if self._same(current, text):
+                    self.stats["copies_skipped"] += 1
+                    return False
+            else:
+                self.stats["snapshots"] += 1
+                if self._same(current, text):
+                    self.stats["copies_skipped"] += 1
+                    self._saved = None; self._owned_text = None
+                    return False
+                self._saved = current
+            with InjectionBackend._stage(job, "clipboard_copy"): self._copy(text)
+            self._owned_text = text
+            return True
+
+    def user_text(self) -> str:
+        # Conteúdo do usuário: com uma restauração pendente, a área de transferência ainda tem a macro
+        # anterior e o original é o que foi salvo.
+        with self._lock:
+            if self._timer is not None and self._owned_text is not None and self._saved is not None: return self._saved
+        return self._paste()
+
+    def schedule_restore(self) -> None:
+        with self._lock:
+            self._cancel_timer_locked()
+            if self._owned_text is None: return
+            self._timer = threading.Timer(self.restore_delay, self._restore, args=(self._generation,))
+            self._timer.name = "ClipboardRestoreTimer"; self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> None:
+        with self._lock: pending = self._cancel_timer_locked()
+        if pending: self._restore()
+
+    def _cancel_timer_locked(self) -> bool:
+        if self._timer is None: return False
+        self._timer.cancel(); self._timer = None
+        self._generation += 1
+        return True
+
+    def _restore(self, generation: Optional[int] = None) -> None:
+        # generation None: chamada direta (flush), já com o Timer cancelado.
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                self.stats["restores_stale"] += 1
+                return
+            self._timer = None
+            saved, owned = self._saved, self._owned_text
+            self._saved = None; self._owned_text = None
+            if owned is None or saved is None: return
+            try:
+                if not self._same(self._paste(), owned):
+                    # O usuário copiou outra coisa enquanto a restauração estava pendente: não sobrescrever.
+                    self.stats["restores_skipped"] += 1
+                    return
+                self._copy(saved)
+                self.stats["restores"] += 1
+            except Exception as e:
+                logger.error("Failed to restore clipboard content: %s", e, exc_info=True)
+
+
+class ClipboardInjectionBackend(KeyboardInjectionBackend):
+    name = "clipboard"
+
+    def __init__(self, clipboard: Optional[DeferredClipboardRestore] = None) -> None:
+        self.clipboard = clipboard or DeferredClipboardRestore()
+
+    def insert_text(self, text: str, job: Optional[InjectionJob] = None) -> None:
+        time.sleep(0.05) # Pequena pausa após backspaces
+        if self.clipboard.put(text, job):
+            time.sleep(0.05) # Pausa para garantir que a cópia foi processada
+        # Colar (Ctrl+V ou Cmd+V); a restauração do conteúdo original fica para depois, em segundo plano.
+        with self._stage(job, "paste"):
+            keyboard.send("command+v" if sys.platform == "darwin" else "ctrl+v")
+        self.clipboard.schedule_restore()
+
+
+class FakeInjectionBackend(InjectionBackend):
+    # Backend sem efeitos colaterais (testes/benchmarks): registra as operações, mantém o texto
+    # resultante em self.buffer e pode simular o custo de cada evento de tecla/área de transferência.
+    def __init__(self, name: str = "fake", key_event_cost: float = 0.0, insert_cost: float = 0.0, per_char_cost: float = 0.0) -> None:
+        self.name = name
+        self.key_event_cost = key_event_cost
+        self.insert_cost = insert_cost
+        self.per_char_cost = per_char_cost
+        self.ops: List[Tuple[str, Any]] = []
+        self.buffer: str = ""
+
+    def type_keys(self, text: str) -> None:
+        self.buffer += text
+
+    def delete_chars(self, count: int, job: Optional[InjectionJob] = None) -> None:
+        with self._stage(job, "delete"):
+            self.ops.append(("delete", count))
+            self.buffer = self.buffer[:-count] if count else self.buffer
+            if self.key_event_cost: time.sleep(self.key_event_cost * count)
+
+    def insert_text(self, text: str, job: Optional[InjectionJob] = None) -> None:
+        with self._stage(job, "insert"):
+            self.ops.append(("insert", text))
+            self.buffer += text
+            cost = self.insert_cost + self.per_char_cost * len(text)
+            if cost: time.sleep(cost)
+
+
+class HybridInjectionPolicy:
+    # Corpos curtos, de uma linha e só com caracteres imprimíveis são digitados; os demais
+    # (longos ou com várias linhas) vão pela área de transferência. Corpos com "/" também: as
+    # teclas do keyboard.write voltam pelo hook de forma assíncrona, depois que a flag de
+    # aplicação já foi desligada, e um "/atalho " digitado seria expandido de novo.
+    def __init__(self, typing_backend: InjectionBackend, clipboard_backend: InjectionBackend, max_typed_chars: int = 40) -> None:
+        self.typing_backend = typing_backend
+        self.clipboard_backend = clipboard_backend
+        self.max_typed_chars = max_typed_chars
+
+    def choose(self, text: str) -> InjectionBackend:
+        if len(text) <= self.max_typed_chars and text.isprintable() and "/" not in text:
+            return self.typing_backend
+        return self.clipboard_backend
+
+
+class MacroInjectionWorker:
+    # Thread própria para as expansões: os jobs são executados em ordem, um de cada vez, e o
+    # resultado volta ao MacroManager por on_complete (chamado nesta mesma thread).
+    def __init__(self, execute: callable, on_complete: callable, history_size: int = 50) -> None:
+        self._execute = execute
+        self._on_complete = on_complete
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._pending_lock = threading.Lock()
+        self._pending: int = 0
+        self.submitted: int = 0
+        self.completed: int = 0
+        self.failed: int = 0
+        self.recent_jobs: "deque[InjectionJob]" = deque(maxlen=history_size)
+        self._thread = threading.Thread(target=self._run, name="MacroInjectionThread", daemon=True)
+        self._thread.start()
+
+    def submit(self, job: InjectionJob) -> None:
+        with self._pending_lock: self._pending += 1; self.submitted += 1
+        self._queue.put(job)
+
+    def has_pending(self) -> bool:
+        # Chamado de dentro de on_complete: o job atual ainda conta como pendente.
+        with self._pending_lock: return self._pending > 1
+
+    def stop(self, timeout: float = 2.0) -> None:
+        self._queue.put(None)
+        if self._thread.is_alive() and threading.current_thread() is not self._thread:
+            self._thread.join(timeout=timeout)
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None: break
+            job.started_at = time.perf_counter()
+            try:
+                self._execute(job)
+            except Exception as e:
+                job.error = str(e)
+                logger.error("Error during macro application keyboard events: %s", e, exc_info=True)
+            job.finished_at = time.perf_counter()
+            if job.ok: self.completed += 1
+            else: self.failed += 1
+            self.recent_jobs.append(job)
+            try: self._on_complete(job)
+            except Exception as e: logger.error("Error in injection completion callback: %s", e, exc_info=True)
+            finally:
+                with self._pending_lock: self._pending -= 1
+
+
+class MacroStore:
+    # Interface dos formatos de armazenamento da biblioteca de macros.
+    # resident=True: load() devolve todas as macros e o manager mantém os corpos em memória.
+    # resident=False: load_keys() devolve só os gatilhos e os corpos são lidos sob demanda (get_body).
+    name = "base"
+    resident = True
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def load(self) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def load_keys(self) -> List[str]:
+        return list(self.load().keys())
+
+    def get_body(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def get_preview(self, key: str, max_chars: int) -> str:
+        return (self.get_body(key) or "")[:max_chars]
+
+    def put(self, key: str, text: str) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def put_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        # Lote (importação): os stores sobrescrevem para gravar tudo de uma vez.
+        for key, text in items: self.put(key, text)
+
+    def write_snapshot(self, data: Dict[str, str]) -> None:
+        raise NotImplementedError
+
+    def needs_compaction(self) -> bool:
+        return False
+
+    def compact_in_background(self, get_data: callable) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class PreviewCache:
+    # Primeira linha de cada macro (até MAX_CHARS), calculada uma vez por versão do corpo e
+    # compartilhada pelo popup (40 caracteres), pela lista principal (60) e pela busca no corpo.
+    # Só as mutações da própria macro (invalidate) ou uma recarga completa (clear) a descartam.
+    # Uma leitura que cruzou com uma invalidação (geração mudou durante o loader) não é guardada;
+    # assim não há estado por atalho fora das entradas, que são limitadas por capacity.
+    MAX_CHARS = 120
+
+    def __init__(self, loader: callable, capacity: int = 50000) -> None:
+        self.loader = loader
+        self.capacity = capacity
+        self._entries: Dict[str, str] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, max_chars: int = MAX_CHARS) -> str:
+        line = self._entries.get(key)
+        if line is not None:
+            self.hits += 1
+            return line[:max_chars]
+        self.misses += 1
+        generation = self._generation
+        line = self.loader(key, self.MAX_CHARS)
+        if generation == self._generation:
+            if key not in self._entries and len(self._entries) >= self.capacity: self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = line
+        return line[:max_chars]
+
+    def invalidate(self, key: str) -> None:
+        self._generation += 1
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_TEMPLATE_TOKEN = re.compile(r"\{\{|\}\}|\{(date|time|clipboard|input)(?::([^{}\n]*))?\}")
+
+
+class MacroTemplate:
+    # Plano de renderização de um corpo com placeholders: tupla de partes, cada uma um literal (str)
+    # ou (tipo, argumento). Renderizar é só um join, sem reanalisar o corpo.
+    #   {date} / {date:%Y-%m-%d}   data atual (padrão %d/%m/%Y)
+    #   {time} / {time:%H:%M:%S}   hora atual (padrão %H:%M)
+    #   {clipboard}                conteúdo da área de transferência do usuário
+    #   {input:Nome}               valor pedido ao usuário na hora da expansão (mesmo nome = mesmo valor)
+    #   {{ e }}                    chaves literais
+    # Um corpo só é template se tiver ao menos um placeholder conhecido; os demais (com ou sem chaves)
+    # continuam sendo colados exatamente como estão.
+    __slots__ = ("parts", "inputs", "uses_clipboard")
+    DEFAULT_FORMATS = {"date": "%d/%m/%Y", "time": "%H:%M"}
+
+    def __init__(self, parts: Tuple[Any, ...]) -> None:
+        self.parts = parts
+        names = [part[1] for part in parts if not isinstance(part, str) and part[0] == "input"]
+        self.inputs: Tuple[str, ...] = tuple(dict.fromkeys(names))
+        self.uses_clipboard = any(not isinstance(part, str) and part[0] == "clipboard" for part in parts)
+
+    @classmethod
+    def compile(cls, body: str) -> Optional["MacroTemplate"]:
+        if "{" not in body: return None
+        parts: List[Any] = []; literal: List[str] = []; pos = 0; has_placeholder = False
+        for match in _TEMPLATE_TOKEN.finditer(body):
+            literal.append(body[pos:match.start()]); pos = match.end()
+            kind = match.group(1)
+            if kind is None:
+                literal.append(match.group(0)[0]); continue
+            if kind == "input" and not (match.group(2) or "").strip():
+                literal.append(match.group(0)); continue
+            has_placeholder = True
+            text = "".join(literal); literal = []
+            if text: parts.append(text)
+            arg = match.group(2)
+            if kind == "input": arg = arg.strip()
+            elif kind in cls.DEFAULT_FORMATS: arg = arg or cls.DEFAULT_FORMATS[kind]
+            parts.append((kind, arg))
+        if not has_placeholder: return None
+        literal.append(body[pos:])
+        if any(literal): parts.append("".join(literal))
+        return cls(tuple(parts))
+
+    def render(self, clipboard: Optional[callable] = None, inputs: Optional[Dict[str, str]] = None, now: Optional[Any] = None) -> str:
+        import datetime
+        now = now or datetime.datetime.now()
+        inputs = inputs or {}
+        clipboard_text = (clipboard() or "") if self.uses_clipboard and clipboard else ""
+        out = []
+        for part in self.parts:
+            if isinstance(part, str): out.append(part); continue
+            kind, arg = part
+            if kind == "input": out.append(inputs.get(arg, ""))
+            elif kind == "clipboard": out.append(clipboard_text)
+            else: out.append(now.strftime(arg))
+        return "".join(out)
+
+
+class TemplateCache:
+    # Planos compilados por atalho. A validade é o próprio objeto str do corpo: o snapshot da
+    # biblioteca (e o BodyCache) devolvem o mesmo objeto até a macro ser editada, então conferir
+    # a versão é um "is". Corpos sem "{" nem chegam a ser analisados; os analisados que não são
+    # template ficam registrados com plano None para não serem analisados de novo.
+    def __init__(self, capacity: int = 50000) -> None:
+        self.capacity = capacity
+        self._entries: Dict[str, Tuple[str, Optional[MacroTemplate]]] = {}
+        self.compiles = 0
+        self.hits = 0
+
+    def get(self, key: str, body: str) -> Optional[MacroTemplate]:
+        if "{" not in body: return None
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is body:
+            self.hits += 1
+            return entry[1]
+        return self._compile(key, body)
+
+    def _compile(self, key: str, body: str) -> Optional[MacroTemplate]:
+        plan = MacroTemplate.compile(body)
+        self.compiles += 1
+        if key not in self._entries and len(self._entries) >= self.capacity: self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (body, plan)
+        return plan
+
+    def prime(self, items: Iterable[Tuple[str, str]]) -> int:
+        # Compila de uma vez os corpos com chaves (carga da biblioteca / edição). Retorna quantos são templates.
+        templates = 0
+        for key, body in items:
+            if body and "{" in body and self._compile(key, body) is not None: templates += 1
+        return templates
+
+    def discard(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class BodyCache:
+    # LRU limitado dos corpos lidos sob demanda (stores não residentes).
+    def __init__(self, capacity: int = 256) -> None:
+        self.capacity = capacity
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key: str, body: str) -> None:
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity: self._entries.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        with self._lock: self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock: self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+@contextlib.contextmanager
+def _atomic_writer(path: str, newline: Optional[str] = None):
+    # Grava num temporário no mesmo diretório e troca com os.replace: um crash no meio da escrita
+    # nunca deixa o arquivo final truncado.
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline=newline) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+
+
+def _write_json_atomic(path: str, data: Any, indent: Optional[int] = 4) -> None:
+    with _atomic_writer(path) as f: json.dump(data, f, ensure_ascii=False, indent=indent)
+
+
+class JsonMacroStore(MacroStore):
+    # expansions.json (snapshot) + expansions.json.journal (uma mutação por linha, só acrescentada).
+    # Cada edição custa um append; a compactação regrava o snapshot em segundo plano: o journal
+    # atual é renomeado para .compacting (novas mutações vão para um journal novo), o snapshot é
+    # gravado de forma atômica e o .compacting é apagado. O replay é idempotente, então um crash
+    # em qualquer ponto só repete mutações já aplicadas.
+    name = "json"
+    resident = True
+    JOURNAL_SUFFIX = ".journal"
+    COMPACTING_SUFFIX = ".journal.compacting"
+
+    def __init__(self, path: str, compact_after: int = 500) -> None:
+        super().__init__(path)
+        self.journal_path = path + self.JOURNAL_SUFFIX
+        self.compacting_path = path + self.COMPACTING_SUFFIX
+        self.compact_after = compact_after
+        self._lock = threading.RLock()
+        self._journal_file = None
+        self._journal_entries = 0
+        self._compaction_thread: Optional[threading.Thread] = None
+        # Incrementado a cada snapshot síncrono: uma compactação que começou antes descarta o seu.
+        self._snapshot_generation = 0
+        # (mtime, tamanho) da última gravação feita por nós, para o watcher ignorar as próprias escritas.
+        self.last_write_signature: Optional[Tuple[int, int]] = None
+
+    def load(self, strict: bool = False) -> Dict[str, str]:
+        # strict=True (recarga a quente): JSON inválido gera exceção em vez de virar biblioteca vazia.
+        with self._lock:
+            data: Dict[str, str] = {}
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if not isinstance(data, dict): raise json.JSONDecodeError("top-level value is not an object", "", 0)
+            except json.JSONDecodeError as e:
+                if strict: raise
+                backup_path = f"{self.path}.corrupt-{time.strftime('%Y%m%d-%H%M%S')}"
+                logger.error(f"JSON inválido em {self.path} ({e}). Cópia preservada em {backup_path}; carregando apenas o journal.")
+                try: shutil.copy2(self.path, backup_path)
+                except OSError as e_backup: logger.error(f"Falha ao preservar {self.path}: {e_backup}")
+                data = {}
+            replayed = self._replay(self.compacting_path, data) + self._replay(self.journal_path, data)
+            self._journal_entries = replayed
+            if replayed: logger.info(f"Replayed {replayed} journal entries over {self.path}")
+            return data
+
+    @staticmethod
+    def _replay(journal_path: str, data: Dict[str, Optional[str]], keep_tombstones: bool = False) -> int:
+        if not os.path.exists(journal_path): return 0
+        applied = 0
+        with open(journal_path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip(): continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Linha incompleta (crash durante o append): só essa entrada é perdida.
+                    logger.warning(f"Entrada inválida na linha {line_number} de {journal_path}; ignorando.")
+                    continue
+                op = entry.get("op")
+                if op == "set": data[entry["key"]] = entry["text"]
+                elif op == "del":
+                    if keep_tombstones: data[entry["key"]] = None
+                    else: data.pop(entry["key"], None)
+                applied += 1
+        return applied
+
+    def _append(self, entry: Dict[str, str]) -> None:
+        self._append_many((entry,))
+
+    def _append_many(self, entries: Iterable[Dict[str, str]]) -> None:
+        with self._lock:
+            if self._journal_file is None:
+                needs_newline = False
+                if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > 0:
+                    # Se o último append foi interrompido, fecha a linha antes de acrescentar a próxima.
+                    with open(self.journal_path, "rb") as f:
+                        f.seek(-1, os.SEEK_END)
+                        needs_newline = f.read(1) != b"\n"
+                self._journal_file = open(self.journal_path, "a", encoding="utf-8")
+                if needs_newline: self._journal_file.write("\n")
+            lines = [json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries]
+            self._journal_file.write("".join(lines))
+            self._journal_file.flush()
+            self._journal_entries += len(lines)
+
+    def put(self, key: str, text: str) -> None:
+        self._append({"op": "set", "key": key, "text": text})
+
+    def delete(self, key: str) -> None:
+        self._append({"op": "del", "key": key})
+
+    def put_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        self._append_many({"op": "set", "key": key, "text": text} for key, text in items)
+
+    def needs_compaction(self) -> bool:
+        return self._journal_entries >= self.compact_after
+
+    def write_snapshot(self, data: Dict[str, str]) -> None:
+        # Snapshot completo e síncrono: o journal deixa de ser necessário.
+        with self._lock:
+            _write_json_atomic(self.path, data)
+            self._snapshot_generation += 1
+            self.last_write_signature = _file_signature(self.path)
+            self._close_journal()
+            for path in (self.journal_path, self.compacting_path):
+                try: os.remove(path)
+                except FileNotFoundError: pass
+            self._journal_entries = 0
+
+    def compact_in_background(self, get_data: callable) -> None:
+        with self._lock:
+            if self._compaction_thread and self._compaction_thread.is_alive(): return
+            self._compaction_thread = threading.Thread(target=self.compact, args=(get_data,), name="JournalCompactionThread", daemon=True)
+            self._compaction_thread.start()
+
+    def compact(self, get_data: callable) -> None:
+        with self._lock:
+            if os.path.exists(self.compacting_path):
+                # Compactação anterior interrompida: junta o journal atual ao .compacting pendente.
+                self._close_journal()
+                if os.path.exists(self.journal_path):
+                    with open(self.journal_path, "r", encoding="utf-8") as src, open(self.compacting_path, "a", encoding="utf-8") as dst:
+                        shutil.copyfileobj(src, dst)
+                    os.remove(self.journal_path)
+            elif os.path.exists(self.journal_path):
+                self._close_journal()
+                os.replace(self.journal_path, self.compacting_path)
+            else:
+                return
+            data = dict(get_data())
+            self._journal_entries = 0
+            generation = self._snapshot_generation
+        new_path = self.path + ".compact"
+        try:
+            start = time.perf_counter()
+            # A serialização (a parte cara) fica fora do lock; a troca do arquivo, não: um
+            # write_snapshot feito nesse meio tempo é mais novo e já apagou o .compacting.
+            _write_json_atomic(new_path, data)
+            with self._lock:
+                if generation != self._snapshot_generation:
+                    os.remove(new_path)
+                    logger.info(f"Compactação de {self.path} descartada: um snapshot mais novo foi gravado durante ela.")
+                    return
+                os.replace(new_path, self.path)
+                self.last_write_signature = _file_signature(self.path)
+                try: os.remove(self.compacting_path)
+                except FileNotFoundError: pass
+            logger.info(f"Compacted journal into {self.path} ({len(data)} macros) in {(time.perf_counter() - start) * 1000:.1f} ms")
+        except Exception as e:
+            logger.error(f"Falha ao compactar o journal de {self.path}: {e}", exc_info=True)
+
+    def _close_journal(self) -> None:
+        if self._journal_file is not None:
+            try: self._journal_file.close()
+            finally: self._journal_file = None
+
+    def close(self) -> None:
+        thread = self._compaction_thread
+        if thread and thread.is_alive(): thread.join(timeout=5.0)
+        with self._lock: self._close_journal()
+
+
+_U32_TYPECODE = "I" if array("I").itemsize == 4 else "L"
+
+
+class MappedMacroStore(JsonMacroStore):
+    # Arquivo somente leitura mapeado em memória + o mesmo journal do JsonMacroStore para as edições.
+    # Layout: cabeçalho | corpos (UTF-8, concatenados) | gatilhos (UTF-8, ordenados) |
+    #         offsets dos gatilhos (uint32, n+1) | offsets dos corpos (uint64, n+1).
+    # Em memória ficam só os dois arrays de offsets e o overlay das edições ainda não compactadas;
+    # um corpo só é decodificado quando é aplicado ou exibido.
+    name = "mmap"
+    resident = False
+    MAGIC = b"MMSTORE1"
+    HEADER = struct.Struct("<8sIQQQ")  # magic, count, keys_pos, keys_size, index_pos
+
+    def __init__(self, path: str, migrate_from: Optional[str] = None, compact_after: int = 500) -> None:
+        super().__init__(path, compact_after=compact_after)
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._count = 0
+        self._keys_pos = 0
+        self._key_offsets = array(_U32_TYPECODE)
+        self._body_offsets = array("Q")
+        # Edições desde a última compactação; None marca uma macro removida.
+        self._overlay: Dict[str, Optional[str]] = {}
+        # Mantido durante toda a compactação, que lê o mapa fora do self._lock: quem fecha o mapa
+        # (write_snapshot, close) espera ela terminar. Leituras (get_body) só usam self._lock.
+        self._compaction_lock = threading.Lock()
+        if not os.path.exists(path):
+            data = JsonMacroStore(migrate_from).load() if migrate_from and os.path.exists(migrate_from) else {}
+            start = time.perf_counter()
+            self.write_file(path, sorted(data.items()))
+            logger.info(f"Created {path} with {len(data)} macros in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    @classmethod
+    def write_file(cls, path: str, items: Iterable[Tuple[str, str]]) -> int:
+        # items precisa vir ordenado por gatilho. Os corpos são gravados em streaming; só os offsets
+        # ficam em memória até o fim.
+        items, prologue = cls._prepare_items(iter(items))
+        encode = cls._body_encoder(prologue)
+        key_offsets = array(_U32_TYPECODE, [0]); body_offsets = array("Q", [cls.HEADER.size + len(prologue)])
+        keys_blob = bytearray()
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(b"\0" * cls.HEADER.size)
+                f.write(prologue)
+                for key, body in items:
+                    encoded = encode(body)
+                    f.write(encoded)
+                    body_offsets.append(body_offsets[-1] + len(encoded))
+                    keys_blob += key.encode("utf-8")
+                    key_offsets.append(len(keys_blob))
+                keys_pos = f.tell()
+                f.write(keys_blob)
+                index_pos = f.tell()
+                f.write(key_offsets.tobytes()); f.write(body_offsets.tobytes())
+                f.seek(0)
+                f.write(cls.HEADER.pack(cls.MAGIC, len(key_offsets) - 1, keys_pos, len(keys_blob), index_pos, *cls._header_extra(prologue)))
+                f.flush(); os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try: os.remove(tmp_path)
+            except OSError: pass
+            raise
+        return len(key_offsets) - 1
+
+    # Pontos de extensão do formato (CompressedMacroStore): bloco gravado entre o cabeçalho e os
+    # corpos, campos extras do cabeçalho e codificação dos corpos.
+    @classmethod
+    def _prepare_items(cls, items: Iterable[Tuple[str, str]]) -> Tuple[Iterable[Tuple[str, str]], bytes]:
+        return items, b""
+
+    @classmethod
+    def _header_extra(cls, prologue: bytes) -> Tuple:
+        return ()
+
+    @classmethod
+    def _body_encoder(cls, prologue: bytes) -> callable:
+        return lambda body: body.encode("utf-8")
+
+    def _open_extra(self, extra: Tuple) -> None:
+        pass
+
+    def _decode_body(self, i: int, max_chars: Optional[int] = None) -> str:
+        if max_chars is None: return self._base_bytes(i).decode("utf-8")
+        # Até 4 bytes por caractere em UTF-8; um caractere cortado no fim é descartado.
+        return self._base_bytes(i, max_chars * 4).decode("utf-8", errors="ignore")[:max_chars]
+
+    def _open_map(self) -> None:
+        self._file = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, keys_pos, keys_size, index_pos, *extra = self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC: raise ValueError(f"{self.path} não é um arquivo {self.MAGIC.decode()}")
+        self._open_extra(tuple(extra))
+        key_offsets = array(_U32_TYPECODE); body_offsets = array("Q")
+        key_offsets.frombytes(self._map[index_pos:index_pos + (count + 1) * key_offsets.itemsize])
+        body_start = index_pos + (count + 1) * key_offsets.itemsize
+        body_offsets.frombytes(self._map[body_start:body_start + (count + 1) * 8])
+        self._count, self._keys_pos = count, keys_pos
+        self._key_offsets, self._body_offsets = key_offsets, body_offsets
+
+    def _close_map(self) -> None:
+        if self._map is not None: self._map.close(); self._map = None
+        if self._file is not None: self._file.close(); self._file = None
+        self._count = 0
+
+    def _key_at(self, i: int) -> str:
+        base = self._keys_pos
+        return self._map[base + self._key_offsets[i]:base + self._key_offsets[i + 1]].decode("utf-8")
+
+    def _all_base_keys(self) -> List[str]:
+        offsets = self._key_offsets
+        blob = self._map[self._keys_pos:self._keys_pos + offsets[-1]] if self._count else b""
+        text = blob.decode("utf-8")
+        if len(text) == len(blob):
+            # Gatilhos só ASCII (o caso comum): offsets de bytes valem como offsets de caracteres.
+            return [text[offsets[i]:offsets[i + 1]] for i in range(self._count)]
+        return [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(self._count)]
+
+    def _find(self, key: str) -> int:
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key: lo = mid + 1
+            else: hi = mid
+        return lo if lo < self._count and self._key_at(lo) == key else -1
+
+    def _base_bytes(self, i: int, limit: Optional[int] = None) -> bytes:
+        start, end = self._body_offsets[i], self._body_offsets[i + 1]
+        if limit is not None: end = min(end, start + limit)
+        return self._map[start:end]
+
+    def _ensure_open(self) -> None:
+        if self._map is not None: return
+        self._open_map()
+        self._overlay = {}
+        replayed = self._replay(self.compacting_path, self._overlay, keep_tombstones=True) + self._replay(self.journal_path, self._overlay, keep_tombstones=True)
+        self._journal_entries = replayed
+        if replayed: logger.info(f"Replayed {replayed} journal entries over {self.path}")
+
+    def load(self) -> Dict[str, str]:
+        with self._lock:
+            self._ensure_open()
+            return {key: body for key, body in self._iter_items()}
+
+    def load_keys(self) -> List[str]:
+        with self._lock:
+            self._ensure_open()
+            keys = self._all_base_keys()
+            if self._overlay:
+                keys = [k for k in keys if k not in self._overlay]
+                keys.extend(k for k, v in self._overlay.items() if v is not None)
+                keys.sort()
+            return keys
+
+    def _iter_items(self, overlay: Optional[Dict[str, Optional[str]]] = None) -> Iterable[Tuple[str, str]]:
+        overlay = self._overlay if overlay is None else overlay
+        base = ((k, i) for k, i in ((self._key_at(i), i) for i in range(self._count)) if k not in overlay)
+        changed = sorted((k, v) for k, v in overlay.items() if v is not None)
+        for key, source in heapq.merge(base, changed, key=lambda item: item[0]):
+            yield key, source if isinstance(source, str) else self._decode_body(source)
+
+    def get_body(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._overlay: return self._overlay[key]
+            self._ensure_open()
+            i = self._find(key)
+            return self._decode_body(i) if i >= 0 else None
+
+    def get_preview(self, key: str, max_chars: int) -> str:
+        with self._lock:
+            if key in self._overlay: return (self._overlay[key] or "")[:max_chars]
+            self._ensure_open()
+            i = self._find(key)
+            return self._decode_body(i, max_chars) if i >= 0 else ""
+
+    def put(self, key: str, text: str) -> None:
+        with self._lock:
+            super().put(key, text)
+            self._overlay[key] = text
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            super().delete(key)
+            self._overlay[key] = None
+
+    def put_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        items = list(items)
+        with self._lock:
+            super().put_many(items)
+            self._overlay.update(items)
+
+    def write_snapshot(self, data: Dict[str, str]) -> None:
+        with self._compaction_lock, self._lock:
+            self._close_map()
+            self.write_file(self.path, sorted(data.items()))
+            self._snapshot_generation += 1
+            self._close_journal()
+            for path in (self.journal_path, self.compacting_path):
+                try: os.remove(path)
+                except FileNotFoundError: pass
+            self._journal_entries = 0
+            self._overlay = {}
+            self._open_map()
+
+    def compact(self, get_data: callable = None) -> None:
+        # get_data é ignorado: o conteúdo vem do próprio arquivo mapeado + overlay.
+        with self._compaction_lock: self._compact()
+
+    def _compact(self) -> None:
+        with self._lock:
+            if not self._overlay: return
+            self._ensure_open()
+            self._close_journal()
+            if os.path.exists(self.journal_path):
+                if os.path.exists(self.compacting_path):
+                    with open(self.journal_path, "r", encoding="utf-8") as src, open(self.compacting_path, "a", encoding="utf-8") as dst:
+                        shutil.copyfileobj(src, dst)
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self.compacting_path)
+            overlay = dict(self._overlay)
+            self._journal_entries = 0
+            generation = self._snapshot_generation
+        new_path = self.path + ".new"
+        try:
+            start = time.perf_counter()
+            # Fora do self._lock: o mapa só é fechado por quem segura o _compaction_lock, então a
+            # leitura é segura; as edições novas vão para self._overlay/journal, não para a cópia usada aqui.
+            count = self.write_file(new_path, self._iter_items(overlay))
+            with self._lock:
+                if generation != self._snapshot_generation:
+                    # write_snapshot gravou uma versão mais nova (e apagou o .compacting) durante a compactação.
+                    os.remove(new_path)
+                    logger.info(f"Compactação de {self.path} descartada: um snapshot mais novo foi gravado durante ela.")
+                    return
+                # No Windows um arquivo mapeado não pode ser substituído: fecha o mapa antes da troca.
+                self._close_map()
+                try: os.replace(new_path, self.path)
+                finally: self._open_map()
+                try: os.remove(self.compacting_path)
+                except FileNotFoundError: pass
+                for key, value in overlay.items():
+                    if self._overlay.get(key, overlay) is value: del self._overlay[key]
+            logger.info(f"Compacted journal into {self.path} ({count} macros) in {(time.perf_counter() - start) * 1000:.1f} ms")
+        except Exception as e:
+            logger.error(f"Falha ao compactar o journal de {self.path}: {e}", exc_info=True)
+            try: os.remove(new_path)
+            except OSError: pass
+
+    def close(self) -> None:
+        super().close()
+        with self._compaction_lock, self._lock: self._close_map()
+
+
+class CompressedMacroStore(MappedMacroStore):
+    # Mesmo layout do MappedMacroStore, mas cada corpo é um stream deflate (sem cabeçalho zlib)
+    # comprimido com um dicionário compartilhado gravado logo após o cabeçalho. Comprimir corpo a
+    # corpo mantém o acesso aleatório; o dicionário recupera a maior parte do ganho de um bloco
+    # único, já que os textos curtos repetem as mesmas frases. Os corpos continuam comprimidos no
+    # mapa e só são descomprimidos ao aplicar/exibir (o manager guarda os recentes no BodyCache).
+    name = "compressed"
+    MAGIC = b"MMZSTOR1"
+    HEADER = struct.Struct("<8sIQQQI")  # magic, count, keys_pos, keys_size, index_pos, dict_size
+    LEVEL = 9
+    DICT_SIZE = 32 * 1024  # janela do deflate: bytes além disso nunca seriam referenciados
+    DICT_SAMPLE_ITEMS = 2000
+    DICT_SAMPLE_BYTES = 1 << 20
+
+    def __init__(self, path: str, migrate_from: Optional[str] = None, compact_after: int = 500) -> None:
+        self._zdict = b""
+        super().__init__(path, migrate_from=migrate_from, compact_after=compact_after)
+
+    @classmethod
+    def build_dictionary(cls, bodies: Iterable[str]) -> bytes:
+        # Linhas inteiras e trechos de 3 palavras que aparecem em mais de um corpo, pontuados pelos
+        # bytes que economizam; os melhores ficam no fim do dicionário (distâncias menores).
+        counts: Dict[str, int] = defaultdict(int)
+        for body in bodies:
+            seen = set()
+            for line in body.splitlines():
+                line = line.strip()
+                if not line: continue
+                seen.add(line)
+                words = line.split()
+                seen.update(" ".join(words[i:i + 3]) for i in range(0, max(len(words) - 2, 0), 2))
+            for piece in seen: counts[piece] += 1
+        scored = sorted(((count - 1) * len(piece), piece) for piece, count in counts.items() if count > 1)
+        chosen: List[bytes] = []; size = 0
+        for _, piece in reversed(scored):
+            encoded = piece.encode("utf-8") + b"\n"
+            if size + len(encoded) > cls.DICT_SIZE: continue
+            chosen.append(encoded); size += len(encoded)
+            if size >= cls.DICT_SIZE - 16: break
+        return b"".join(reversed(chosen))
+
+    @classmethod
+    def _prepare_items(cls, items: Iterable[Tuple[str, str]]) -> Tuple[Iterable[Tuple[str, str]], bytes]:
+        # O dicionário sai das primeiras macros do stream (já ordenado); o restante continua em streaming.
+        head: List[Tuple[str, str]] = []; sampled = 0
+        for item in items:
+            head.append(item); sampled += len(item[1])
+            if len(head) >= cls.DICT_SAMPLE_ITEMS or sampled >= cls.DICT_SAMPLE_BYTES: break
+        return itertools.chain(head, items), cls.build_dictionary(body for _, body in head)
+
+    @classmethod
+    def _header_extra(cls, prologue: bytes) -> Tuple:
+        return (len(prologue),)
+
+    @classmethod
+    def _body_encoder(cls, prologue: bytes) -> callable:
+        # Carregar o dicionário custa mais que comprimir um corpo curto: copia um compressor já preparado.
+        primed = zlib.compressobj(cls.LEVEL, zlib.DEFLATED, -15, zdict=prologue) if prologue else zlib.compressobj(cls.LEVEL, zlib.DEFLATED, -15)
+
+        def encode(body: str) -> bytes:
+            compressor = primed.copy()
+            return compressor.compress(body.encode("utf-8")) + compressor.flush()
+        return encode
+
+    def _open_extra(self, extra: Tuple) -> None:
+        self._zdict = bytes(self._map[self.HEADER.size:self.HEADER.size + extra[0]])
+
+    def _decode_body(self, i: int, max_chars: Optional[int] = None) -> str:
+        decompressor = zlib.decompressobj(-15, zdict=self._zdict) if self._zdict else zlib.decompressobj(-15)
+        if max_chars is None: return decompressor.decompress(self._base_bytes(i)).decode("utf-8")
+        # Prévia: descomprime só os primeiros bytes necessários.
+        return decompressor.decompress(self._base_bytes(i), max_chars * 4).decode("utf-8", errors="ignore")[:max_chars]
+
+    def compression_stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._ensure_open()
+            return {"macros": self._count, "dictionary_bytes": len(self._zdict),
+                    "compressed_body_bytes": self._body_offsets[-1] - self._body_offsets[0] if self._count else 0,
+                    "file_bytes": len(self._map)}
+
+
+class SqliteMacroStore(MacroStore):
+    # Gatilhos indexados e corpos lidos sob demanda: a inicialização lê só o índice dos gatilhos
+    # (covering index, sem tocar nas páginas dos corpos) e cada mutação é uma transação de uma linha.
+    name = "sqlite"
+    resident = False
+
+    def __init__(self, path: str, migrate_from: Optional[str] = None) -> None:
+        super().__init__(path)
+        self._lock = threading.Lock()
+        # Lida pela thread do Tk e pela thread de injeção; o acesso é serializado por self._lock.
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS macros (id INTEGER PRIMARY KEY, trigger TEXT NOT NULL UNIQUE, body TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        if migrate_from: self._migrate_json_once(migrate_from)
+
+    def _migrate_json_once(self, json_path: str) -> None:
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE name = 'migrated_from'").fetchone(): return
+            if not os.path.exists(json_path): return
+            start = time.perf_counter()
+            # JsonMacroStore.load também reaplica o journal pendente do arquivo JSON.
+            data = JsonMacroStore(json_path).load()
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO macros (trigger, body) VALUES (?, ?)", data.items())
+                self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('migrated_from', ?)", (json_path,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            logger.info(f"Migrated {len(data)} macros from {json_path} to {self.path} in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def load(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT trigger, body FROM macros"))
+
+    def load_keys(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT trigger FROM macros ORDER BY trigger")]
+
+    def get_body(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT body FROM macros WHERE trigger = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def get_preview(self, key: str, max_chars: int) -> str:
+        with self._lock:
+            row = self._conn.execute("SELECT substr(body, 1, ?) FROM macros WHERE trigger = ?", (max_chars, key)).fetchone()
+        return row[0] if row else ""
+
+    def put(self, key: str, text: str) -> None:
+        with self._lock:
+            self._conn.execute("INSERT INTO macros (trigger, body) VALUES (?, ?) ON CONFLICT(trigger) DO UPDATE SET body = excluded.body", (key, text))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM macros WHERE trigger = ?", (key,))
+
+    def put_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT INTO macros (trigger, body) VALUES (?, ?) ON CONFLICT(trigger) DO UPDATE SET body = excluded.body", items)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def write_snapshot(self, data: Dict[str, str]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM macros")
+                self._conn.executemany("INSERT INTO macros (trigger, body) VALUES (?, ?)", data.items())
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            try: self._conn.close()
+            except sqlite3.Error as e: logger.warning(f"Erro ao fechar {self.path}: {e}")
+
+
+
+class LibraryDelta:
+    # Diferença entre duas versões da biblioteca: só isso é aplicado ao índice, à lista e ao popup.
+    __slots__ = ("added", "removed", "changed")
+
+    def __init__(self, added: Dict[str, str], removed: List[str], changed: Dict[str, str]) -> None:
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __len__(self) -> int:
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def summary(self) -> str:
+        return f"+{len(self.added)} -{len(self.removed)} ~{len(self.changed)}"
+
+    @classmethod
+    def between(cls, current: Dict[str, str], new: Dict[str, str]) -> "LibraryDelta":
+        added = {k: v for k, v in new.items() if k not in current}
+        removed = [k for k in current if k not in new]
+        changed = {k: v for k, v in new.items() if k in current and current[k] != v}
+        return cls(added, removed, changed)
+
+    @staticmethod
+    def fingerprints(data: Dict[str, str]) -> Dict[str, int]:
+        # Só para comparar versões dentro do mesmo processo (hash de str é aleatorizado por processo).
+        return {k: hash(v) for k, v in data.items()}
+
+    @classmethod
+    def between_versions(cls, previous: Dict[str, int], new: Dict[str, str], present: callable) -> "LibraryDelta":
+        # Diferença entre duas versões de um arquivo externo (previous em fingerprints), expressa
+        # sobre a biblioteca atual: só o que mudou no arquivo é aplicado; o resto da biblioteca
+        # (edições feitas no app) fica como está.
+        added: Dict[str, str] = {}; changed: Dict[str, str] = {}
+        for k, v in new.items():
+            if previous.get(k) == hash(v): continue
+            if present(k): changed[k] = v
+            else: added[k] = v
+        removed = [k for k in previous if k not in new and present(k)]
+        return cls(added, removed, changed)
+
+
+class _InotifyWaiter:
+    # Espera por eventos de escrita/renomeação no diretório via inotify (Linux), com timeout.
+    # Em outras plataformas available fica False e o watcher só faz polling.
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+
+    def __init__(self, directory: str) -> None:
+        self.available = False
+        self._fd = -1
+        if not sys.platform.startswith("linux"): return
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK)
+            if fd < 0: return
+            if libc.inotify_add_watch(fd, directory.encode(), self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE) < 0:
+                os.close(fd); return
+            self._fd = fd
+            self.available = True
+        except (OSError, AttributeError) as e:
+            logger.debug("inotify indisponível: %s", e)
+
+    def wait(self, timeout: float) -> bool:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable: return False
+        try:
+            while os.read(self._fd, 4096): pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd); self._fd = -1
+
+
+class MacroFileWatcher:
+    # Observa o arquivo de macros fora das threads do hook e do Tk. Compara (mtime, tamanho) a cada
+    # intervalo, ou acorda antes via inotify; espera o arquivo ficar estável antes de avisar, para
+    # não ler uma cópia pela metade feita pela ferramenta de sincronização.
+    SETTLE_DELAY = 0.2
+
+    def __init__(self, path: str, on_change: callable, interval: float = 1.0, is_own_write: Optional[callable] = None,
+                 on_start: Optional[callable] = None) -> None:
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.is_own_write = is_own_write
+        # Chamado uma vez na thread do watcher, antes da primeira verificação (estado de referência).
+        self.on_start = on_start
+        self.reloads = 0
+        self._signature = _file_signature(path)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive(): return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="MacroFileWatcherThread", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread and self._thread.is_alive(): self._thread.join(timeout=self.interval + 1.0)
+
+    def _run(self) -> None:
+        waiter = _InotifyWaiter(os.path.dirname(self.path) or ".")
+        logger.info(f"Watching {self.path} for external changes ({'inotify' if waiter.available else 'polling'}, {self.interval}s).")
+        try:
+            if self.on_start is not None:
+                self._signature = _file_signature(self.path)
+                try: self.on_start()
+                except Exception as e: logger.error(f"Falha ao preparar a observação de {self.path}: {e}", exc_info=True)
+            while not self._stop.is_set():
+                if waiter.available: waiter.wait(self.interval)
+                else: self._stop.wait(self.interval)
+                if self._stop.is_set(): break
+                self.check()
+        finally:
+            waiter.close()
+
+    def check(self) -> bool:
+        signature = _file_signature(self.path)
+        if signature == self._signature or signature is None: return False
+        while not self._stop.wait(self.SETTLE_DELAY):
+            settled = _file_signature(self.path)
+            if settled == signature: break
+            signature = settled
+        if self._stop.is_set(): return False
+        self._signature = signature
+        if self.is_own_write and self.is_own_write(signature): return False
+        self.reloads += 1
+        try: self.on_change()
+        except Exception as e: logger.error(f"Erro ao recarregar {self.path}: {e}", exc_info=True)
+        return True
+
+
+def validate_macro(trigger: str, text: str) -> Optional[str]:
+    # Regras dos diálogos de adicionar/editar e da importação. Devolve a mensagem de erro ou None.
+    if not trigger.startswith("/") or len(trigger) < 2: return "o atalho deve começar com '/' e não pode ser só '/'"
+    if not text: return "o texto não pode ser vazio"
+    return None
+
+
+MACRO_FILE_FORMATS = {".json": "json", ".jsonl": "jsonl", ".ndjson": "jsonl", ".csv": "csv"}
+
+
+def detect_macro_format(path: str, fmt: Optional[str] = None) -> str:
+    if fmt:
+        if fmt not in MACRO_FILE_FORMATS.values(): raise ValueError(f"formato desconhecido '{fmt}' (use json, jsonl ou csv)")
+        return fmt
+    fmt = MACRO_FILE_FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None: raise ValueError(f"não foi possível deduzir o formato de {path}; use .json, .jsonl ou .csv")
+    return fmt
+
+
+def _iter_json_object_pairs(f, chunk_size: int = 1 << 16) -> Iterable[Tuple[int, Any, Any, Optional[str]]]:
+    # Lê {"atalho": "texto", ...} (formato do expansions.json) sem carregar o arquivo inteiro: o
+    # buffer guarda só o par atual e o restante do último bloco lido.
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def more() -> bool:
+        nonlocal buf, pos, eof
+        if eof: return False
+        data = f.read(chunk_size)
+        if not data:
+            eof = True; return False
+        buf = buf[pos:] + data; pos = 0
+        return True
+
+    def peek() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n": pos += 1
+            if pos < len(buf): return buf[pos]
+            if not more(): return ""
+
+    def value() -> Any:
+        nonlocal pos
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Valor cortado no fim do buffer (ex.: corpo grande): lê mais e tenta de novo.
+                if more(): continue
+                raise
+            if end == len(buf) and not isinstance(obj, (str, list, dict)) and more(): continue  # número pode continuar
+            pos = end
+            return obj
+
+    def expect(char: str) -> None:
+        nonlocal pos
+        found = peek()
+        if found != char: raise ValueError(f"JSON inválido: esperado '{char}', encontrado {found!r}")
+        pos += 1
+
+    def finish() -> None:
+        # Como json.load: depois do "}" final só pode haver espaço em branco.
+        expect("}")
+        if peek(): raise ValueError("JSON inválido: dados extras depois do fim do objeto")
+
+    expect("{")
+    if peek() == "}":
+        finish(); return
+    index = 0
+    while True:
+        if peek() != '"': raise ValueError("JSON inválido: esperado um atalho entre aspas")
+        key = value()
+        expect(":")
+        peek()
+        text = value()
+        index += 1
+        yield index, key, text, None
+        if peek() == ",":
+            pos += 1; continue
+        finish()
+        return
+
+
+def iter_macro_records(path: str, fmt: Optional[str] = None) -> Iterable[Tuple[int, Any, Any, Optional[str]]]:
+    # (registro/linha, atalho, texto, erro) lidos em fluxo. Erros de sintaxe em JSON Lines/CSV
+    # invalidam só a linha; no formato expansions.json interrompem a leitura (ValueError).
+    fmt = detect_macro_format(path, fmt)
+    with open(path, "r", encoding="utf-8-sig", newline="" if fmt == "csv" else None) as f:
+        if fmt == "json":
+            yield from _iter_json_object_pairs(f)
+        elif fmt == "jsonl":
+            for line_number, line in enumerate(f, 1):
+                if not line.strip(): continue
+                try: entry = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, None, None, f"JSON inválido ({e.msg})"; continue
+                if not isinstance(entry, dict) or "trigger" not in entry or "text" not in entry:
+                    yield line_number, None, None, 'esperado {"trigger": ..., "text": ...}'; continue
+                yield line_number, entry["trigger"], entry["text"], None
+        else:
+            # Corpos longos/multilinha passam do limite padrão de 128 KB por campo do módulo csv.
+            csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+            reader = csv.reader(f)
+            columns = (0, 1)
+            for row in reader:
+                if reader.line_num == 1:
+                    header = [cell.strip().lower() for cell in row]
+                    if "trigger" in header and "text" in header:
+                        columns = (header.index("trigger"), header.index("text")); continue
+                if not any(cell.strip() for cell in row): continue
+                if len(row) <= max(columns):
+                    yield reader.line_num, None, None, "linha sem as colunas de atalho e texto"; continue
+                yield reader.line_num, row[columns[0]], row[columns[1]], None
+
+
+def write_macro_records(path: str, items: Iterable[Tuple[str, str]], fmt: Optional[str] = None) -> int:
+    # Exporta em fluxo (um par por vez) e troca o arquivo de forma atômica no fim.
+    fmt = detect_macro_format(path, fmt)
+    count = 0
+    with _atomic_writer(path, newline="" if fmt == "csv" else None) as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(("trigger", "text"))
+            for key, text in items:
+                writer.writerow((key, text)); count += 1
+        elif fmt == "jsonl":
+            for key, text in items:
+                f.write(json.dumps({"trigger": key, "text": text}, ensure_ascii=False) + "\n"); count += 1
+        else:
+            # Mesmo layout do json.dump(indent=4) usado para o expansions.json.
+            f.write("{")
+            for key, text in items:
+                f.write(("," if count else "") + "\n    " + json.dumps(key, ensure_ascii=False) + ": " + json.dumps(text, ensure_ascii=False))
+                count += 1
+            f.write("\n}" if count else "}")
+    return count
+
+
+class ImportReport:
+    # Resultado de uma importação; guarda no máximo MAX_DETAILS exemplos de conflitos e de erros.
+    MAX_DETAILS = 100
+
+    def __init__(self, path: str, fmt: str, on_conflict: str, dry_run: bool) -> None:
+        self.path = path
+        self.format = fmt
+        self.on_conflict = on_conflict
+        self.dry_run = dry_run
+        self.records = 0
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.duplicates = 0
+        self.conflicts: set = set()
+        self.invalid: List[Tuple[int, str]] = []
+        self.invalid_count = 0
+        self.error: Optional[str] = None
+        self.seconds = 0.0
+
+    def add_invalid(self, record: int, reason: str) -> None:
+        self.invalid_count += 1
+        if len(self.invalid) < self.MAX_DETAILS: self.invalid.append((record, reason))
+
+    def summary(self) -> str:
+        skipped = f", {len(self.conflicts)} conflitos ignorados" if self.on_conflict == "skip" else f", {len(self.conflicts)} conflitos sobrescritos"
+        text = (f"{self.added} novas, {self.updated} atualizadas, {self.unchanged} iguais{skipped}, "
+                f"{self.duplicates} repetidas no arquivo, {self.invalid_count} inválidas")
+        if self.error: text += f"; leitura interrompida: {self.error}"
+        return ("[simulação] " if self.dry_run else "") + text
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"path": self.path, "format": self.format, "on_conflict": self.on_conflict, "dry_run": self.dry_run,
+                "records": self.records, "added": self.added, "updated": self.updated, "unchanged": self.unchanged,
+                "duplicates": self.duplicates, "conflict_count": len(self.conflicts),
+                "conflicts": sorted(self.conflicts)[:self.MAX_DETAILS], "invalid_count": self.invalid_count,
+                "invalid": [{"record": record, "reason": reason} for record, reason in self.invalid],
+                "error": self.error, "seconds": round(self.seconds, 3)}
+
+
+def _enumerate_monitors() -> List[Any]:
+    from screeninfo import get_monitors
+    return get_monitors()
+
+
+def _display_signature() -> Optional[Tuple[int, ...]]:
+    # Sinal barato de mudança de monitores: retângulo da tela virtual + número de monitores.
+    # Fora do Windows não há equivalente barato; o cache passa a reenumerar periodicamente.
+    if os.name != 'nt' or windll is None: return None
+    metrics = windll.user32.GetSystemMetrics
+    return tuple(metrics(i) for i in (76, 77, 78, 79, 80))  # SM_X/YVIRTUALSCREEN, SM_CX/CYVIRTUALSCREEN, SM_CMONITORS
+
+
+class MonitorLayoutCache:
+    # Retângulos dos monitores ordenados por x; monitor_at faz bisect nas bordas esquerdas e testa
+    # só os candidatos à esquerda do ponto. A enumeração (screeninfo) acontece fora do caminho do
+    # atalho: na inicialização, quando a assinatura da tela muda ou, sem assinatura, periodicamente.
+    PERIODIC_REFRESH = 60.0
+
+    def __init__(self, enumerate_monitors: Optional[callable] = None, signature_probe: Optional[callable] = None) -> None:
+        self._enumerate = enumerate_monitors or _enumerate_monitors
+        self._probe = signature_probe or _display_signature
+        # (retângulos, bordas esquerdas, principal) trocados juntos numa única atribuição.
+        self._layout: Tuple[Tuple[Tuple[int, int, int, int], ...], List[int], Optional[Tuple[int, int, int, int]]] = ((), [], None)
+        self.signature: Optional[Tuple[int, ...]] = None
+        self.refreshed_at = 0.0
+        self.refreshes = 0
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self) -> None:
+        with self._refresh_lock:
+            signature = self._probe()
+            start = time.perf_counter()
+            monitors = list(self._enumerate())
+            rects = tuple(sorted((m.x, m.y, m.width, m.height) for m in monitors))
+            # Ponto fora de todos os monitores: usa o principal (ou o primeiro enumerado), como antes.
+            primary = next((m for m in monitors if getattr(m, "is_primary", False)), monitors[0] if monitors else None)
+            primary_rect = (primary.x, primary.y, primary.width, primary.height) if primary else None
+            self._layout = (rects, [r[0] for r in rects], primary_rect)
+            self.signature = signature
+            self.refreshed_at = time.monotonic()
+            self.refreshes += 1
+            logger.info(f"Monitor layout refreshed in {(time.perf_counter() - start) * 1000:.1f} ms: {rects}")
+
+    def refresh_async(self) -> None:
+        threading.Thread(target=self._refresh_safely, name="MonitorLayoutThread", daemon=True).start()
+
+    def _refresh_safely(self) -> None:
+        try: self.refresh()
+        except Exception as e: logger.error(f"Monitor info error: {e}", exc_info=True)
+
+    def check(self) -> bool:
+        # Chamado periodicamente pelo Tk: só a assinatura (barata) roda aqui; reenumera em outra thread.
+        if self._refresh_lock.locked(): return False
+        signature = self._probe()
+        if signature is None:
+            stale = time.monotonic() - self.refreshed_at > self.PERIODIC_REFRESH
+        else:
+            stale = signature != self.signature
+        if stale: self.refresh_async()
+        return stale
+
+    def monitor_at(self, x: int, y: int) -> Optional[Tuple[int, int, int, int]]:
+        rects, starts, primary = self._layout
+        if not rects: return None
+        i = bisect.bisect_right(starts, x) - 1
+        while i >= 0:
+            mx, my, mw, mh = rects[i]
+            if mx <= x < mx + mw and my <= y < my + mh: return rects[i]
+            i -= 1
+        return primary
 
 
-def configurar_tema(root: tk.Tk) -> None:
-    try: logger.info("Tk scaling call has been commented out/skipped in configurar_tema.")
-    except Exception as e: logger.warning(f"Could not set Tk scaling (or call was already commented out): {e}")
+class ForegroundProcessProbe:
+    # Nome do executável da janela em primeiro plano ("chrome.exe"), em minúsculas; None fora do
+    # Windows ou se não der para consultar. O nome é guardado por PID: depois da primeira consulta
+    # custa duas chamadas user32. Qualquer callable sem argumentos que devolva o nome serve de probe.
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
 
-    if hasattr(sys, '_MEIPASS'): base_path = sys._MEIPASS
-    else: base_path = os.path.dirname(os.path.abspath(__file__))
-    theme_package_name = 'azure'
-    possible_theme_package_base_paths = [ base_path, os.path.join(base_path, 'libs'), os.path.dirname(base_path) ]
-    tcl_auto_path_to_add = None
-    for p_path in possible_theme_package_base_paths:
-        if os.path.isdir(os.path.join(p_path, 'theme')) and os.path.exists(os.path.join(p_path, 'theme', 'pkgIndex.tcl')):
-            tcl_auto_path_to_add = p_path; logger.info(f"Found Azure theme structure with 'theme' folder in: {tcl_auto_path_to_add}"); break
-        if os.path.basename(p_path) == 'theme' and os.path.exists(os.path.join(p_path, 'pkgIndex.tcl')):
-            tcl_auto_path_to_add = os.path.dirname(p_path); logger.info(f"Found Azure theme structure where base_path pointed into 'theme'. Auto_path set to parent: {tcl_auto_path_to_add}"); break
-        if os.path.exists(os.path.join(p_path, f'{theme_package_name}.tcl')) and os.path.isdir(os.path.join(p_path, 'theme')) and os.path.exists(os.path.join(p_path, 'theme', 'pkgIndex.tcl')):
-            tcl_auto_path_to_add = p_path; logger.info(f"Found {theme_package_name}.tcl and 'theme' subfolder in: {tcl_auto_path_to_add}"); break
-    if not tcl_auto_path_to_add: tcl_auto_path_to_add = base_path; logger.warning(f"Could not definitively locate Azure theme structure. Defaulting Tcl auto_path to: {tcl_auto_path_to_add}")
-    logger.info(f"Adding to Tcl auto_path: {tcl_auto_path_to_add}")
-    try: root.tk.call('lappend', 'auto_path', tcl_auto_path_to_add)
-    except tk.TclError as e:
-        logger.error(f"Failed to lappend to Tcl auto_path: {e}"); ctk.set_default_color_theme("blue"); logger.info("Falling back to default CustomTkinter theme as Tcl auto_path configuration failed.")
-        default_font_tuple = ('Segoe UI', 10); root.option_add('*Font', default_font_tuple); style = ttk.Style(root)
-        style.configure('Treeview', rowheight=28, font=default_font_tuple); style.configure('Treeview.Heading', font=('Segoe UI', 10, 'bold'))
-        if os.name == 'nt': WindowsAPI.apply_window_style(root); return
-    try:
-        logger.info(f"Attempting to 'package require {theme_package_name}'")
-        root.tk.call('package', 'require', theme_package_name)
-        root.tk.call('set_theme', ctk.get_appearance_mode().lower())
-        logger.info(f"{theme_package_name.capitalize()} Tcl theme loaded and set to {ctk.get_appearance_mode().lower()}.")
-    except tk.TclError as e:
-        logger.error(f"Failed to load or set {theme_package_name.capitalize()} Tcl theme: {e}. Using default CustomTkinter theme.")
-        ctk.set_default_color_theme("blue")
-    style = ttk.Style(root); default_font_tuple = ('Segoe UI', 10); bold_font_tuple = ('Segoe UI', 10, 'bold')
-    root.option_add('*Font', default_font_tuple)
-    style.configure('Treeview', rowheight=28, font=default_font_tuple, borderwidth=0, relief="flat")
-    style.configure('Treeview.Heading', font=bold_font_tuple, padding=(5, 5))
-    style.configure('TButton', padding=6, font=default_font_tuple); style.configure('TLabel', padding=4, font=default_font_tuple)
-    try:
-        appearance_mode = ctk.get_appearance_mode()
-        idx = 1 if appearance_mode == "Dark" else 0
+    def __init__(self) -> None:
+        self._names: Dict[int, str] = {}
 
-        # Correção para ctk.ThemeManager.THEME_DATA (para CTk < 5.x) ou ctk.ThemeManager.get_theme() (para CTk >= 5.x)
-        theme_data = {}
-        if hasattr(ctk.ThemeManager, 'get_theme') and callable(ctk.ThemeManager.get_theme):
-            theme_name_or_path = ctk.ThemeManager.get_currently_used_theme()
-            if isinstance(theme_name_or_path, str) and os.path.exists(theme_name_or_path): # Se for um path para JSON
-                with open(theme_name_or_path, 'r') as f:
-                    theme_data = json.load(f)
-            else: # Se for um nome de tema embutido
-                theme_data = ctk.ThemeManager.get_theme(theme_name_or_path)
-        elif hasattr(ctk.ThemeManager, 'THEME_DATA'): # Para versões mais antigas
-            theme_data = ctk.ThemeManager.THEME_DATA
+    def __call__(self) -> Optional[str]:
+        if os.name != 'nt' or windll is None: return None
+        hwnd = windll.user32.GetForegroundWindow()
+        if not hwnd: return None
+        pid = ctypes.c_ulong()
+        windll.user32.GetWindowThreadProcessId(hwnd, byref(pid))
+        name = self._names.get(pid.value)
+        if name is None:
+            handle = windll.kernel32.OpenProcess(self.PROCESS_QUERY_LIMITED_INFORMATION, False, pid.value)
+            if not handle: return None
+            try:
+                buffer = ctypes.create_unicode_buffer(1024); size = ctypes.c_ulong(len(buffer))
+                if not windll.kernel32.QueryFullProcessImageNameW(handle, 0, buffer, byref(size)): return None
+            finally:
+                windll.kernel32.CloseHandle(handle)
+            name = os.path.basename(buffer.value).lower()
+            if len(self._names) >= 256: self._names.clear()
+            self._names[pid.value] = name
+        return name
 
-        bg_color_tuple = theme_data.get("CTkFrame", {}).get("fg_color", ("#DBDBDB", "#2B2B2B"))
-        text_color_tuple = theme_data.get("CTkLabel", {}).get("text_color", ("#101010", "#DCE4EE"))
 
-        final_bg_color = bg_color_tuple[idx] if isinstance(bg_color_tuple, (list, tuple)) and len(bg_color_tuple) > idx else bg_color_tuple
-        final_text_color = text_color_tuple[idx] if isinstance(text_color_tuple, (list, tuple)) and len(text_color_tuple) > idx else text_color_tuple
+class MacroProfiles:
+    # Definição dos perfis (profiles.json, ao lado do expansions.json):
+    #   {"crm": {"processes": ["crm.exe"], "prefixes": ["/crm"], "macros": ["/ticket"], "include_global": true}}
+    # Uma macro pertence a um perfil se estiver em "macros" ou começar com um dos "prefixes"; macros
+    # sem perfil são globais. Num aplicativo de "processes" valem as macros do perfil (+ as globais,
+    # salvo "include_global": false); nos demais aplicativos, só as globais.
+    FILE_NAME = "profiles.json"
 
-        style.configure('TScrollbar', troughcolor=final_bg_color, bordercolor=final_bg_color, arrowcolor=final_text_color, background=final_bg_color)
-    except Exception as e_style: logger.warning(f"Could not apply CTk-based styles to TScrollbar: {e_style}.")
-    root.attributes('-alpha', 1.0); root.overrideredirect(False)
-    if os.name == 'nt': WindowsAPI.apply_window_style(root)
+    def __init__(self, definitions: Dict[str, Dict[str, Any]]) -> None:
+        self.names: List[str] = []
+        self.include_global: Dict[str, bool] = {}
+        self._macros: Dict[str, set] = {}
+        self._prefixes: Dict[str, Tuple[str, ...]] = {}
+        self.by_process: Dict[str, str] = {}
+        for name, spec in definitions.items():
+            if not isinstance(spec, dict): raise ValueError(f"perfil '{name}' deve ser um objeto")
+            self.names.append(name)
+            self.include_global[name] = bool(spec.get("include_global", True))
+            self._macros[name] = set(spec.get("macros", ()))
+            self._prefixes[name] = tuple(spec.get("prefixes", ()))
+            for process in spec.get("processes", ()): self.by_process[str(process).lower()] = name
+
+    @classmethod
+    def load(cls, path: str) -> Optional["MacroProfiles"]:
+        try:
+            with open(path, "r", encoding="utf-8") as f: definitions = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Falha ao ler perfis de {path}: {e}. Perfis desativados.")
+            return None
+        try:
+            if not isinstance(definitions, dict): raise ValueError("o arquivo deve conter um objeto")
+            profiles = cls(definitions)
+        except ValueError as e:
+            logger.error(f"Perfis inválidos em {path}: {e}. Perfis desativados.")
+            return None
+        logger.info(f"{len(profiles.names)} perfis carregados de {path} ({len(profiles.by_process)} aplicativos)")
+        return profiles if profiles.names else None
+
+    def profiles_for(self, key: str) -> List[str]:
+        return [name for name in self.names if key in self._macros[name] or (self._prefixes[name] and key.startswith(self._prefixes[name]))]
+
+
+class ProfileView:
+    # Índice pronto de um perfil: biblioteca (snapshot próprio), cursor do hook e busca aproximada.
+    # Trocar de perfil é trocar a referência para outra ProfileView.
+    __slots__ = ("name", "library", "cursor", "matcher")
+
+    def __init__(self, name: Optional[str], library: MacroLibrary, first_line_getter: callable, matcher: Optional[MacroMatcher] = None) -> None:
+        self.name = name
+        self.library = library
+        self.cursor = library.cursor()
+        self.matcher = matcher or MacroMatcher(library, first_line_getter)
 
 
 class MacroManager:
-    def __init__(self) -> None:
+    HOTKEY_IGNORE_WINDOW = 0.25
+    # VALOR CRÍTICO PARA AJUSTE: tempo para o foco voltar à janela de destino depois de esconder o popup.
+    FOCUS_RETURN_DELAY = 0.7
+    PRE_INJECTION_DELAY = 0.05
+    SQLITE_FILE_NAME = "expansions.sqlite3"
+    MMAP_FILE_NAME = "expansions.mmstore"
+    COMPRESSED_FILE_NAME = "expansions.zstore"
+
+    def __init__(self, load_in_background: bool = False, expansions_file: Optional[str] = None,
+                 settings: Optional[Dict[str, Any]] = None, injection_policy: Optional[HybridInjectionPolicy] = None,
+                 foreground_probe: Optional[callable] = None) -> None:
+        # expansions_file/settings/injection_policy permitem rodar o manager fora do desktop
+        # (benchmarks headless): arquivo próprio, sem settings.json do usuário e backends falsos.
         self._lock = threading.Lock()
         self._load_lock = threading.Lock()
-        self._expansion_cache = defaultdict(str)
-        self.expansions: Dict[str, str] = {}
+        # Serializa as alterações da biblioteca em memória: edições avulsas (thread do Tk) e lotes
+        # de importação (que reconstroem o índice a partir de uma cópia) não podem se intercalar.
+        self._mutation_lock = threading.RLock()
+        self.library_ready = threading.Event()
+        self.load_seconds: Optional[float] = None
+        # Snapshot imutável dos atalhos (e dos corpos, com store residente), trocado atomicamente a
+        # cada mutação; com store não residente os corpos passam por self._body_cache.
+        self.library = MacroLibrary()
+        self._body_cache = BodyCache()
+        self.previews = PreviewCache(self.get_first_line)
+        self.templates = TemplateCache()
+        self.template_input_callback: Optional[callable] = None
+        self.matcher = MacroMatcher(self.library, self.get_preview)
+        # O hook e o popup usam a visão do perfil ativo; sem profiles.json é a biblioteca inteira.
+        self.profiles: Optional[MacroProfiles] = None
+        self._full_view = ProfileView(None, self.library, self.get_preview, self.matcher)
+        self._default_view = self._full_view
+        self._profile_views: Dict[str, ProfileView] = {}
+        self._process_views: Dict[str, ProfileView] = {}
+        self.active_view = self._full_view
+        self.foreground_probe = foreground_probe or ForegroundProcessProbe()
         self.current_typed: str = ""
         self.keyboard_listener_hook: Optional[Any] = None
         self.tray_icon: Optional[Any] = None
         self.suggestion_ui_callback: Optional[callable] = None
+        self.library_change_callback: Optional[callable] = None
+        self.file_watcher: Optional[MacroFileWatcher] = None
+        # Store não residente: fingerprints do expansions.json da última vez que foi lido, para
+        # recargas aplicarem só o que mudou no arquivo (ele não recebe as edições feitas no app).
+        self._json_baseline: Optional[Dict[str, int]] = None
         self.suggestion_popup_active: bool = False
         self.suggestion_hotkey_hook: Optional[Any] = None
         self.is_running: bool = True
         self.is_applying_macro_flag: bool = False
         self.last_hotkey_press_time: float = 0.0
+        self.hook_latency = LatencyHistogram("on_key_press")
+        self.injection_latency = LatencyHistogram("injection_total")
+        self.settings: Dict[str, Any] = load_settings() if settings is None else settings
+        self._body_cache.capacity = int(self.settings.get("body_cache_size", self._body_cache.capacity))
+        # Sugestões aproximadas (fora de ordem) ou só por prefixo; com match_body as sugestões também
+        # procuram no texto (primeira linha) das macros.
+        self.fuzzy_suggestions: bool = bool(self.settings.get("fuzzy_suggestions", True))
+        self.match_body_in_suggestions: bool = bool(self.settings.get("match_body_in_suggestions", False))
+        self.injection_policy = injection_policy or HybridInjectionPolicy(TypingInjectionBackend(), ClipboardInjectionBackend(),
+                                                                          max_typed_chars=int(self.settings.get("typing_max_chars", 40)))
+        self.injection_worker = MacroInjectionWorker(self._execute_injection_job, self._on_injection_complete)
+        self.metrics = MetricsRegistry(enabled=bool(self.settings.get("metrics", False)))
+        self.metrics_server: Optional[MetricsServer] = None
+        self.recorder: Optional[KeystrokeRecorder] = None
+        self._register_metrics()
 
         app_data_dir_name = "MacroManagerV3"
 
-        if hasattr(sys, '_MEIPASS'):
+        if expansions_file is not None:
+            self.expansions_file = expansions_file
+            self.bundled_expansions_file = None
+        elif hasattr(sys, '_MEIPASS'):
             self.bundled_expansions_file = os.path.join(sys._MEIPASS, "expansions.json")
             user_data_path = get_user_data_dir(app_data_dir_name)
             self.expansions_file = os.path.join(user_data_path, "expansions.json")
@@ -210,7 +2541,24 @@ class MacroManager:
             logger.info(f"Modo Desenvolvimento: Usando expansions.json em: {self.expansions_file}")
 
         self._ensure_expansions_file()
-        self.load_expansions()
+        self.store: Optional[MacroStore] = None
+        if load_in_background:
+            # Abrir o store (e migrar, se for o caso) e carregar a biblioteca enquanto a janela é montada.
+            threading.Thread(target=self._open_and_load, name="MacroLoadThread", daemon=True).start()
+        else:
+            self._open_and_load()
+
+    def _open_and_load(self) -> None:
+        start = time.perf_counter()
+        try:
+            self._open_store()
+            self.profiles = MacroProfiles.load(os.path.join(os.path.dirname(self.expansions_file), MacroProfiles.FILE_NAME))
+            self.load_expansions()
+        except Exception as e:
+            logger.error(f"Falha ao carregar a biblioteca de macros: {e}", exc_info=True)
+        finally:
+            self.load_seconds = time.perf_counter() - start
+            self.library_ready.set()
 
     def _ensure_expansions_file(self) -> None:
         try:
@@ -241,14 +2589,7 @@ class MacroManager:
                     with open(self.expansions_file, "w", encoding="utf-8") as f:
                         json.dump({}, f, ensure_ascii=False, indent=4)
 
-            with open(self.expansions_file, "r+", encoding="utf-8") as f:
-                try:
-                    json.load(f)
-                except json.JSONDecodeError:
-                    logger.warning(f"JSON inválido em {self.expansions_file}. Resetando para arquivo vazio.")
-                    f.seek(0)
-                    f.truncate()
-                    json.dump({}, f, ensure_ascii=False, indent=4)
+            # JSON inválido não é mais resetado aqui: JsonMacroStore.load preserva uma cópia do arquivo corrompido.
 
         except Exception as e:
             logger.critical(f"Erro crítico ao garantir o arquivo de expansões do usuário {self.expansions_file}: {e}", exc_info=True)
@@ -264,37 +2605,108 @@ class MacroManager:
 
 
     def load_expansions(self) -> None:
-        with self._load_lock:
+        with self._load_lock, self.metrics.timer("store.load_expansions"):
+            expansions: Dict[str, str] = {}
             try:
-                with open(self.expansions_file, "r", encoding="utf-8") as f:
-                    self.expansions = json.load(f)
-                    self._expansion_cache.clear()
-                    self._expansion_cache.update(self.expansions)
-                logger.info(f"Successfully loaded {len(self.expansions)} macros from {self.expansions_file}")
+                start = time.perf_counter()
+                if self.store.resident: expansions = self.store.load(); keys = expansions.keys()
+                else: keys = self.store.load_keys()
+                logger.info(f"Successfully loaded {len(keys)} macros from {self.store.path} ({self.store.name}) in {(time.perf_counter() - start) * 1000:.1f} ms")
             except FileNotFoundError:
                 logger.error(f"Expansions file {self.expansions_file} não encontrado em load_expansions. Tentando _ensure_expansions_file e recarregar.")
                 self._ensure_expansions_file()
+                self._open_store()
                 try:
-                    with open(self.expansions_file, "r", encoding="utf-8") as f_retry:
-                        self.expansions = json.load(f_retry)
-                        self._expansion_cache.clear()
-                        self._expansion_cache.update(self.expansions)
-                    logger.info(f"Successfully loaded {len(self.expansions)} macros from {self.expansions_file} após recriação.")
+                    expansions = self.store.load()
+                    keys = expansions.keys()
+                    logger.info(f"Successfully loaded {len(expansions)} macros from {self.expansions_file} após recriação.")
                 except Exception as e_retry_load:
                     logger.error(f"Falha ao carregar expansões mesmo após _ensure_expansions_file: {e_retry_load}")
-                    self.expansions = {}
-                    self._expansion_cache.clear()
-            except json.JSONDecodeError:
-                logger.error(f"JSONDecodeError em load_expansions para {self.expansions_file}. Resetando.")
-                self.expansions = {}
-                self._expansion_cache.clear()
+                    expansions = {}; keys = ()
+            except Exception as e:
+                logger.error(f"Falha ao carregar expansões de {self.store.path}: {e}", exc_info=True)
+                expansions = {}; keys = ()
+            self._body_cache.clear()
+            self.previews.clear()
+            self.templates.clear()
+            self.library.rebuild(keys, expansions if self.store.resident else None)
+            self._build_profile_views(keys, expansions if self.store.resident else None)
+            # Com store não residente os corpos só são lidos na expansão; os planos são compilados ali.
+            if expansions:
+                templates = self.templates.prime(expansions.items())
+                if templates: logger.info(f"{templates} macros com placeholders compiladas.")
+
+    def _build_profile_views(self, keys: Iterable[str], bodies: Optional[Dict[str, str]]) -> None:
+        profiles = self.profiles
+        if profiles is None:
+            self._profile_views = {}; self._process_views = {}
+            self._default_view = self.active_view = self._full_view
+            return
+        members: Dict[str, List[str]] = {name: [] for name in profiles.names}
+        global_keys: List[str] = []
+        for key in keys:
+            names = profiles.profiles_for(key)
+            if not names: global_keys.append(key)
+            for name in names: members[name].append(key)
+
+        def build(name: str, view_keys: List[str]) -> ProfileView:
+            library = MacroLibrary()
+            library.rebuild(view_keys, {k: bodies[k] for k in view_keys} if bodies is not None else None)
+            return ProfileView(name, library, self.get_preview)
+
+        views = {name: build(name, members[name] + global_keys if profiles.include_global[name] else members[name]) for name in profiles.names}
+        self._profile_views = views
+        self._default_view = self.active_view = build("global", global_keys)
+        self._process_views = {process: views[name] for process, name in profiles.by_process.items()}
+        logger.info(f"Perfis: {len(global_keys)} macros globais; " + ", ".join(f"{name}: {len(view.library)}" for name, view in views.items()))
+
+    def _views_for_key(self, key: str) -> List[ProfileView]:
+        if self.profiles is None: return []
+        names = self.profiles.profiles_for(key)
+        if names: return [self._profile_views[name] for name in names if name in self._profile_views]
+        return [self._default_view] + [view for name, view in self._profile_views.items() if self.profiles.include_global[name]]
+
+    def _refresh_profile(self) -> None:
+        # Thread do hook, só no ctrl+space e no "/" que inicia um atalho: consulta o aplicativo em
+        # primeiro plano e troca a visão ativa (uma busca em dict e uma atribuição).
+        if self.profiles is None: return
+        try: process = self.foreground_probe()
+        except Exception as e:
+            logger.debug("Foreground probe failed: %s", e); return
+        view = self._process_views.get(process, self._default_view)
+        if view is not self.active_view:
+            self.active_view = view
+            self.metrics.counter("profiles.switches").inc()
+            if logger.isEnabledFor(logging.DEBUG): logger.debug("Perfil ativo: %s (%s)", view.name, process)
+
+    def _open_store(self) -> None:
+        storage = str(self.settings.get("storage", "json")).lower()
+        if storage == "sqlite":
+            if isinstance(self.store, SqliteMacroStore): return
+            db_path = os.path.join(os.path.dirname(self.expansions_file), self.SQLITE_FILE_NAME)
+            try:
+                self.store = SqliteMacroStore(db_path, migrate_from=self.expansions_file)
+                return
+            except Exception as e:
+                logger.error(f"Falha ao abrir {db_path}: {e}. Usando {self.expansions_file}.", exc_info=True)
+        elif storage in ("mmap", "compressed"):
+            store_class, file_name = (MappedMacroStore, self.MMAP_FILE_NAME) if storage == "mmap" else (CompressedMacroStore, self.COMPRESSED_FILE_NAME)
+            if type(self.store) is store_class: return
+            store_path = os.path.join(os.path.dirname(self.expansions_file), file_name)
+            try:
+                self.store = store_class(store_path, migrate_from=self.expansions_file)
+                return
             except Exception as e:
-                logger.error(f"Falha ao carregar expansões de {self.expansions_file}: {e}", exc_info=True)
-                self.expansions = {}
-                self._expansion_cache.clear()
+                logger.error(f"Falha ao abrir {store_path}: {e}. Usando {self.expansions_file}.", exc_info=True)
+        elif storage != "json":
+            logger.warning(f"Valor desconhecido para 'storage' em settings.json: '{storage}'. Usando json.")
+        if isinstance(self.store, JsonMacroStore) and self.store.path == self.expansions_file: return
+        self.store = JsonMacroStore(self.expansions_file)
 
     def save_expansions(self) -> None:
-        with self._load_lock:
+        # Snapshot completo (atômico). Edições individuais não precisam disso: set_macro/remove_macro
+        # vão para o journal.
+        with self._load_lock, self.metrics.timer("store.save_expansions"):
             try:
                 exp_dir = os.path.dirname(self.expansions_file)
                 if not os.path.exists(exp_dir):
@@ -304,183 +2716,462 @@ class MacroManager:
                         logger.error(f"Não foi possível criar diretório {exp_dir} para salvar expansões: {e}. Salvamento pode falhar.")
                         return
 
-                with open(self.expansions_file, "w", encoding="utf-8") as f:
-                    json.dump(self.expansions, f, ensure_ascii=False, indent=4)
-                self._expansion_cache.clear()
-                self._expansion_cache.update(self.expansions)
-                logger.info(f"Successfully saved {len(self.expansions)} macros to {self.expansions_file}")
+                if not self.store.resident:
+                    # Cada mutação já foi gravada pelo store; não há snapshot em memória para regravar.
+                    logger.debug("save_expansions: store '%s' persiste por mutação, nada a gravar.", self.store.name)
+                    return
+                data = self.library.snapshot.to_dict()
+                self.store.write_snapshot(data)
+                logger.info(f"Successfully saved {len(data)} macros to {self.expansions_file}")
             except Exception as e:
                 logger.error(f"Falha ao salvar expansões em {self.expansions_file}: {e}")
 
+    def _persist_set(self, key: str, text: str) -> None:
+        try:
+            self.store.put(key, text)
+        except Exception as e:
+            logger.error(f"Falha ao registrar '{key}' no journal: {e}. Gravando snapshot completo.")
+            self.save_expansions(); return
+        if self.store.needs_compaction(): self.store.compact_in_background(self.library.snapshot.to_dict)
+
+    def _persist_delete(self, key: str) -> None:
+        try:
+            self.store.delete(key)
+        except Exception as e:
+            logger.error(f"Falha ao registrar remoção de '{key}' no journal: {e}. Gravando snapshot completo.")
+            self.save_expansions(); return
+        if self.store.needs_compaction(): self.store.compact_in_background(self.library.snapshot.to_dict)
+
+    def has_macro(self, key: str) -> bool:
+        return key in self.library
+
+    def macro_count(self) -> int:
+        return len(self.library)
+
+    def get_body(self, key: str) -> Optional[str]:
+        if self.store is None or self.store.resident: return self.library.snapshot.get_body(key)
+        body = self._body_cache.get(key)
+        if body is None:
+            body = self.store.get_body(key)
+            if body is not None: self._body_cache.put(key, body)
+        return body
+
+    def get_preview(self, key: str, max_chars: int = PreviewCache.MAX_CHARS) -> str:
+        return self.previews.get(key, max_chars)
+
+    def get_first_line(self, key: str, max_chars: int = 120) -> str:
+        if self.store is None or self.store.resident: body = self.library.snapshot.get_body(key) or ""
+        else: body = self._body_cache.get(key) or self.store.get_preview(key, max_chars)
+        end = body.find("\n", 0, max_chars)
+        return body[:end] if end != -1 else body[:max_chars]
+
+    def search_macros(self, filter_text: str, limit: int = 100, all_profiles: bool = False) -> List[str]:
+        # O popup busca no perfil ativo; a lista da janela principal (all_profiles) em todas as macros.
+        view = self._full_view if all_profiles else self.active_view
+        if not self.fuzzy_suggestions:
+            return view.library.matches(filter_text, limit)
+        return view.matcher.search(filter_text, limit=limit, include_body=self.match_body_in_suggestions)
+
+    def set_macro(self, key: str, text: str, old_key: Optional[str] = None, persist: bool = True) -> None:
+        self.library_ready.wait()
+        if old_key is not None and old_key != key:
+            self.remove_macro(old_key, persist=persist)
+        with self._mutation_lock:
+            resident = self.store is None or self.store.resident
+            if not resident: self._body_cache.put(key, text)
+            self.library.set(key, text if resident else None)
+            for view in self._views_for_key(key): view.library.set(key, text if resident else None)
+            self.previews.invalidate(key)
+            self.templates.discard(key); self.templates.prime(((key, text),))
+        if persist: self._persist_set(key, text)
+
+    def remove_macro(self, key: str, persist: bool = True) -> bool:
+        self.library_ready.wait()
+        with self._mutation_lock:
+            if not self.library.remove(key): return False
+            for view in self._views_for_key(key): view.library.remove(key)
+            self._body_cache.discard(key)
+            self.previews.invalidate(key)
+            self.templates.discard(key)
+        if persist: self._persist_delete(key)
+        return True
+
+    def import_macros(self, path: str, fmt: Optional[str] = None, on_conflict: str = "skip", dry_run: bool = False) -> ImportReport:
+        # Lê em fluxo e valida cada registro como os diálogos de adicionar/editar; repetições no
+        # arquivo: vale a última. Só o lote aceito fica em memória e é aplicado de uma vez.
+        if on_conflict not in ("skip", "overwrite"): raise ValueError(f"on_conflict inválido: '{on_conflict}' (use skip ou overwrite)")
+        self.library_ready.wait()
+        fmt = detect_macro_format(path, fmt)
+        report = ImportReport(path, fmt, on_conflict, dry_run)
+        start = time.perf_counter()
+        batch: Dict[str, str] = {}
+        try:
+            for record, key, text, error in iter_macro_records(path, fmt):
+                report.records += 1
+                if error is None and not (isinstance(key, str) and isinstance(text, str)): error = "atalho e texto devem ser texto"
+                if error is None:
+                    key, text = key.strip(), text.strip()
+                    error = validate_macro(key, text)
+                if error is not None:
+                    report.add_invalid(record, error); continue
+                if key in batch: report.duplicates += 1
+                batch[key] = text
+        except (OSError, ValueError) as e:
+            # Erro de sintaxe no formato expansions.json: nada do arquivo é aplicado.
+            logger.error(f"Importação de {path} interrompida: {e}")
+            report.error = str(e); batch = {}
+        accepted: Dict[str, str] = {}
+        for key, text in batch.items():
+            current = self.get_body(key) if key in self.library else None
+            if current is None: report.added += 1
+            elif current == text: report.unchanged += 1; continue
+            else:
+                report.conflicts.add(key)
+                if on_conflict == "skip": continue
+                report.updated += 1
+            accepted[key] = text
+        if accepted and not dry_run: self.apply_macro_batch(accepted)
+        report.seconds = time.perf_counter() - start
+        self.metrics.counter("import.macros").inc(0 if dry_run else len(accepted))
+        logger.info(f"Importação de {path} ({fmt}) em {report.seconds * 1000:.1f} ms: {report.summary()}")
+        return report
+
+    def apply_macro_batch(self, batch: Dict[str, str]) -> None:
+        # Lote de inclusões/atualizações: um único rebuild do índice e dos perfis (em vez de um
+        # overlay por macro) e uma única gravação no store. A cópia e o rebuild ficam sob o
+        # _mutation_lock: uma edição avulsa feita durante a importação entra antes ou depois, nunca se perde.
+        with self._load_lock, self._mutation_lock:
+            resident = self.store is None or self.store.resident
+            if resident:
+                data = self.library.snapshot.to_dict(); data.update(batch)
+                keys = data.keys()
+            else:
+                data = None
+                keys = set(self.library.snapshot.iter_keys()); keys.update(batch)
+                for key in batch: self._body_cache.discard(key)
+            self.library.rebuild(keys, data)
+            self._build_profile_views(keys, data)
+            self.previews.clear()
+            for key in batch: self.templates.discard(key)
+            self.templates.prime(batch.items())
+        if resident:
+            self.save_expansions(); return
+        try:
+            self.store.put_many(batch.items())
+        except Exception as e:
+            logger.error(f"Falha ao gravar lote de {len(batch)} macros em {self.store.path}: {e}", exc_info=True); return
+        if self.store.needs_compaction(): self.store.compact_in_background(self.library.snapshot.to_dict)
+
+    def export_macros(self, path: str, fmt: Optional[str] = None) -> int:
+        # Em fluxo, na ordem do índice; com store não residente os corpos são lidos um a um.
+        self.library_ready.wait()
+        fmt = detect_macro_format(path, fmt)
+        snapshot = self.library.snapshot
+        resident = self.store is None or self.store.resident
+        get_body = snapshot.get_body if resident else self.store.get_body
+
+        def items() -> Iterable[Tuple[str, str]]:
+            for key in snapshot.iter_keys():
+                body = get_body(key)
+                if body is not None: yield key, body
+
+        start = time.perf_counter()
+        count = write_macro_records(path, items(), fmt)
+        logger.info(f"Exportadas {count} macros para {path} ({fmt}) em {(time.perf_counter() - start) * 1000:.1f} ms")
+        return count
+
+    def _register_metrics(self) -> None:
+        metrics = self.metrics
+        metrics.add_histogram(self.hook_latency)
+        metrics.add_histogram(self.injection_latency)
+        metrics.add_collector("library", lambda: {"size": len(self.library), "version": self.library.version,
+                                                  "rebases": self.library.rebases, "overlay": self.library.snapshot.overlay_size,
+                                                  "store": self.store.name if self.store else None,
+                                                  "load_ms": round(self.load_seconds * 1000, 1) if self.load_seconds is not None else None})
+        metrics.add_collector("preview_cache", lambda: {"entries": len(self.previews), "hits": self.previews.hits, "misses": self.previews.misses})
+        metrics.add_collector("body_cache", lambda: {"entries": len(self._body_cache), "capacity": self._body_cache.capacity,
+                                                     "hits": self._body_cache.hits, "misses": self._body_cache.misses})
+        metrics.add_collector("profiles", lambda: {"active": self.active_view.name, "active_size": len(self.active_view.library),
+                                                   "profiles": len(self._profile_views)})
+        metrics.add_collector("template_cache", lambda: {"entries": len(self.templates), "hits": self.templates.hits, "compiles": self.templates.compiles})
+        metrics.add_collector("injection_worker", lambda: {"submitted": self.injection_worker.submitted, "completed": self.injection_worker.completed,
+                                                           "failed": self.injection_worker.failed})
+        clipboard = getattr(self.injection_policy.clipboard_backend, "clipboard", None)
+        if clipboard is not None: metrics.add_collector("clipboard", lambda: dict(clipboard.stats))
+
+    def _after_library_ready(self, action: callable, name: str) -> bool:
+        # Ganchos de inicialização que usam o store: com carga em segundo plano (store ainda None ou
+        # migrando) rodam numa thread que espera library_ready, sem segurar a criação da janela.
+        # Retorna True se a ação foi adiada.
+        if self.library_ready.is_set(): return False
+        def run():
+            self.library_ready.wait()
+            if self.is_running: action()
+        threading.Thread(target=run, name=name, daemon=True).start()
+        return True
+
+    def start_metrics_server(self) -> None:
+        port = self.settings.get("metrics_port")
+        if not self.metrics.enabled or port is None or self.metrics_server is not None: return
+        if self._after_library_ready(self.start_metrics_server, "MetricsServerStartThread"): return
+        server = MetricsServer(self.metrics, int(port))
+        if server.start(): self.metrics_server = server
+
+    def export_metrics(self) -> Optional[str]:
+        try: return self.metrics.export()
+        except OSError as e:
+            logger.error(f"Falha ao exportar métricas: {e}")
+            return None
+
+    def start_recording(self, path: str, anonymize: bool = True) -> None:
+        if self.recorder is not None: return
+        self.recorder = KeystrokeRecorder(path, anonymize=anonymize)
+        logger.info(f"Gravando teclas em {path} (anonimizado: {anonymize})")
+
+    def stop_recording(self) -> None:
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None: recorder.close()
+
+    def register_template_input_callback(self, callback: callable) -> None:
+        # callback(macro_key, nomes) -> {nome: valor} ou None (cancelado); chamado na thread de injeção.
+        self.template_input_callback = callback
+
     def register_suggestion_ui_callback(self, callback: callable) -> None:
         self.suggestion_ui_callback = callback
 
+    def register_library_change_callback(self, callback: callable) -> None:
+        # callback(delta) é chamado na thread do watcher; quem registra decide em que thread aplicar.
+        self.library_change_callback = callback
+
+    def start_file_watcher(self) -> None:
+        if not self.settings.get("hot_reload", True) or self.file_watcher is not None: return
+        if self._after_library_ready(self.start_file_watcher, "FileWatcherStartThread"): return
+        interval = float(self.settings.get("hot_reload_interval", 1.0))
+        self.file_watcher = MacroFileWatcher(self.expansions_file, self.reload_from_disk, interval=interval, is_own_write=self._is_own_write,
+                                             on_start=self._prepare_file_watch)
+        self.file_watcher.start()
+
+    def _is_own_write(self, signature: Tuple[int, int]) -> bool:
+        return isinstance(self.store, JsonMacroStore) and self.store.last_write_signature == signature
+
+    def _prepare_file_watch(self) -> None:
+        # Thread do watcher: com carga em segundo plano o store só existe depois de library_ready
+        # (a migração do sqlite/mmap pode demorar).
+        self.library_ready.wait()
+        if not self.store.resident: self._capture_json_baseline()
+
+    def _capture_json_baseline(self) -> None:
+        try: self._json_baseline = LibraryDelta.fingerprints(JsonMacroStore(self.expansions_file).load(strict=True))
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Não foi possível ler {self.expansions_file} como referência para recargas: {e}")
+
+    def reload_from_disk(self) -> Optional[LibraryDelta]:
+        # Roda na thread do watcher: lê e compara fora das threads do hook e do Tk.
+        self.library_ready.wait()
+        start = time.perf_counter()
+        try:
+            if self.store.resident:
+                # Snapshot externo + journal local: edições ainda não compactadas continuam valendo.
+                new = self.store.load(strict=True)
+                delta = LibraryDelta.between(self.library.snapshot.to_dict(), new)
+            else:
+                # O expansions.json é comparado com a versão anterior dele mesmo, não com o store:
+                # as edições feitas no app só existem no store e não podem ser desfeitas aqui.
+                new = JsonMacroStore(self.expansions_file).load(strict=True)
+                previous, self._json_baseline = self._json_baseline, LibraryDelta.fingerprints(new)
+                if previous is None:
+                    logger.warning(f"{self.expansions_file} mudou sem versão anterior conhecida; guardada como referência, nada aplicado.")
+                    return LibraryDelta({}, [], {})
+                delta = LibraryDelta.between_versions(previous, new, self.has_macro)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Recarga de {self.expansions_file} adiada: {e}")
+            return None
+        logger.info(f"Reloaded {self.expansions_file} in {(time.perf_counter() - start) * 1000:.1f} ms: {delta.summary()}")
+        if not len(delta): return delta
+        if self.library_change_callback: self.library_change_callback(delta)
+        else: self.apply_library_delta(delta)
+        return delta
+
+    def apply_library_delta(self, delta: LibraryDelta) -> None:
+        # O arquivo JSON já contém a nova versão; os demais stores recebem a alteração linha a linha.
+        persist = not self.store.resident
+        for key in delta.removed: self.remove_macro(key, persist=persist)
+        for key, text in delta.added.items(): self.set_macro(key, text, persist=persist)
+        for key, text in delta.changed.items(): self.set_macro(key, text, persist=persist)
+
     def _trigger_suggestion_ui(self, command: str, data: Optional[Any] = None) -> None:
         if self.suggestion_ui_callback:
             self.suggestion_ui_callback(command, data)
 
     def try_apply_macro(self, macro_key_to_apply: str, typed_length_to_delete: int) -> bool:
-        if macro_key_to_apply in self._expansion_cache:
-            logger.info(f"Applying macro '{macro_key_to_apply}', deleting {typed_length_to_delete} chars.")
-            logger.debug(f"try_apply_macro: current_typed before action: '{self.current_typed}' for macro '{macro_key_to_apply}'")
+        # Versão síncrona (executa na thread chamadora); o caminho normal é request_macro_application.
+        job = self._build_injection_job(macro_key_to_apply, typed_length_to_delete)
+        if job is None: return False
+        self.is_applying_macro_flag = True
+        job.started_at = time.perf_counter()
+        try: self._execute_injection_job(job)
+        except Exception as e:
+            job.error = str(e)
+            logger.error("Error during macro application keyboard events: %s", e, exc_info=True)
+        job.finished_at = time.perf_counter()
+        self._on_injection_complete(job)
+        return job.ok
 
-            self.is_applying_macro_flag = True
-            macro_text = self._expansion_cache[macro_key_to_apply]
+    def _build_injection_job(self, macro_key_to_apply: str, typed_length_to_delete: int) -> Optional["InjectionJob"]:
+        if macro_key_to_apply not in self.library:
+            logger.warning("Macro key '%s' not found in cache for application.", macro_key_to_apply)
+            return None
+        # O corpo é resolvido na thread de injeção (pode exigir leitura do store), não na thread do hook.
+        return InjectionJob(macro_key_to_apply, None, typed_length_to_delete, self.suggestion_popup_active)
 
-            if self.suggestion_popup_active:
-                logger.debug("try_apply_macro: Hiding suggestion popup BEFORE sending keys.")
-                self._trigger_suggestion_ui("hide")
-                # VALOR CRÍTICO PARA AJUSTE:
-                sleep_duration_for_focus_return = 0.7 # <<<<<< VALOR AUMENTADO PARA TESTE DE FOCO
-                logger.debug(f"try_apply_macro: Pausing for {sleep_duration_for_focus_return}s for focus to return...")
-                time.sleep(sleep_duration_for_focus_return)
-                logger.debug("try_apply_macro: Paused after hide, attempting key operations.")
-            else:
-                time.sleep(0.05)
+    def _execute_injection_job(self, job: "InjectionJob") -> None:
+        logger.info("Applying macro '%s' (job %s), deleting %s chars.", job.macro_key, job.job_id, job.chars_to_delete)
+        if job.hide_popup_first: self._trigger_suggestion_ui("hide")
+        if job.text is None:
+            with job.stage("load_body"): job.text = self.get_body(job.macro_key)
+            if job.text is None: raise KeyError(f"macro '{job.macro_key}' removida antes da injeção")
+        template = self.templates.get(job.macro_key, job.text)
+        if template is not None:
+            rendered = self._render_template(job, template)
+            if rendered is None:
+                job.error = "expansão cancelada pelo usuário"; return
+            job.text = rendered
+        # Depois do popup ou de uma janela pedindo {input:...}, o foco precisa voltar à janela de destino.
+        if job.hide_popup_first or (template is not None and template.inputs):
+            with job.stage("focus_wait"): time.sleep(self.FOCUS_RETURN_DELAY)
+        else:
+            with job.stage("pre_delay"): time.sleep(self.PRE_INJECTION_DELAY)
 
+        backend = self.injection_policy.choose(job.text)
+        job.backend = backend.name
+        backend.delete_chars(job.chars_to_delete, job)
+        backend.insert_text(job.text, job)
+        job.ok = True
 
-            try:
-                logger.debug(f"Sending {typed_length_to_delete} backspaces.")
-                for _ in range(typed_length_to_delete):
-                    keyboard.send("backspace")
-                time.sleep(0.05) # Pequena pausa após backspaces
-
-                # Salvar conteúdo atual da área de transferência
-                original_clipboard_content = pyperclip.paste()
-                logger.debug("Original clipboard content saved.")
-
-                # Copiar texto da macro para a área de transferência
-                pyperclip.copy(macro_text)
-                logger.debug(f"Macro text '{macro_text[:30]}...' copied to clipboard.")
-                time.sleep(0.05) # Pausa para garantir que a cópia foi processada
-
-                # Colar (Ctrl+V ou Cmd+V)
-                if sys.platform == "darwin": # macOS
-                    keyboard.send("command+v")
-                    logger.debug("Sent command+v (macOS).")
-                else: # Windows/Linux
-                    keyboard.send("ctrl+v")
-                    logger.debug("Sent ctrl+v.")
-                time.sleep(0.05) # Pausa após colar
-
-                # Restaurar conteúdo original da área de transferência
-                pyperclip.copy(original_clipboard_content)
-                logger.debug("Original clipboard content restored.")
-
-                self.show_notification(f"Macro '{macro_key_to_apply}' aplicada")
-            except Exception as e:
-                logger.error(f"Error during macro application keyboard events: {e}", exc_info=True)
-            finally:
-                self.is_applying_macro_flag = False
-                self.current_typed = ""
-                if self.suggestion_popup_active:
-                     logger.debug("try_apply_macro finally: suggestion_popup_active is still true, ensuring hide (callback will set it to false).")
-                     self._trigger_suggestion_ui("hide")
+    def _render_template(self, job: "InjectionJob", template: MacroTemplate) -> Optional[str]:
+        values: Optional[Dict[str, str]] = {}
+        if template.inputs and self.template_input_callback:
+            with job.stage("input"): values = self.template_input_callback(job.macro_key, template.inputs)
+            if values is None: return None
+        with job.stage("render"): return template.render(self._user_clipboard_text, values)
 
-                logger.debug(f"try_apply_macro: Cleanup done. current_typed='{self.current_typed}', is_applying_macro_flag={self.is_applying_macro_flag}, popup_active={self.suggestion_popup_active}")
-            return True
+    def _user_clipboard_text(self) -> str:
+        clipboard = getattr(self.injection_policy.clipboard_backend, "clipboard", None)
+        try: return clipboard.user_text() if clipboard is not None else pyperclip.paste()
+        except Exception as e:
+            logger.error(f"Não foi possível ler a área de transferência para {{clipboard}}: {e}")
+            return ""
 
-        logger.warning(f"Macro key '{macro_key_to_apply}' not found in cache for application.")
-        return False
+    def _on_injection_complete(self, job: "InjectionJob") -> None:
+        self.injection_latency.record(job.total_seconds())
+        if self.metrics.enabled: self._record_injection_metrics(job)
+        if job.ok:
+            logger.info("Macro '%s' (job %s, %s) applied in %.1f ms. Stages (ms): %s", job.macro_key, job.job_id, job.backend, job.total_seconds() * 1000, job.stage_summary())
+            self.show_notification(f"Macro '{job.macro_key}' aplicada")
+        else:
+            logger.error("Macro '%s' (job %s) failed after %.1f ms: %s", job.macro_key, job.job_id, job.total_seconds() * 1000, job.error)
+        if not self.injection_worker.has_pending():
+            self.current_typed = ""
+            self.is_applying_macro_flag = False
+        if self.suggestion_popup_active:
+            logger.debug("Injection complete: suggestion_popup_active is still true, ensuring hide.")
+            self._trigger_suggestion_ui("hide")
 
+    def _record_injection_metrics(self, job: "InjectionJob") -> None:
+        metrics = self.metrics
+        metrics.counter("injection.ok" if job.ok else "injection.failed").inc()
+        if job.backend: metrics.counter(f"injection.backend.{job.backend}").inc()
+        if job.started_at is not None: metrics.histogram("injection.stage.queued").record(job.started_at - job.enqueued_at)
+        for stage, seconds in job.stages.items(): metrics.histogram(f"injection.stage.{stage}").record(seconds)
 
-    def on_key_press(self, event: keyboard.KeyboardEvent) -> None:
-        if self.is_applying_macro_flag:
-            logger.debug(f"on_key_press: Ignored (is_applying_macro_flag). Key: {event.name}")
-            return
+    def on_key_press(self, event: keyboard.KeyboardEvent, now: Optional[float] = None) -> None:
+        # Roda na thread do hook do 'keyboard': só atualiza o buffer digitado e enfileira trabalho.
+        # Uma única leitura de relógio, conjuntos pré-compilados e logs só quando DEBUG está ativo.
+        # 'now' só é passado pelo replay de traces (relógio virtual).
+        start = time.perf_counter()
+        if now is None: now = start
+        if self.recorder is not None: self.recorder.record("k", event.name, now, self)
+        self._handle_key_press(event.name, now)
+        self.hook_latency.record(time.perf_counter() - start)
 
-        HOTKEY_IGNORE_WINDOW = 0.25
-        keys_to_ignore_post_hotkey = ['ctrl', 'left ctrl', 'right ctrl', 'space', 'alt', 'left alt', 'right alt', 'shift', 'left shift', 'right shift']
-        if time.time() - self.last_hotkey_press_time < HOTKEY_IGNORE_WINDOW and \
-           event.name in keys_to_ignore_post_hotkey:
-            logger.debug(f"on_key_press: Ignored (hotkey component filter). Key: '{event.name}', TimeDiff: {time.time() - self.last_hotkey_press_time:.3f}s")
+    def _handle_key_press(self, name: Optional[str], now: float) -> None:
+        if self.is_applying_macro_flag or name is None or not self.is_running:
             return
-
-        if not self.is_running or event.name is None:
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if name in _HOTKEY_COMPONENT_KEYS and now - self.last_hotkey_press_time < self.HOTKEY_IGNORE_WINDOW:
+            if debug: logger.debug("on_key_press: Ignored (hotkey component filter). Key: '%s'", name)
             return
 
         try:
-            logger.debug(f"on_key_press: START - key='{event.name}', current_typed='{self.current_typed}', popup_active={self.suggestion_popup_active}")
+            if debug: logger.debug("on_key_press: key='%s', current_typed='%s', popup_active=%s", name, self.current_typed, self.suggestion_popup_active)
 
             if self.suggestion_popup_active:
-                if event.name in ["ctrl", "alt", "shift", "left ctrl", "right ctrl", "left alt", "right alt", "left shift", "right shift", "caps lock", "cmd", "option", "windows"]:
-                    logger.debug(f"on_key_press: Ignored modifier key '{event.name}' while popup active.")
+                if name in _MODIFIER_KEYS:
                     return
-
-                logger.debug(f"Popup active, processing key: {event.name}")
-                if event.name == "esc": # Correção: 'esc' é o nome canônico para Escape
+                if name == "esc": # Correção: 'esc' é o nome canônico para Escape
                     self._trigger_suggestion_ui("hide")
                     return
-                if event.name in ["up", "down"]:
-                    self._trigger_suggestion_ui("navigate", event.name)
+                if name in _NAVIGATION_DELTAS:
+                    self._trigger_suggestion_ui("navigate", _NAVIGATION_DELTAS[name])
                     return
-                if event.name in ["space", "enter", "tab"]:
-                    logger.debug(f"on_key_press: Popup selection key '{event.name}', current_typed to be sent: '{self.current_typed}'")
+                if name in _SELECTION_KEYS:
                     self._trigger_suggestion_ui("select_or_close", self.current_typed)
                     return
-                elif event.name == "backspace":
+                elif name == "backspace":
                     if self.current_typed:
                         self.current_typed = self.current_typed[:-1]
-                        logger.debug(f"on_key_press: Backspace, current_typed now: '{self.current_typed}'")
                         if not self.current_typed.startswith('/'):
                             self._trigger_suggestion_ui("hide")
-                            logger.debug("on_key_press: Backspace, hiding popup (current_typed no longer starts with /)")
                         else:
-                            filtered_macros = [m for m in self.expansions.keys() if m.startswith(self.current_typed)]
-                            if not filtered_macros and self.current_typed == "/":
-                                logger.debug("on_key_press: Backspace, current_typed is '/', updating with empty list.")
-                                self._trigger_suggestion_ui("update", {"macros": [], "filter": self.current_typed})
-                            elif not filtered_macros :
-                                logger.debug(f"on_key_press: Backspace, no macros for '{self.current_typed}'. Hiding.")
+                            match_count = self.active_view.cursor.seek(self.current_typed)
+                            if not match_count and self.current_typed != "/" and not self.fuzzy_suggestions:
                                 self._trigger_suggestion_ui("hide")
                             else:
-                                self._trigger_suggestion_ui("update", {"macros": filtered_macros, "filter": self.current_typed})
+                                self._trigger_suggestion_ui("update", {"count": match_count, "filter": self.current_typed})
                     else:
-                        logger.debug("on_key_press: Backspace with empty current_typed in active popup. Hiding.")
                         self._trigger_suggestion_ui("hide")
                     return
-                elif len(event.name) == 1 and event.name.isprintable():
-                    self.current_typed += event.name
-                    logger.debug(f"on_key_press: Printable char, current_typed now: '{self.current_typed}'")
-                    filtered_macros = [m for m in self.expansions.keys() if m.startswith(self.current_typed)]
-                    if not filtered_macros:
-                         logger.debug(f"on_key_press: No macros match '{self.current_typed}'. Hiding popup.")
-                         self._trigger_suggestion_ui("hide")
+                elif len(name) == 1 and name.isprintable():
+                    self.current_typed += name
+                    match_count = self.active_view.cursor.seek(self.current_typed)
+                    if not match_count and not self.fuzzy_suggestions:
+                        self._trigger_suggestion_ui("hide")
                     else:
-                        self._trigger_suggestion_ui("update", {"macros": filtered_macros, "filter": self.current_typed})
-                    return
-                logger.debug(f"on_key_press: Ignored unhandled key '{event.name}' while popup active.")
+                        self._trigger_suggestion_ui("update", {"count": match_count, "filter": self.current_typed})
                 return
 
             if self.current_typed.startswith("/"):
-                if event.name in ["space", "enter", "tab"]:
-                    if self.current_typed in self._expansion_cache:
-                        logger.info(f"Direct expansion: '{self.current_typed}' by '{event.name}'")
-                        self.try_apply_macro(self.current_typed, len(self.current_typed) + 1)
+                if name in _SELECTION_KEYS:
+                    if self.current_typed in self.active_view.library:
+                        if debug: logger.debug("Direct expansion: '%s' by '%s'", self.current_typed, name)
+                        self.request_macro_application(self.current_typed, len(self.current_typed) + 1)
                     else:
-                        logger.debug(f"Direct expansion: '{self.current_typed}' not a macro. Clearing.")
                         self.current_typed = ""
-                elif event.name == "backspace":
+                elif name == "backspace":
                     self.current_typed = self.current_typed[:-1]
-                    logger.debug(f"Direct: Backspace, current_typed: '{self.current_typed}'")
-                elif len(event.name) == 1 and event.name.isprintable():
-                    self.current_typed += event.name
-                    logger.debug(f"Direct: Printable, current_typed: '{self.current_typed}'")
-                elif event.name not in keys_to_ignore_post_hotkey + ["caps lock", "esc", "cmd", "option", "windows"]:
-                    logger.debug(f"Direct: Non-handled key '{event.name}' with '{self.current_typed}'. Clearing.")
+                elif len(name) == 1 and name.isprintable():
+                    self.current_typed += name
+                elif name not in _DIRECT_MODE_IGNORED_KEYS:
                     self.current_typed = ""
-            elif event.name == "/":
+            elif name == "/":
                 self.current_typed = "/"
-                logger.debug(f"Direct: Slash typed, current_typed set to: '{self.current_typed}'")
-
-            logger.debug(f"on_key_press: END - current_typed='{self.current_typed}'")
+                self._refresh_profile()
         except Exception as e:
-            logger.error(f"Error processing key in on_key_press: {e}", exc_info=True)
+            logger.error("Error processing key in on_key_press: %s", e, exc_info=True)
             self.current_typed = ""
 
+    def request_macro_application(self, macro_key_to_apply: str, typed_length_to_delete: int) -> Optional["InjectionJob"]:
+        # A flag é ligada já na thread que pede a expansão, para que as teclas seguintes (inclusive os
+        # backspaces/ctrl+v sintéticos) sejam ignoradas até o worker terminar.
+        job = self._build_injection_job(macro_key_to_apply, typed_length_to_delete)
+        if job is None: return None
+        self.is_applying_macro_flag = True
+        self.injection_worker.submit(job)
+        return job
 
-    def activate_suggestion_mode(self) -> None:
-        self.last_hotkey_press_time = time.time()
+    def activate_suggestion_mode(self, now: Optional[float] = None) -> None:
+        self.last_hotkey_press_time = time.perf_counter() if now is None else now
+        if self.recorder is not None: self.recorder.record("h", None, self.last_hotkey_press_time, self)
 
         if self.is_applying_macro_flag:
             logger.info("activate_suggestion_mode: Macro application in progress, ignoring hotkey.")
@@ -498,7 +3189,9 @@ class MacroManager:
             logger.info("Hotkey (ctrl+space) pressed. Activating suggestion mode. Current typed before reset: '%s'", self.current_typed)
             self.current_typed = "/"
             logger.info(f"activate_suggestion_mode: current_typed SET TO: '{self.current_typed}'")
-            self._trigger_suggestion_ui("show", {"macros": list(self.expansions.keys()), "filter": self.current_typed})
+            self._refresh_profile()
+            match_count = self.active_view.cursor.reset(self.current_typed)
+            self._trigger_suggestion_ui("show", {"count": match_count, "filter": self.current_typed})
 
 
     def start_listener(self) -> None:
@@ -579,8 +3272,22 @@ class MacroManager:
             logger.info("Cleanup: Stopping manager and listeners...")
             self.is_running = False
             self.stop_listener()
+            self.stop_recording()
+            if self.file_watcher is not None: self.file_watcher.stop()
+            if self.metrics_server is not None: self.metrics_server.stop()
+            self.injection_worker.stop()
+            if self.store is not None: self.store.close()
+            clipboard = getattr(self.injection_policy.clipboard_backend, "clipboard", None)
+            if clipboard is not None:
+                clipboard.flush()
+                logger.info(f"Cleanup: Clipboard stats: {dict(clipboard.stats)}")
+            logger.info(f"Cleanup: Injection latency: {self.injection_latency.summary()}")
+            logger.info(f"Cleanup: Hook latency: {self.hook_latency.summary()}")
+            logger.info(f"Cleanup: Preview cache: {len(self.previews)} entries, {self.previews.hits} hits, {self.previews.misses} misses")
+            if self.metrics.enabled: self.export_metrics()
 
             try:
+                import psutil
                 current_process = psutil.Process(os.getpid())
                 children = current_process.children(recursive=True)
                 if children:
@@ -612,10 +3319,15 @@ class MacroManager:
             logger.debug(f"Tray icon not available or no notification support, for message: {message}")
 
 class MacroSuggestionPopup(ctk.CTkToplevel):
-    def __init__(self, master, all_macros_dict: Dict[str, str], manager_ref: MacroManager, on_close_callback: callable):
+    MAX_RESULTS = 100
+    MAX_ITEMS_DISPLAY = 7
+    ROW_HEIGHT = 30
+    ROW_PADY = 1
+    POPUP_WIDTH = 480
+
+    def __init__(self, master, manager_ref: MacroManager, on_close_callback: callable):
         super().__init__(master)
-        logger.debug(f"MacroSuggestionPopup __init__ called. Master: {master}, Macros count: {len(all_macros_dict)}")
-        self.all_macros_dict = all_macros_dict
+        logger.debug("MacroSuggestionPopup __init__ called. Master: %s, Macros count: %s", master, manager_ref.macro_count())
         self.manager_ref = manager_ref
         self.on_close_callback = on_close_callback
 
@@ -637,7 +3349,7 @@ class MacroSuggestionPopup(ctk.CTkToplevel):
             if isinstance(self.ITEM_TEXT_COLOR, (list, tuple)) and len(self.ITEM_TEXT_COLOR) > idx: self.ITEM_TEXT_COLOR = self.ITEM_TEXT_COLOR[idx]
             if isinstance(self.ITEM_SELECTED_TEXT_COLOR, (list, tuple)) and len(self.ITEM_SELECTED_TEXT_COLOR) > idx: self.ITEM_SELECTED_TEXT_COLOR = self.ITEM_SELECTED_TEXT_COLOR[idx]
         except Exception as e:
-            logger.warning(f"Could not get theme colors for popup items from CTk ThemeManager, using fallbacks: {e}")
+            logger.warning("Could not get theme colors for popup items from CTk ThemeManager, using fallbacks: %s", e)
             appearance_mode = ctk.get_appearance_mode() # Ensure we have it
             self.ITEM_SELECTED_COLOR = "#1F6AA5"
             self.ITEM_TEXT_COLOR = "#DCE4EE" if appearance_mode == "Dark" else "#101010"
@@ -648,177 +3360,177 @@ class MacroSuggestionPopup(ctk.CTkToplevel):
         self.outer_frame.pack(expand=True, fill="both", padx=1, pady=1)
         self.inner_frame = ctk.CTkFrame(self.outer_frame, fg_color=self.BG_COLOR, corner_radius=6)
         self.inner_frame.pack(expand=True, fill="both", padx=1, pady=1)
-        self.scrollable_frame = ctk.CTkScrollableFrame(
-            self.inner_frame, fg_color="transparent",
-            scrollbar_button_color=self.ITEM_HOVER_COLOR,
-            scrollbar_button_hover_color=self.ITEM_SELECTED_COLOR, corner_radius=5
-        )
-        self.scrollable_frame.pack(expand=True, fill="both", padx=3, pady=3)
-        self.list_item_widgets: list[ctk.CTkButton] = []
-        self.current_selection_index: int = -1
+        self.rows_frame = ctk.CTkFrame(self.inner_frame, fg_color="transparent", corner_radius=5)
+        self.rows_frame.pack(expand=True, fill="both", padx=3, pady=3)
         self.item_font = CTkFont("Segoe UI", 11)
+        # Pool fixo de linhas: os botões são criados uma única vez e apenas recebem o texto/cor
+        # da janela visível de self.results; rolar ou navegar só move self.window_start.
+        self.results: List[str] = []
+        self.window_start: int = 0
+        self.current_selection_index: int = -1
+        self._visible_row_count: int = 0
+        self.row_pool: List[ctk.CTkButton] = []
+        for row_index in range(self.MAX_ITEMS_DISPLAY):
+            row = ctk.CTkButton(
+                self.rows_frame, text="", font=self.item_font,
+                fg_color=self.ITEM_FG_COLOR, hover_color=self.ITEM_HOVER_COLOR,
+                text_color=self.ITEM_TEXT_COLOR, anchor="w", height=self.ROW_HEIGHT,
+                corner_radius=4, border_spacing=8,
+                command=lambda r=row_index: self._trigger_select_action_from_click(r)
+            )
+            row._row_index = row_index; row._bound_key = None; row._bound_selected = None
+            row.bind("<Enter>", lambda e, r=row_index: self._on_item_enter(e, r))
+            row.bind("<Leave>", lambda e, r=row_index: self._on_item_leave(e, r))
+            row.bind("<MouseWheel>", self._on_mouse_wheel)
+            self.row_pool.append(row)
+        self.rows_frame.bind("<MouseWheel>", self._on_mouse_wheel)
         self.bind("<Escape>", lambda e: self.close_popup())
         self.withdraw()
         logger.debug("MacroSuggestionPopup __init__ finished.")
 
     def _clear_items(self):
-        for widget in self.list_item_widgets: widget.destroy()
-        self.list_item_widgets = []
+        self.results = []
+        self.window_start = 0
         self.current_selection_index = -1
 
-    def _highlight_item(self, index: int, select: bool):
-        if 0 <= index < len(self.list_item_widgets):
-            item_button = self.list_item_widgets[index]
-            if select: item_button.configure(fg_color=self.ITEM_SELECTED_COLOR, text_color=self.ITEM_SELECTED_TEXT_COLOR)
-            else: item_button.configure(fg_color=self.ITEM_FG_COLOR, text_color=self.ITEM_TEXT_COLOR)
+    def _row_text(self, key: str) -> str:
+        preview_char_limit = 40
+        preview_oneline = self.manager_ref.get_preview(key, preview_char_limit + 1)
+        preview_short = (preview_oneline[:preview_char_limit] + "...") if len(preview_oneline) > preview_char_limit else preview_oneline
+        return f"{key}  \u2192  {preview_short}"
 
-    def _on_item_enter(self, event, item_button: ctk.CTkButton):
+    def _set_visible_row_count(self, count: int) -> None:
+        if count == self._visible_row_count: return
+        for row in self.row_pool[count:self._visible_row_count]: row.pack_forget()
+        for row in self.row_pool[self._visible_row_count:count]: row.pack(fill="x", expand=True, padx=3, pady=self.ROW_PADY)
+        self._visible_row_count = count
+        visible_height = count * (self.ROW_HEIGHT + self.ROW_PADY * 2)
+        outer_f_pady = 1; inner_f_pady = 1; rows_f_pady = 3
+        total_vertical_padding = (outer_f_pady*2)+(inner_f_pady*2)+(rows_f_pady*2)
+        popup_total_height = min(max(visible_height + total_vertical_padding + 10, 80), 450)
+        current_geom = self.geometry()
         try:
-            index = self.list_item_widgets.index(item_button)
-            if index != self.current_selection_index:
-                item_button.configure(fg_color=self.ITEM_HOVER_COLOR)
-        except ValueError: logger.warning(f"Item not found in list_item_widgets during _on_item_enter: {item_button}")
+            current_pos_parts = current_geom.split('+')
+            if len(current_pos_parts) == 3:
+                 current_pos = "+" + current_pos_parts[1] + "+" + current_pos_parts[2]
+                 self.geometry(f"{self.POPUP_WIDTH}x{int(popup_total_height)}{current_pos}")
+            else: self.geometry(f"{self.POPUP_WIDTH}x{int(popup_total_height)}")
+        except IndexError: self.geometry(f"{self.POPUP_WIDTH}x{int(popup_total_height)}")
+        logger.debug("Geometria do popup definida para: %s", self.geometry())
 
-    def _on_item_leave(self, event, item_button: ctk.CTkButton):
-        try:
-            index = self.list_item_widgets.index(item_button)
-            if index != self.current_selection_index:
-                item_button.configure(fg_color=self.ITEM_FG_COLOR)
-        except ValueError: logger.warning(f"Item not found in list_item_widgets during _on_item_leave: {item_button}")
-
-    def _scroll_to_item(self, index: int):
-        if not self.list_item_widgets or not (0 <= index < len(self.list_item_widgets)): return
-        self.scrollable_frame.update_idletasks()
-        target_widget = self.list_item_widgets[index]
-        try:
-            widget_y_rel = target_widget.winfo_y(); widget_h = target_widget.winfo_height()
-            viewport_h = self.scrollable_frame._parent_canvas.winfo_height()
-            self.scrollable_frame._parent_canvas.update_idletasks()
-            bbox_all = self.scrollable_frame._parent_canvas.bbox("all")
-            if not bbox_all: return
-            content_h = bbox_all[3] - bbox_all[1]
-            if content_h <= viewport_h: return
-            if content_h <= 0: return
-            viewport_top_y = self.scrollable_frame._parent_canvas.canvasy(0)
-            viewport_bottom_y = viewport_top_y + viewport_h
-            widget_top_y = widget_y_rel; widget_bottom_y = widget_y_rel + widget_h
-            new_scroll_fraction = -1.0
-            if widget_top_y < viewport_top_y: new_scroll_fraction = widget_top_y / content_h
-            elif widget_bottom_y > viewport_bottom_y: new_scroll_fraction = (widget_bottom_y - viewport_h) / content_h
-            if new_scroll_fraction != -1.0:
-                new_scroll_fraction = max(0.0, min(new_scroll_fraction, 1.0))
-                self.scrollable_frame._parent_canvas.yview_moveto(new_scroll_fraction)
-                self.scrollable_frame.update_idletasks()
-        except Exception as e: logger.error(f"Error in _scroll_to_item: {e}", exc_info=True)
+    def _render_window(self) -> None:
+        # Custo constante: no máximo MAX_ITEMS_DISPLAY configure(), e só nas linhas que mudaram.
+        for row_index in range(self._visible_row_count):
+            row = self.row_pool[row_index]
+            result_index = self.window_start + row_index
+            key = self.results[result_index] if result_index < len(self.results) else None
+            selected = result_index == self.current_selection_index
+            if key != row._bound_key:
+                row.configure(text=self._row_text(key) if key is not None else "")
+                row._bound_key = key; row._bound_selected = None
+            if selected != row._bound_selected:
+                if selected: row.configure(fg_color=self.ITEM_SELECTED_COLOR, text_color=self.ITEM_SELECTED_TEXT_COLOR)
+                else: row.configure(fg_color=self.ITEM_FG_COLOR, text_color=self.ITEM_TEXT_COLOR)
+                row._bound_selected = selected
+
+    def _ensure_visible(self, index: int) -> None:
+        if index < self.window_start: self.window_start = index
+        elif index >= self.window_start + self._visible_row_count: self.window_start = index - self._visible_row_count + 1
+        self.window_start = max(0, min(self.window_start, len(self.results) - self._visible_row_count))
+
+    def _on_item_enter(self, event, row_index: int):
+        if self.window_start + row_index != self.current_selection_index:
+            self.row_pool[row_index].configure(fg_color=self.ITEM_HOVER_COLOR)
+
+    def _on_item_leave(self, event, row_index: int):
+        if self.window_start + row_index != self.current_selection_index:
+            self.row_pool[row_index].configure(fg_color=self.ITEM_FG_COLOR)
+
+    def _on_mouse_wheel(self, event) -> None:
+        self._scroll_window(-1 if event.delta > 0 else 1)
+
+    def _scroll_window(self, rows: int) -> None:
+        max_start = max(0, len(self.results) - self._visible_row_count)
+        new_start = max(0, min(self.window_start + rows, max_start))
+        if new_start != self.window_start:
+            self.window_start = new_start; self._render_window()
 
     def _navigate(self, direction: int):
-        if not self.list_item_widgets: return
+        num_items = len(self.results)
+        if not num_items: return
+        # Passos maiores que 1 vêm de navegações agregadas; a volta ao início/fim só ocorre em passos unitários.
         new_index = self.current_selection_index + direction
-        num_items = len(self.list_item_widgets)
-        if self.current_selection_index != -1 and 0 <= self.current_selection_index < num_items:
-            self._highlight_item(self.current_selection_index, False)
-        if 0 <= new_index < num_items: self.current_selection_index = new_index
-        elif new_index < 0: self.current_selection_index = num_items - 1
-        elif new_index >= num_items: self.current_selection_index = 0
-        if 0 <= self.current_selection_index < num_items:
-            self._highlight_item(self.current_selection_index, True)
-            self._scroll_to_item(self.current_selection_index)
-            if self.list_item_widgets[self.current_selection_index].winfo_exists():
-                 self.list_item_widgets[self.current_selection_index].focus_set()
-        else: self.current_selection_index = -1
+        if abs(direction) == 1:
+            if new_index < 0: new_index = num_items - 1
+            elif new_index >= num_items: new_index = 0
+        else: new_index = max(0, min(new_index, num_items - 1))
+        self.current_selection_index = new_index
+        self._ensure_visible(new_index)
+        self._render_window()
+
+    def refresh_rows(self, filter_text: str) -> None:
+        # Textos de prévia podem ter mudado para os mesmos atalhos: força a reconfiguração das linhas.
+        for row in self.row_pool: row._bound_key = None
+        self.update_suggestions(filter_text)
 
     def update_suggestions(self, filter_text: str) -> None:
+        with self.manager_ref.metrics.timer("popup.update_suggestions"): self._update_suggestions(filter_text)
+
+    def _update_suggestions(self, filter_text: str) -> None:
         self._clear_items()
-        logger.info(f"update_suggestions (com CTkButton) chamado com filtro: '{filter_text}'")
+        logger.debug("update_suggestions chamado com filtro: '%s'", filter_text)
         if not self.manager_ref.suggestion_popup_active:
             if self.winfo_viewable(): self.withdraw(); return
         if not filter_text.startswith("/"): self.close_popup(); return
-        if filter_text == "/": display_macros_keys = sorted(self.all_macros_dict.keys())
-        else: display_macros_keys = sorted([k for k in self.all_macros_dict.keys() if k.startswith(filter_text)])
-        logger.debug(f"Encontradas {len(display_macros_keys)} macros para o filtro '{filter_text}'.")
-        MAX_ITEMS_DISPLAY = 7; item_pady_outer = 1; button_height = 30
         try:
-            for i, key in enumerate(display_macros_keys):
-                preview_full = self.all_macros_dict.get(key, ""); preview_oneline = preview_full.split('\n')[0]
-                preview_char_limit = 40; preview_short = (preview_oneline[:preview_char_limit] + "...") if len(preview_oneline) > preview_char_limit else preview_oneline
-                button_text = f"{key}  \u2192  {preview_short}"
-                item_button = ctk.CTkButton(
-                    self.scrollable_frame, text=button_text, font=self.item_font,
-                    fg_color=self.ITEM_FG_COLOR, hover_color=self.ITEM_HOVER_COLOR,
-                    text_color=self.ITEM_TEXT_COLOR, anchor="w", height=button_height,
-                    corner_radius=4, border_spacing=8,
-                    command=lambda k=key, idx=i: self._trigger_select_action_from_click(k, idx)
-                )
-                item_button._macro_key = key
-                item_button.bind("<Enter>", lambda e, btn=item_button: self._on_item_enter(e, btn))
-                item_button.bind("<Leave>", lambda e, btn=item_button: self._on_item_leave(e, btn))
-                item_button.pack(fill="x", expand=True, padx=3, pady=item_pady_outer)
-                self.list_item_widgets.append(item_button)
-            self.scrollable_frame.update_idletasks()
-            if self.list_item_widgets:
-                self.current_selection_index = 0; self._highlight_item(0, True)
+            self.results = self.manager_ref.search_macros(filter_text, limit=self.MAX_RESULTS)
+            logger.debug("Encontradas %s macros para o filtro '%s'.", len(self.results), filter_text)
+            if self.results:
+                self.current_selection_index = 0
+                self._set_visible_row_count(min(len(self.results), self.MAX_ITEMS_DISPLAY))
+                self._render_window()
                 if not self.winfo_viewable(): logger.info("Tornando o popup de sugestões visível (deiconify)."); self.deiconify()
-                else: logger.info("Popup de sugestões já estava visível (lift).")
-                self.lift(); self.scrollable_frame.focus_set()
-                visible_items = min(len(self.list_item_widgets), MAX_ITEMS_DISPLAY)
-                actual_item_height_in_scroll = button_height + (item_pady_outer * 2)
-                popup_content_height = visible_items * actual_item_height_in_scroll
-                outer_f_pady = 1; inner_f_pady = 1; scroll_f_pady = 3
-                total_vertical_padding = (outer_f_pady*2)+(inner_f_pady*2)+(scroll_f_pady*2)
-                popup_total_height = min(max(popup_content_height + total_vertical_padding + 10, 80), 450)
-                popup_width = 480
-                current_geom = self.geometry()
-                try:
-                    current_pos_parts = current_geom.split('+')
-                    if len(current_pos_parts) == 3:
-                         current_pos = "+" + current_pos_parts[1] + "+" + current_pos_parts[2]
-                         self.geometry(f"{popup_width}x{int(popup_total_height)}{current_pos}")
-                    else: self.geometry(f"{popup_width}x{int(popup_total_height)}")
-                except IndexError: self.geometry(f"{popup_width}x{int(popup_total_height)}")
-                logger.info(f"Geometria do popup definida para: {self.geometry()}")
-                self._scroll_to_item(self.current_selection_index)
+                self.lift(); self.rows_frame.focus_set()
+            elif filter_text != "/":
+                logger.debug("Nenhuma macro corresponde a '%s'. Fechando popup.", filter_text)
+                self.close_popup()
             else:
                 if self.winfo_viewable(): self.withdraw()
         except Exception as e:
-            logger.critical(f"ERRO CRÍTICO DENTRO DO UPDATE_SUGGESTIONS: {e}", exc_info=True)
+            logger.critical("ERRO CRÍTICO DENTRO DO UPDATE_SUGGESTIONS: %s", e, exc_info=True)
             if self.winfo_viewable(): self.withdraw()
             if self.on_close_callback: self.on_close_callback()
 
-    def _trigger_select_action_from_click(self, macro_key: str, clicked_index: int):
-        logger.debug(f"_trigger_select_action_from_click: Key='{macro_key}', Index='{clicked_index}'")
-        if self.current_selection_index != -1 and \
-           0 <= self.current_selection_index < len(self.list_item_widgets) and \
-           self.current_selection_index != clicked_index:
-            self._highlight_item(self.current_selection_index, False)
+    def _trigger_select_action_from_click(self, row_index: int):
+        clicked_index = self.window_start + row_index
+        logger.debug("_trigger_select_action_from_click: Row='%s', Index='%s'", row_index, clicked_index)
+        if not (0 <= clicked_index < len(self.results)): return
         self.current_selection_index = clicked_index
-        self._highlight_item(self.current_selection_index, True)
+        self._render_window()
         self.after(50, self._apply_selected_macro)
 
     def _trigger_select_action_from_keyboard(self):
-        logger.debug(f"_trigger_select_action_from_keyboard: Current index: {self.current_selection_index}")
-        if 0 <= self.current_selection_index < len(self.list_item_widgets):
+        logger.debug("_trigger_select_action_from_keyboard: Current index: %s", self.current_selection_index)
+        if 0 <= self.current_selection_index < len(self.results):
             self._apply_selected_macro()
         else:
             logger.debug("_trigger_select_action_from_keyboard: Nenhum item selecionado ou índice inválido. Fechando popup.")
             self.close_popup()
 
     def _apply_selected_macro(self):
-        if not (0 <= self.current_selection_index < len(self.list_item_widgets)):
+        if not (0 <= self.current_selection_index < len(self.results)):
             logger.warning("_apply_selected_macro: Índice de seleção inválido.")
             self.close_popup(); return
-        selected_button = self.list_item_widgets[self.current_selection_index]
-        if hasattr(selected_button, "_macro_key"):
-            selected_key_to_apply = selected_button._macro_key
-            if selected_key_to_apply in self.all_macros_dict:
-                chars_to_delete = len(self.manager_ref.current_typed)
-                logger.debug(f"_apply_selected_macro: Aplicando. Key='{selected_key_to_apply}', manager.current_typed='{self.manager_ref.current_typed}', chars_to_delete={chars_to_delete}")
-                self.manager_ref.try_apply_macro(selected_key_to_apply, chars_to_delete)
-            else: logger.warning(f"Chave '{selected_key_to_apply}' não encontrada para _apply_selected_macro.")
-        else: logger.error(f"Botão no índice {self.current_selection_index} não possui _macro_key.")
+        selected_key_to_apply = self.results[self.current_selection_index]
+        if self.manager_ref.has_macro(selected_key_to_apply):
+            chars_to_delete = len(self.manager_ref.current_typed)
+            logger.debug("_apply_selected_macro: Aplicando. Key='%s', manager.current_typed='%s', chars_to_delete=%s", selected_key_to_apply, self.manager_ref.current_typed, chars_to_delete)
+            self.manager_ref.request_macro_application(selected_key_to_apply, chars_to_delete)
+        else: logger.warning("Chave '%s' não encontrada para _apply_selected_macro.", selected_key_to_apply)
         self.close_popup()
 
     def on_select_action(self, event=None) -> bool:
-        logger.debug(f"on_select_action (event handler for keyboard). Current index: {self.current_selection_index}")
+        logger.debug("on_select_action (event handler for keyboard). Current index: %s", self.current_selection_index)
         self._trigger_select_action_from_keyboard(); return True
 
     def close_popup(self, event=None) -> None:
@@ -830,22 +3542,65 @@ class MacroSuggestionPopup(ctk.CTkToplevel):
             logger.debug("close_popup: Popup not viewable but manager thought active. Calling callback."); self.on_close_callback()
 
     def handle_external_key(self, key_name: str) -> None:
-        logger.debug(f"Popup handling external key: {key_name}")
-        if not self.winfo_viewable(): logger.debug(f"Popup not viewable, ignoring key: {key_name}"); return
-        if key_name == "up": self._navigate(-1)
+        logger.debug("Popup handling external key: %s", key_name)
+        if not self.winfo_viewable(): logger.debug("Popup not viewable, ignoring key: %s", key_name); return
+        if isinstance(key_name, int): self._navigate(key_name)
+        elif key_name == "up": self._navigate(-1)
         elif key_name == "down": self._navigate(1)
         elif key_name in ["enter", "tab", "space"]: self.on_select_action()
 
     def is_active(self) -> bool: return self.winfo_viewable()
 
 class MacroGUI:
-    def __init__(self, root: ctk.CTk, manager: MacroManager) -> None:
+    SUGGESTION_FRAME_MS = 16
+    MONITOR_CHECK_MS = 2000
+    FULL_REFRESH_THRESHOLD = 500
+    # Lista principal: linhas inseridas por páginas conforme a rolagem se aproxima do fim.
+    LIST_PAGE_SIZE = 200
+    LIST_PREFETCH_FRACTION = 0.9
+    # Busca: o resultado vem em lotes (o limite dobra quando a rolagem chega ao fim do lote atual).
+    LIST_SEARCH_LIMIT = 2000
+    SEARCH_DEBOUNCE_MS = 120
+
+    def __init__(self, root: ctk.CTk, manager: MacroManager, profiler: Optional[StartupProfiler] = None) -> None:
         self.root = root; self.manager = manager; self.bandeja_ativa = False
-        self.tray_icon_object: Optional[Icon] = None; self.tray_thread: Optional[threading.Thread] = None
+        self.profiler = profiler or StartupProfiler()
+        # _list_view None = biblioteca inteira na ordem do índice; lista = resultado da busca.
+        # As linhas carregadas são sempre as primeiras _list_loaded chaves da visão atual.
+        self._list_view: Optional[List[str]] = None
+        self._list_loaded = 0
+        self._list_load_pending = False
+        self._search_text = ""; self._search_limit = self.LIST_SEARCH_LIMIT; self._search_more = False
+        self._search_after_id: Optional[str] = None
+        self.tray_icon_object: Optional[Any] = None; self.tray_thread: Optional[threading.Thread] = None
         self.suggestion_popup: Optional[MacroSuggestionPopup] = None
-        configurar_tema(self.root); self._setup_window(); self._create_widgets(); self._setup_events()
-        self.manager.register_suggestion_ui_callback(lambda cmd, data: self.root.after(0, self._process_suggestion_request, cmd, data))
-        self.atualizar_lista()
+        self.monitors = MonitorLayoutCache()
+        self.monitors.refresh_async()
+        with self.profiler.phase("theme"): configurar_tema(self.root)
+        with self.profiler.phase("widgets"): self._setup_window(); self._create_widgets(); self._setup_events()
+        # A thread do hook só enfileira; chamar root.after() de outra thread bloquearia o hook até o
+        # mainloop atender a chamada. O Tk drena a fila a cada SUGGESTION_FRAME_MS.
+        self.suggestion_commands = SuggestionCommandQueue()
+        self.manager.register_suggestion_ui_callback(self.suggestion_commands.put)
+        self.manager.metrics.add_collector("suggestion_queue", self.suggestion_commands.stats)
+        self.library_deltas: "queue.SimpleQueue[LibraryDelta]" = queue.SimpleQueue()
+        # Pedidos de valores {input:...} vindos da thread de injeção, atendidos no mesmo loop de drenagem.
+        self.template_requests: "queue.SimpleQueue" = queue.SimpleQueue()
+        # Resultados de importação/exportação (rodam fora da thread do Tk).
+        self.transfer_results: "queue.SimpleQueue" = queue.SimpleQueue()
+        self.manager.register_template_input_callback(self._ask_template_inputs)
+        self.manager.register_library_change_callback(self.library_deltas.put)
+        # A biblioteca pode ainda estar carregando (MacroLoadThread): a lista é preenchida pelo loop
+        # de _drain_suggestion_commands assim que library_ready for sinalizado.
+        self._library_shown = False
+        self.root.after(self.SUGGESTION_FRAME_MS, self._drain_suggestion_commands)
+        self.root.after(self.MONITOR_CHECK_MS, self._check_monitor_layout)
+
+    def _check_monitor_layout(self) -> None:
+        try: self.monitors.check()
+        except Exception as e: logger.error(f"Monitor layout check error: {e}", exc_info=True)
+        finally:
+            if self.manager.is_running: self.root.after(self.MONITOR_CHECK_MS, self._check_monitor_layout)
 
     def _setup_window(self) -> None:
         self.root.title("Macro Manager"); self.root.geometry("800x600"); self.root.minsize(600, 400)
@@ -855,7 +3610,12 @@ class MacroGUI:
         self.root.grid_columnconfigure(0, weight=1); self.root.grid_rowconfigure(0, weight=1)
         self.main_frame = ctk.CTkFrame(self.root); self.main_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
         self.main_frame.grid_columnconfigure(0, weight=1); self.main_frame.grid_rowconfigure(1, weight=1)
-        ctk.CTkLabel(self.main_frame, text="Macros Disponíveis:", font=CTkFont(size=14, weight="bold")).grid(row=0, column=0, sticky="w", padx=5, pady=(5,10))
+        header_frame = ctk.CTkFrame(self.main_frame, fg_color="transparent"); header_frame.grid(row=0, column=0, sticky="ew", padx=5, pady=(5,10))
+        header_frame.grid_columnconfigure(1, weight=1)
+        ctk.CTkLabel(header_frame, text="Macros Disponíveis:", font=CTkFont(size=14, weight="bold")).grid(row=0, column=0, sticky="w")
+        # Sem textvariable: o CTkEntry não mostra o placeholder quando há uma variável associada.
+        self.busca_entry = ctk.CTkEntry(header_frame, placeholder_text="Buscar atalho...", width=260); self.busca_entry.grid(row=0, column=1, sticky="e")
+        self.busca_entry.bind("<KeyRelease>", self._on_search_changed)
         self._create_macro_list(); self._create_buttons()
 
     def _create_macro_list(self) -> None:
@@ -865,28 +3625,119 @@ class MacroGUI:
         self.lista_macros.heading("Atalho", text="Atalho"); self.lista_macros.heading("Texto", text="Texto da Macro")
         self.lista_macros.column("Atalho", width=200, minwidth=150, stretch=tk.NO); self.lista_macros.column("Texto", width=500, minwidth=300)
         self.lista_macros.grid(row=0, column=0, sticky="nsew")
-        scrollbar = ttk.Scrollbar(tree_container_frame, orient="vertical", command=self.lista_macros.yview); scrollbar.grid(row=0, column=1, sticky="ns")
-        self.lista_macros.configure(yscrollcommand=scrollbar.set)
+        self.lista_scrollbar = ttk.Scrollbar(tree_container_frame, orient="vertical", command=self.lista_macros.yview); self.lista_scrollbar.grid(row=0, column=1, sticky="ns")
+        self.lista_macros.configure(yscrollcommand=self._on_list_scrolled)
 
     def _create_buttons(self) -> None:
         button_frame = ctk.CTkFrame(self.main_frame); button_frame.grid(row=2, column=0, sticky="ew", padx=5, pady=(10,5))
-        button_frame.grid_columnconfigure((0,1,2), weight=1)
+        button_frame.grid_columnconfigure((0,1,2,3,4), weight=1)
         ctk.CTkButton(button_frame, text="Adicionar Macro", command=self.adicionar_macro_gui).grid(row=0, column=0, padx=5, pady=5)
         ctk.CTkButton(button_frame, text="Remover Selecionada", command=self.remover_macro_gui).grid(row=0, column=1, padx=5, pady=5)
         ctk.CTkButton(button_frame, text="Editar Selecionada", command=self.editar_macro_gui).grid(row=0, column=2, padx=5, pady=5)
+        ctk.CTkButton(button_frame, text="Importar...", command=self.importar_macros_gui).grid(row=0, column=3, padx=5, pady=5)
+        ctk.CTkButton(button_frame, text="Exportar...", command=self.exportar_macros_gui).grid(row=0, column=4, padx=5, pady=5)
 
     def _setup_events(self) -> None: self.root.protocol("WM_DELETE_WINDOW", self.on_closing_main_window_X_button)
 
     def atualizar_lista(self) -> None:
         try:
-            for i in self.lista_macros.get_children(): self.lista_macros.delete(i)
-            for key, val in sorted(self.manager.expansions.items()):
-                primeira_linha_val = val.split('\n')[0]
-                texto_curto = (primeira_linha_val[:60] + "...") if len(primeira_linha_val) > 60 else primeira_linha_val
-                self.lista_macros.insert("", "end", values=(key, texto_curto))
-            logger.info(f"Updated macro list with {len(self.manager.expansions)} items")
+            self.lista_macros.delete(*self.lista_macros.get_children())
+            self._list_loaded = 0
+            self._load_list_page()
+            logger.info(f"Updated macro list: {self._list_loaded} of {self._list_view_len()} items loaded")
         except Exception as e: logger.error(f"Error updating macro list: {e}", exc_info=True)
 
+    def _list_row_values(self, key: str) -> Tuple[str, str]:
+        primeira_linha_val = self.manager.get_preview(key, 61)
+        texto_curto = (primeira_linha_val[:60] + "...") if len(primeira_linha_val) > 60 else primeira_linha_val
+        return key, texto_curto
+
+    def _list_view_len(self) -> int:
+        return len(self.manager.library) if self._list_view is None else len(self._list_view)
+
+    def _load_list_page(self) -> None:
+        lo = self._list_loaded; hi = min(lo + self.LIST_PAGE_SIZE, self._list_view_len())
+        keys = self.manager.library.keys_in_range(lo, hi) if self._list_view is None else self._list_view[lo:hi]
+        for key in keys: self.lista_macros.insert("", "end", iid=key, values=self._list_row_values(key))
+        self._list_loaded += len(keys)
+
+    def _on_list_scrolled(self, first: str, last: str) -> None:
+        self.lista_scrollbar.set(first, last)
+        if float(last) >= self.LIST_PREFETCH_FRACTION and self._list_has_more() and not self._list_load_pending:
+            # Fora do callback de rolagem: inserir aqui dispararia outro yscrollcommand recursivamente.
+            self._list_load_pending = True
+            self.root.after_idle(self._load_more_list_rows)
+
+    def _list_has_more(self) -> bool:
+        return self._list_loaded < self._list_view_len() or (self._list_view is not None and self._search_more)
+
+    def _load_more_list_rows(self) -> None:
+        self._list_load_pending = False
+        try:
+            if self._list_view is not None and self._search_more and self._list_loaded >= len(self._list_view): self._extend_search()
+            self._load_list_page()
+        except Exception as e: logger.error(f"Error loading macro list page: {e}", exc_info=True)
+
+    def _list_on_set(self, key: str, old_key: Optional[str] = None) -> None:
+        # Chamado depois de manager.set_macro: atualiza só a linha afetada.
+        if self._list_view is not None: self._apply_search(); return
+        if old_key is not None and old_key != key: self._list_on_removed(old_key)
+        if self.lista_macros.exists(key):
+            self.lista_macros.item(key, values=self._list_row_values(key)); return
+        position = self.manager.library.position(key)
+        if position < self._list_loaded or self._list_loaded == self._list_view_len() - 1:
+            self.lista_macros.insert("", position, iid=key, values=self._list_row_values(key))
+            self._list_loaded += 1
+
+    def _list_on_removed(self, key: str) -> None:
+        if self._list_view is not None:
+            try: self._list_view.remove(key)
+            except ValueError: return
+        if self.lista_macros.exists(key):
+            self.lista_macros.delete(key)
+            self._list_loaded -= 1
+
+    def _on_search_changed(self, *_args) -> None:
+        if self._search_after_id is not None: self.root.after_cancel(self._search_after_id)
+        self._search_after_id = self.root.after(self.SEARCH_DEBOUNCE_MS, self._apply_search)
+
+    def _apply_search(self) -> None:
+        self._search_after_id = None
+        texto = self.busca_entry.get().strip()
+        start = time.perf_counter()
+        self._search_text = texto; self._search_limit = self.LIST_SEARCH_LIMIT
+        self._list_view = self.manager.search_macros(texto, limit=self._search_limit, all_profiles=True) if texto else None
+        # Lote cheio = pode haver mais resultados; a rolagem busca o próximo lote em vez de cortar a lista.
+        self._search_more = self._list_view is not None and len(self._list_view) >= self._search_limit
+        self.atualizar_lista()
+        logger.debug("List search '%s': %s results in %.1f ms", texto, self._list_view_len(), (time.perf_counter() - start) * 1000)
+
+    def _extend_search(self) -> None:
+        # Refaz a busca com o dobro do limite e acrescenta só as chaves novas: as linhas já
+        # inseridas continuam sendo as primeiras _list_loaded chaves da visão.
+        self._search_limit *= 2
+        start = time.perf_counter()
+        resultados = self.manager.search_macros(self._search_text, limit=self._search_limit, all_profiles=True)
+        vistos = set(self._list_view)
+        self._list_view.extend(k for k in resultados if k not in vistos)
+        self._search_more = len(resultados) >= self._search_limit
+        logger.debug("List search '%s' extended: %s results in %.1f ms", self._search_text, len(self._list_view), (time.perf_counter() - start) * 1000)
+
+    def _apply_library_delta(self, delta: LibraryDelta) -> None:
+        # Aplica só as linhas afetadas; deltas grandes (troca da biblioteca inteira) recriam a lista.
+        start = time.perf_counter()
+        self.manager.apply_library_delta(delta)
+        if len(delta) > self.FULL_REFRESH_THRESHOLD:
+            self.atualizar_lista()
+        elif self._list_view is not None:
+            self._apply_search()
+        else:
+            for key in delta.removed: self._list_on_removed(key)
+            for key in delta.added: self._list_on_set(key)
+            for key in delta.changed: self._list_on_set(key)
+        if self.suggestion_popup and self.suggestion_popup.is_active(): self.suggestion_popup.refresh_rows(self.manager.current_typed or "/")
+        logger.info(f"Applied library change {delta.summary()} to the GUI in {(time.perf_counter() - start) * 1000:.1f} ms")
+
     def _center_toplevel(self, win, w, h):
         self.root.update_idletasks(); px,py,pw,ph = self.root.winfo_x(),self.root.winfo_y(),self.root.winfo_width(),self.root.winfo_height()
         x,y = (px+(pw//2)-(w//2), py+(ph//2)-(h//2)) if pw>100 and ph>100 else ((self.root.winfo_screenwidth()//2)-(w//2), (self.root.winfo_screenheight()//2)-(h//2))
@@ -902,9 +3753,10 @@ class MacroGUI:
         entrada_texto = ctk.CTkTextbox(container, height=300, width=400, wrap="word"); entrada_texto.grid(row=3, column=0, sticky="nsew", pady=(0,15)); container.grid_rowconfigure(3, weight=1)
         def salvar():
             s,t = entrada_shortcut.get().strip(), entrada_texto.get("1.0", "end-1c").strip()
-            if not s.startswith("/") or len(s)<2 or not t or s in self.manager.expansions: messagebox.showerror("Erro", "Verifique o atalho (deve começar com '/', ser único, e não vazio) e o texto (não pode ser vazio).", parent=janela_adicionar); return
-            self.manager.expansions[s] = t; self.manager.save_expansions(); self.atualizar_lista()
-            if self.suggestion_popup and self.suggestion_popup.is_active(): self.suggestion_popup.all_macros_dict=self.manager.expansions.copy(); self.suggestion_popup.update_suggestions(self.manager.current_typed or "/")
+            erro = validate_macro(s, t) or (f"o atalho '{s}' já existe" if self.manager.has_macro(s) else None)
+            if erro: messagebox.showerror("Erro", f"Verifique o atalho (deve começar com '/', ser único, e não vazio) e o texto (não pode ser vazio): {erro}.", parent=janela_adicionar); return
+            self.manager.set_macro(s, t); self._list_on_set(s)
+            if self.suggestion_popup and self.suggestion_popup.is_active(): self.suggestion_popup.update_suggestions(self.manager.current_typed or "/")
             janela_adicionar.destroy()
         ctk.CTkButton(container, text="Salvar Macro", command=salvar).grid(row=4, column=0, pady=(10,0)); entrada_shortcut.focus_set(); janela_adicionar.bind("<Escape>", lambda e: janela_adicionar.destroy())
 
@@ -915,16 +3767,16 @@ class MacroGUI:
         if not val: messagebox.showerror("Erro Interno", "Não foi possível obter dados da macro.", parent=self.root); return
         s_rem = val[0]
         if messagebox.askyesno("Confirmar Remoção", f"Remover '{s_rem}'?", icon='warning', parent=self.root):
-            if s_rem in self.manager.expansions: del self.manager.expansions[s_rem]; self.manager.save_expansions(); self.atualizar_lista()
-            if self.suggestion_popup and self.suggestion_popup.is_active(): self.suggestion_popup.all_macros_dict=self.manager.expansions.copy(); self.suggestion_popup.update_suggestions(self.manager.current_typed or "/")
-            else: messagebox.showerror("Erro", f"Macro '{s_rem}' não encontrada.", parent=self.root); self.atualizar_lista()
+            if not self.manager.remove_macro(s_rem): messagebox.showerror("Erro", f"Macro '{s_rem}' não encontrada.", parent=self.root); self.atualizar_lista(); return
+            self._list_on_removed(s_rem)
+            if self.suggestion_popup and self.suggestion_popup.is_active(): self.suggestion_popup.update_suggestions(self.manager.current_typed or "/")
 
     def editar_macro_gui(self):
         sel = self.lista_macros.selection()
         if not sel: messagebox.showwarning("Nenhuma Seleção", "Selecione uma macro para editar.", parent=self.root); return
         val = self.lista_macros.item(sel[0], "values")
         if not val: messagebox.showerror("Erro Interno", "Não foi possível obter dados da macro.", parent=self.root); return
-        old_s, old_t = val[0], self.manager.expansions.get(val[0], "")
+        old_s, old_t = val[0], self.manager.get_body(val[0]) or ""
         win_edit = ctk.CTkToplevel(self.root); win_edit.title(f"Editar: {old_s}"); win_edit.attributes("-topmost",True); win_edit.transient(self.root); win_edit.grab_set(); self._center_toplevel(win_edit, 450,550)
         container=ctk.CTkFrame(win_edit); container.pack(fill="both",expand=True,padx=15,pady=15); container.grid_columnconfigure(0,weight=1)
         ctk.CTkLabel(container,text=f"Editando: {old_s}",font=CTkFont(size=12,weight="bold")).grid(row=0,column=0,sticky="w",pady=(0,5))
@@ -934,13 +3786,52 @@ class MacroGUI:
         entry_new_t=ctk.CTkTextbox(container,height=300,width=400,wrap="word"); entry_new_t.insert("1.0",old_t); entry_new_t.grid(row=4,column=0,sticky="nsew",pady=(0,15)); container.grid_rowconfigure(4,weight=1)
         def confirm_edit():
             new_s,new_t = entry_new_s.get().strip(), entry_new_t.get("1.0","end-1c").strip()
-            if not new_s.startswith("/") or len(new_s)<2 or not new_t or (old_s!=new_s and new_s in self.manager.expansions): messagebox.showerror("Erro", "Verifique o atalho e o texto.",parent=win_edit); return
-            if old_s in self.manager.expansions: del self.manager.expansions[old_s]
-            self.manager.expansions[new_s]=new_t; self.manager.save_expansions(); self.atualizar_lista()
-            if self.suggestion_popup and self.suggestion_popup.is_active(): self.suggestion_popup.all_macros_dict=self.manager.expansions.copy(); self.suggestion_popup.update_suggestions(self.manager.current_typed or "/")
+            erro = validate_macro(new_s, new_t) or (f"o atalho '{new_s}' já existe" if old_s!=new_s and self.manager.has_macro(new_s) else None)
+            if erro: messagebox.showerror("Erro", f"Verifique o atalho e o texto: {erro}.",parent=win_edit); return
+            self.manager.set_macro(new_s, new_t, old_key=old_s); self._list_on_set(new_s, old_key=old_s)
+            if self.suggestion_popup and self.suggestion_popup.is_active(): self.suggestion_popup.update_suggestions(self.manager.current_typed or "/")
             win_edit.destroy()
         ctk.CTkButton(container,text="Salvar",command=confirm_edit).grid(row=5,column=0,pady=(10,0)); entry_new_s.focus_set(); win_edit.bind("<Escape>",lambda e:win_edit.destroy())
 
+    MACRO_FILE_TYPES = [("JSON Lines", "*.jsonl *.ndjson"), ("CSV", "*.csv"), ("JSON (expansions.json)", "*.json")]
+
+    def importar_macros_gui(self):
+        path = filedialog.askopenfilename(parent=self.root, title="Importar macros", filetypes=self.MACRO_FILE_TYPES + [("Todos", "*.*")])
+        if not path: return
+        try: detect_macro_format(path)
+        except ValueError as e: messagebox.showerror("Importar", str(e), parent=self.root); return
+        overwrite = messagebox.askyesnocancel("Importar", "Sobrescrever macros existentes com o mesmo atalho?\n\nNão: mantém as atuais e ignora os conflitos.", parent=self.root)
+        if overwrite is None: return
+        def run():
+            try: self.transfer_results.put(("import", self.manager.import_macros(path, on_conflict="overwrite" if overwrite else "skip")))
+            except Exception as e:
+                logger.error(f"Erro ao importar {path}: {e}", exc_info=True); self.transfer_results.put(("error", f"Falha ao importar {path}: {e}"))
+        threading.Thread(target=run, name="MacroImportThread", daemon=True).start()
+
+    def exportar_macros_gui(self):
+        path = filedialog.asksaveasfilename(parent=self.root, title="Exportar macros", defaultextension=".jsonl", filetypes=self.MACRO_FILE_TYPES)
+        if not path: return
+        try: detect_macro_format(path)
+        except ValueError as e: messagebox.showerror("Exportar", str(e), parent=self.root); return
+        def run():
+            try: self.transfer_results.put(("export", (path, self.manager.export_macros(path))))
+            except Exception as e:
+                logger.error(f"Erro ao exportar para {path}: {e}", exc_info=True); self.transfer_results.put(("error", f"Falha ao exportar para {path}: {e}"))
+        threading.Thread(target=run, name="MacroExportThread", daemon=True).start()
+
+    def _show_transfer_result(self, kind: str, result: Any) -> None:
+        if kind == "error": messagebox.showerror("Importar/Exportar", result, parent=self.root); return
+        if kind == "export": messagebox.showinfo("Exportar", f"{result[1]} macros exportadas para {result[0]}.", parent=self.root); return
+        # Um único refresh da lista e do popup para o lote inteiro.
+        if result.added or result.updated:
+            if self._list_view is not None: self._apply_search()
+            else: self.atualizar_lista()
+            if self.suggestion_popup and self.suggestion_popup.is_active(): self.suggestion_popup.refresh_rows(self.manager.current_typed or "/")
+        details = [result.summary()]
+        if result.conflicts: details.append("Conflitos: " + ", ".join(sorted(result.conflicts)[:10]) + (" ..." if len(result.conflicts) > 10 else ""))
+        if result.invalid: details.append("Inválidas: " + "; ".join(f"registro {record}: {reason}" for record, reason in result.invalid[:5]) + (" ..." if result.invalid_count > 5 else ""))
+        (messagebox.showwarning if result.error else messagebox.showinfo)("Importar", "\n\n".join(details), parent=self.root)
+
     def hide_to_tray(self) -> None:
         if not self.bandeja_ativa:
             logger.info("Escondendo janela para a bandeja do sistema.")
@@ -980,8 +3871,15 @@ class MacroGUI:
             logger.critical("--- CALLBACK DE TESTE DO MENU DA BANDEJA ACIONADO ---")
             if icon_param: icon_param.stop()
             self.root.after(50, self._perform_full_shutdown)
-        menu = (MenuItem("Sair de Teste", callback_teste_sair),)
-        try: img=self._desenhar_icone(); return Icon("MacroMan",img,"Gerenciador de Macros",menu) if img else None
+
+        def exportar_metricas(i, it):
+            path = self.manager.export_metrics()
+            if path: self.manager.show_notification(f"Métricas exportadas para {path}")
+        try:
+            from pystray import Icon, MenuItem
+            menu = (MenuItem("Sair de Teste", callback_teste_sair),)
+            if self.manager.metrics.enabled: menu = (MenuItem("Exportar métricas", exportar_metricas),) + menu
+            img=self._desenhar_icone(); return Icon("MacroMan",img,"Gerenciador de Macros",menu) if img else None
         except Exception as e: logger.error(f"Failed to create tray icon: {e}",exc_info=True); return None
 
     def _restaurar_janela_callback(self):
@@ -993,6 +3891,7 @@ class MacroGUI:
         self.root.after(10,self.root.deiconify); self.root.lift(); self.root.attributes('-topmost',1); self.root.focus_force(); self.root.after(100,lambda: self.root.attributes('-topmost',0))
 
     def _desenhar_icone(self):
+        from PIL import Image, ImageDraw, ImageFont
         s=64;i=Image.new("RGBA",(s,s),(0,0,0,0));d=ImageDraw.Draw(i)
         try:
             d.ellipse((4,4,s-4,s-4),fill=(0,120,215,255));fs=38;fnt=None
@@ -1022,6 +3921,7 @@ class MacroGUI:
 
     def _gui_cleanup(self) -> None:
         logger.info("MacroGUI _gui_cleanup initiated.")
+        logger.info(f"Suggestion command queue stats: {self.suggestion_commands.stats()}")
         if self.tray_icon_object:
             logger.debug("Stopping tray icon object (self.tray_icon_object.stop()).")
             self.tray_icon_object.stop()
@@ -1097,51 +3997,83 @@ class MacroGUI:
         logger.critical("--- sys.exit(0) foi chamado, mas a execução continuou. Isso indica um problema profundo. ---") # Não deve ser alcançado
 
     def _ensure_suggestion_popup(self) -> MacroSuggestionPopup:
-        logger.debug(f"Entering _ensure_suggestion_popup. Popup exists: {self.suggestion_popup is not None and self.suggestion_popup.winfo_exists()}")
+        logger.debug("Entering _ensure_suggestion_popup. Popup exists: %s", self.suggestion_popup is not None and self.suggestion_popup.winfo_exists())
         if not self.suggestion_popup or not self.suggestion_popup.winfo_exists():
             logger.info("Creating new MacroSuggestionPopup instance.")
-            self.suggestion_popup = MacroSuggestionPopup(self.root, self.manager.expansions.copy(), self.manager, self._on_suggestion_popup_closed)
+            self.suggestion_popup = MacroSuggestionPopup(self.root, self.manager, self._on_suggestion_popup_closed)
         else:
              logger.debug("Reusing existing MacroSuggestionPopup instance.")
-             self.suggestion_popup.all_macros_dict = self.manager.expansions.copy()
         logger.debug("Exiting _ensure_suggestion_popup.")
         return self.suggestion_popup
 
+    def _ask_template_inputs(self, macro_key: str, names: Tuple[str, ...]) -> Optional[Dict[str, str]]:
+        # Thread de injeção: bloqueia até o usuário responder na thread do Tk (ou o app fechar).
+        request = {"done": threading.Event(), "values": None}
+        self.template_requests.put((macro_key, names, request))
+        while not request["done"].wait(0.5):
+            if not self.manager.is_running: return None
+        return request["values"]
+
+    def _show_template_input(self, macro_key: str, names: Tuple[str, ...], request: Dict[str, Any]) -> None:
+        values: Optional[Dict[str, str]] = {}
+        try:
+            for name in names:
+                value = ctk.CTkInputDialog(title=f"Macro {macro_key}", text=f"{name}:").get_input()
+                if value is None: values = None; break
+                values[name] = value
+            request["values"] = values
+        finally:
+            request["done"].set()
+
     def _on_suggestion_popup_closed(self) -> None:
         manager_active = self.manager.suggestion_popup_active
-        logger.debug(f"Popup closed callback. manager.current_typed: '{self.manager.current_typed}', is_applying: {self.manager.is_applying_macro_flag}, manager_popup_active: {manager_active}")
+        logger.debug("Popup closed callback. manager.current_typed: '%s', is_applying: %s, manager_popup_active: %s", self.manager.current_typed, self.manager.is_applying_macro_flag, manager_active)
         if manager_active and not self.manager.is_applying_macro_flag: self.manager.current_typed = ""
         self.manager.suggestion_popup_active = False
-        logger.debug(f"Popup closed. manager.current_typed: '{self.manager.current_typed}', popup_active: {self.manager.suggestion_popup_active}")
+        logger.debug("Popup closed. manager.current_typed: '%s', popup_active: %s", self.manager.current_typed, self.manager.suggestion_popup_active)
+
+    def _drain_suggestion_commands(self) -> None:
+        try:
+            if not self._library_shown and self.manager.library_ready.is_set():
+                self._library_shown = True
+                self.profiler.record("load_expansions (background)", self.manager.load_seconds or 0.0)
+                with self.profiler.phase("first list render"): self.atualizar_lista()
+                self.profiler.report()
+            while not self.library_deltas.empty(): self._apply_library_delta(self.library_deltas.get_nowait())
+            while not self.template_requests.empty(): self._show_template_input(*self.template_requests.get_nowait())
+            while not self.transfer_results.empty(): self._show_transfer_result(*self.transfer_results.get_nowait())
+            batch = self.suggestion_commands.drain()
+            for command, data in batch: self._process_suggestion_request(command, data)
+            if len(batch) > 1 and logger.isEnabledFor(logging.DEBUG): logger.debug("Suggestion queue drained %s commands. Stats: %s", len(batch), self.suggestion_commands.stats())
+        except Exception as e: logger.error("Error draining suggestion commands: %s", e, exc_info=True)
+        finally:
+            if self.manager.is_running: self.root.after(self.SUGGESTION_FRAME_MS, self._drain_suggestion_commands)
 
     def _process_suggestion_request(self, command: str, data: Optional[Any]) -> None:
-        logger.debug(f"GUI _process_suggestion_request: command='{command}', data='{data}'")
-        if command == "show" and not self.manager.expansions: logger.warning("SHOW: No expansions loaded.")
+        logger.debug("GUI _process_suggestion_request: command='%s', data='%s'", command, data)
+        if command == "show" and not self.manager.macro_count(): logger.warning("SHOW: No expansions loaded.")
         if command=="show" and self.manager.suggestion_popup_active and self.suggestion_popup and self.suggestion_popup.is_active():
             filter_val = data.get("filter",self.manager.current_typed) if isinstance(data,dict) else self.manager.current_typed
-            logger.warning(f"SHOW: Popup already active. Updating filter: '{filter_val}'.");popup=self._ensure_suggestion_popup();popup.update_suggestions(filter_val or "/");return
+            logger.warning("SHOW: Popup already active. Updating filter: '%s'.", filter_val);popup=self._ensure_suggestion_popup();popup.update_suggestions(filter_val or "/");return
         popup=self._ensure_suggestion_popup()
         if command=="show":
             self.manager.suggestion_popup_active=True
             mx,my=self.root.winfo_pointerx(),self.root.winfo_pointery();tx,ty=mx,my+25
-            pwg,pmhg=480,450;am=None
-            try:
-                mons=get_monitors()
-                for m in mons:
-                    if m.x<=mx<m.x+m.width and m.y<=my<m.y+m.height:am=m;break
-                if not am and mons:am=mons[0]
-            except Exception as e:logger.error(f"Monitor info error: {e}",exc_info=True)
+            pwg,pmhg=480,450
+            am=self.monitors.monitor_at(mx,my)
             if am:
-                mox,moy,mow,moh=am.x,am.y,am.width,am.height
+                mox,moy,mow,moh=am
                 if ty+pmhg>moy+moh-10:ty=my-pmhg-30
                 ty=max(moy+5,ty);tx=max(mox+5,min(tx,mox+mow-pwg-5))
             else:
                 sw,sh=self.root.winfo_screenwidth(),self.root.winfo_screenheight()
                 if ty+pmhg>sh-10:ty=my-pmhg-30
                 ty=max(0,ty);tx=max(0,min(tx,sw-pwg-10))
-            logger.debug(f"Positioning popup: +{int(tx)}+{int(ty)}");popup.geometry(f"+{int(tx)}+{int(ty)}")
+            logger.debug("Positioning popup: +%s+%s", int(tx), int(ty));popup.geometry(f"+{int(tx)}+{int(ty)}")
             filter_val_show=data.get("filter",self.manager.current_typed) if isinstance(data,dict) else self.manager.current_typed
             popup.update_suggestions(filter_val_show or "/")
+            # Do ctrl+space (thread do hook) até o popup preenchido: fila + frame do Tk + posicionamento + filtro.
+            if self.manager.metrics.enabled: self.manager.metrics.histogram("popup.show").record(time.perf_counter() - self.manager.last_hotkey_press_time)
         elif command=="update":
             if popup.is_active() and data and "filter" in data:popup.update_suggestions(data["filter"])
             elif not popup.is_active() and self.manager.suggestion_popup_active:logger.warning("Update: popup not active, manager thought so. Syncing.");self._on_suggestion_popup_closed()
@@ -1151,12 +4083,490 @@ class MacroGUI:
         elif command=="navigate":
             if popup.is_active():popup.handle_external_key(data)
         elif command=="select_or_close":
-            if popup.is_active():logger.debug(f"select_or_close: manager.current_typed='{data}'");popup.handle_external_key("enter")
+            if popup.is_active():logger.debug("select_or_close: manager.current_typed='%s'", data);popup.handle_external_key("enter")
             else: logger.debug("select_or_close: popup not active. Syncing.");
             if self.manager.suggestion_popup_active:self._on_suggestion_popup_closed()
 
-def main():
-    logger.info(f"Application starting... Running as admin: {is_admin()}")
+def benchmark_injection(backends: Dict[str, InjectionBackend], bodies: Dict[str, str], repeats: int = 5, chars_to_delete: int = 8) -> Dict[str, Dict[str, Any]]:
+    # Tempo ponta a ponta (apagar atalho + inserir corpo) de cada backend para cada corpo.
+    results: Dict[str, Dict[str, Any]] = {}
+    for backend_name, backend in backends.items():
+        for body_name, body in bodies.items():
+            samples = []
+            for _ in range(repeats):
+                job = InjectionJob(body_name, body, chars_to_delete, False)
+                start = time.perf_counter()
+                backend.delete_chars(chars_to_delete, job)
+                backend.insert_text(body, job)
+                samples.append((time.perf_counter() - start) * 1000)
+            results[f"{backend_name}:{body_name}"] = {
+                "backend": backend_name, "body": body_name, "chars": len(body), "repeats": repeats,
+                "mean_ms": round(sum(samples) / len(samples), 3), "min_ms": round(min(samples), 3), "max_ms": round(max(samples), 3),
+            }
+    return results
+
+@contextlib.contextmanager
+def _stubbed_keyboard_io(counts: Dict[str, int]):
+    # Troca só as chamadas ao SO do 'keyboard' (eventos de tecla) por contadores: keyboard.write/
+    # keyboard.send e os backends reais rodam inteiros, sem digitar nada. Sem tabela de teclado
+    # disponível (ex.: Linux sem dumpkeys), o mapeamento nome -> scan code também é substituído.
+    os_keyboard = keyboard._os_keyboard
+    saved = {name: getattr(os_keyboard, name) for name in ("press", "release", "type_unicode", "map_name")}
+
+    def event(kind: str) -> callable:
+        def record(_arg) -> None: counts[kind] += 1
+        return record
+
+    os_keyboard.press, os_keyboard.release, os_keyboard.type_unicode = event("press"), event("release"), event("type_unicode")
+    try: next(iter(saved["map_name"]("a")))
+    except Exception: os_keyboard.map_name = lambda name: iter(((zlib.crc32(name.encode("utf-8")) % 200 + 1, ()),))
+    try: yield
+    finally:
+        for name, function in saved.items(): setattr(os_keyboard, name, function)
+
+def _run_injection_benchmark(fake: bool, repeats: int) -> None:
+    bodies = {"short": "Bom dia, tudo bem?", "medium": "Obrigado pelo contato! Em breve retornaremos sua mensagem.",
+              "long": "Prezados clientes,\n\n" + "Informamos que o sistema passará por manutenção programada. " * 20}
+    if fake:
+        # Os backends reais (keyboard.write, DeferredClipboardRestore e as pausas fixas do paste),
+        # com os eventos de tecla e a área de transferência do SO trocados por stubs em memória:
+        # mede o custo do próprio código, não o do SO nem o do aplicativo que recebe as teclas.
+        clipboard_text = {"value": "conteúdo do usuário"}
+        clipboard = DeferredClipboardRestore(paste=lambda: clipboard_text["value"], copy=lambda text: clipboard_text.__setitem__("value", text))
+        backends = {"typing": TypingInjectionBackend(), "clipboard": ClipboardInjectionBackend(clipboard)}
+        counts: Dict[str, int] = defaultdict(int)
+        with _stubbed_keyboard_io(counts): results = benchmark_injection(backends, bodies, repeats=repeats)
+        clipboard.flush()
+        results["os_calls_stubbed"] = dict(counts)
+        results["clipboard_stats"] = dict(clipboard.stats)
+    else:
+        print("Benchmark real: clique em um editor de texto vazio. Iniciando em 5 segundos...", flush=True)
+        time.sleep(5)
+        backends = {"typing": TypingInjectionBackend(), "clipboard": ClipboardInjectionBackend()}
+        results = benchmark_injection(backends, bodies, repeats=repeats)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+class HeadlessSuggestionUI:
+    # Substituto do popup sem Tk para benchmarks: mesma fila de comandos do MacroGUI e a mesma busca
+    # + prévias das linhas visíveis que o popup faz a cada filtro; a seleção aplica a macro escolhida.
+    def __init__(self, manager: "MacroManager", max_results: int = 100, visible_rows: int = 7) -> None:
+        self.manager = manager
+        self.max_results = max_results
+        self.visible_rows = visible_rows
+        self.commands = SuggestionCommandQueue()
+        self.filter_latency = LatencyHistogram("filter")
+        self.results: List[str] = []
+        self.selection = 0
+        self.visible = False
+        manager.register_suggestion_ui_callback(self.commands.put)
+
+    def drain(self) -> None:
+        # Equivale a um frame do Tk (MacroGUI._drain_suggestion_commands).
+        for command, data in self.commands.drain(): self._process(command, data)
+
+    def _process(self, command: str, data: Optional[Any]) -> None:
+        if command == "show":
+            self.manager.suggestion_popup_active = True
+            self._update(data.get("filter", "/") if isinstance(data, dict) else "/")
+        elif command == "update":
+            if self.visible and data and "filter" in data: self._update(data["filter"])
+            elif self.manager.suggestion_popup_active: self._close()
+        elif command == "hide":
+            self._close()
+        elif command == "navigate":
+            if self.visible and self.results: self.selection = (self.selection + data) % len(self.results)
+        elif command == "select_or_close":
+            if self.visible and 0 <= self.selection < len(self.results):
+                self.manager.request_macro_application(self.results[self.selection], len(self.manager.current_typed))
+            self._close()
+
+    def _update(self, filter_text: str) -> None:
+        if not filter_text.startswith("/"): self._close(); return
+        start = time.perf_counter()
+        self.results = self.manager.search_macros(filter_text, limit=self.max_results)
+        for key in self.results[:self.visible_rows]: self.manager.get_preview(key, 41)
+        self.filter_latency.record(time.perf_counter() - start)
+        self.selection = 0
+        if self.results or filter_text == "/": self.visible = bool(self.results)
+        else: self._close()
+
+    def _close(self) -> None:
+        self.visible = False
+        if self.manager.suggestion_popup_active and not self.manager.is_applying_macro_flag: self.manager.current_typed = ""
+        self.manager.suggestion_popup_active = False
+
+
+_BENCH_SYLLABLES = ("ba", "ce", "di", "fo", "gu", "la", "me", "ni", "po", "ru", "sa", "te", "vi", "xo", "za", "tr", "pl", "cr")
+_BENCH_WORDS = ("obrigado", "pelo", "contato", "segue", "em", "anexo", "o", "relatorio", "att", "bom", "dia", "prezados")
+
+
+def _bench_library(size: int, rnd: "random.Random") -> Dict[str, str]:
+    # Atalhos pronunciáveis de 2 a 6 sílabas (prefixos compartilhados como numa biblioteca real) e
+    # corpos mistos: ~70% de uma linha curta, ~30% longos com várias linhas.
+    library: Dict[str, str] = {}
+    while len(library) < size:
+        key = "/" + "".join(rnd.choice(_BENCH_SYLLABLES) for _ in range(rnd.randint(2, 6)))
+        if key in library: key += str(len(library))
+        words = [rnd.choice(_BENCH_WORDS) for _ in range(rnd.randint(3, 10))]
+        body = " ".join(words).capitalize() + "."
+        if rnd.random() < 0.3: body = "\n".join(body for _ in range(rnd.randint(3, 12)))
+        library[key] = body
+    return library
+
+
+def _key_events(text: str) -> List[keyboard.KeyboardEvent]:
+    names = {" ": "space", "\n": "enter"}
+    return [keyboard.KeyboardEvent(keyboard.KEY_DOWN, 0, name=names.get(ch, ch)) for ch in text]
+
+
+def _wait_injections(manager: "MacroManager", timeout: float = 10.0) -> None:
+    worker = manager.injection_worker
+    deadline = time.perf_counter() + timeout
+    while (worker.completed + worker.failed < worker.submitted or manager.is_applying_macro_flag) and time.perf_counter() < deadline:
+        time.sleep(0.0002)
+
+
+def benchmark_core(size: int, storage: str = "json", expansions: int = 200, popup_sessions: int = 100,
+                   queries: int = 500, seed: int = 1234) -> Dict[str, Any]:
+    # Dirige o MacroManager como o hook do 'keyboard' faria (KeyboardEvent sintéticos), com backends
+    # de injeção falsos e o HeadlessSuggestionUI no lugar do popup. Pausas fixas (foco/pré-injeção)
+    # são zeradas: mede-se só o custo de software do caminho tecla -> expansão.
+    import random
+    rnd = random.Random(seed)
+    library = _bench_library(size, rnd)
+    keys = sorted(library)
+    result: Dict[str, Any] = {"size": size, "storage": storage}
+    with tempfile.TemporaryDirectory(prefix="macro-bench-") as tmp:
+        path = os.path.join(tmp, "expansions.json")
+        _write_json_atomic(path, library, indent=None)
+        typing_backend, clipboard_backend = FakeInjectionBackend("typing"), FakeInjectionBackend("clipboard")
+        start = time.perf_counter()
+        manager = MacroManager(expansions_file=path, settings={"storage": storage, "hot_reload": False},
+                               injection_policy=HybridInjectionPolicy(typing_backend, clipboard_backend))
+        result["startup_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        result["load_ms"] = round((manager.load_seconds or 0.0) * 1000, 3)
+        manager.FOCUS_RETURN_DELAY = 0.0
+        manager.PRE_INJECTION_DELAY = 0.0
+        ui = HeadlessSuggestionUI(manager)
+        try:
+            # 1) Digitação direta: texto comum e "/atalho" + espaço.
+            manager.hook_latency = LatencyHistogram("direct_hook")
+            manager.injection_latency = LatencyHistogram("direct_expansion")
+            typed_events = 0
+            for _ in range(expansions):
+                events = _key_events(" ".join(rnd.choice(_BENCH_WORDS) for _ in range(3)) + " " + rnd.choice(keys) + " ")
+                for event in events: manager.on_key_press(event)
+                typed_events += len(events)
+                _wait_injections(manager)
+            result["direct"] = {"events": typed_events, "hook": manager.hook_latency.summary(),
+                                "expansion": manager.injection_latency.summary()}
+
+            # 2) Popup: ctrl+space, digita parte do atalho (um frame por tecla), corrige, navega e confirma.
+            manager.hook_latency = LatencyHistogram("popup_hook")
+            manager.injection_latency = LatencyHistogram("popup_expansion")
+            popup_events = 0
+            for _ in range(popup_sessions):
+                key = rnd.choice(keys)
+                manager.last_hotkey_press_time = 0.0
+                manager.activate_suggestion_mode(); ui.drain()
+                events = _key_events(key[1:rnd.randint(3, len(key))])
+                events += [keyboard.KeyboardEvent(keyboard.KEY_DOWN, 0, name=name) for name in ("backspace", "down", "up")]
+                events += _key_events(key[len(key) - 1]) + _key_events("\n")
+                for event in events:
+                    manager.on_key_press(event); ui.drain()
+                popup_events += len(events)
+                _wait_injections(manager)
+                ui.drain()
+            result["popup"] = {"sessions": popup_sessions, "events": popup_events, "hook": manager.hook_latency.summary(),
+                               "filter": ui.filter_latency.summary(), "expansion": manager.injection_latency.summary()}
+
+            # 3) Vazão de filtro pura: prefixos e consultas aproximadas, como o popup pediria.
+            probe = [rnd.choice(keys)[:rnd.randint(2, 6)] for _ in range(queries // 2)]
+            probe += ["/" + "".join(rnd.sample("aeioulmnprstv", rnd.randint(2, 4))) for _ in range(queries - len(probe))]
+            start = time.perf_counter()
+            hits = sum(len(manager.search_macros(q, limit=100)) for q in probe)
+            elapsed = time.perf_counter() - start
+            result["filter_throughput"] = {"queries": len(probe), "results": hits, "seconds": round(elapsed, 4),
+                                           "queries_per_second": round(len(probe) / elapsed, 1) if elapsed else None}
+            result["injections"] = {"completed": manager.injection_worker.completed, "failed": manager.injection_worker.failed,
+                                    "typed": sum(1 for op, _ in typing_backend.ops if op == "insert"),
+                                    "pasted": sum(1 for op, _ in clipboard_backend.ops if op == "insert")}
+            result["suggestion_queue"] = ui.commands.stats()
+        finally:
+            manager.cleanup()
+    return result
+
+def _run_core_benchmark(sizes: List[int], storage: str, output: Optional[str]) -> None:
+    import platform
+    report = {"benchmark": "core", "python": platform.python_version(), "platform": platform.platform(),
+              "fixed_delays": False, "results": [benchmark_core(size, storage) for size in sizes]}
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, "w", encoding="utf-8") as f: f.write(text + "\n")
+    print(text)
+
+def benchmark_storage(size: int, seed: int = 1234, samples: int = 200) -> Dict[str, Any]:
+    # Compara cada store com o expansions.json puro (indent=4, como o app grava): tamanho em disco,
+    # carga como no load_expansions (corpos para o JSON, só atalhos para os demais), memória Python
+    # retida pela carga (tracemalloc; páginas do mmap ficam de fora, são do cache do SO) e leitura
+    # de corpos sem cache, como numa expansão ou prévia fora do BodyCache.
+    import random
+    import tracemalloc
+    rnd = random.Random(seed)
+    library = _bench_library(size, rnd)
+    probe = rnd.sample(sorted(library), min(samples, size))
+    results: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory(prefix="macro-bench-") as tmp:
+        json_path = os.path.join(tmp, "expansions.json")
+        _write_json_atomic(json_path, library)
+        del library
+        factories = {"json": lambda: JsonMacroStore(json_path),
+                     "mmap": lambda: MappedMacroStore(os.path.join(tmp, MacroManager.MMAP_FILE_NAME), migrate_from=json_path),
+                     "compressed": lambda: CompressedMacroStore(os.path.join(tmp, MacroManager.COMPRESSED_FILE_NAME), migrate_from=json_path),
+                     "sqlite": lambda: SqliteMacroStore(os.path.join(tmp, MacroManager.SQLITE_FILE_NAME), migrate_from=json_path)}
+        for name, factory in factories.items():
+            start = time.perf_counter()
+            factory().close()  # migração a partir do JSON (uma vez, na primeira execução)
+            build = time.perf_counter() - start
+
+            def load(store: MacroStore) -> Any:
+                return store.load() if store.resident else store.load_keys()
+
+            start = time.perf_counter()
+            store = factory(); loaded = load(store)
+            load_seconds = time.perf_counter() - start
+            store.close(); del loaded
+            tracemalloc.start()
+            store = factory(); loaded = load(store)
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            # Store residente: o corpo já está no dict carregado.
+            get_body = loaded.get if store.resident else store.get_body
+            get_preview = (lambda key, n: loaded[key][:n]) if store.resident else store.get_preview
+            start = time.perf_counter()
+            for key in probe: get_body(key)
+            body_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            for key in probe: get_preview(key, PreviewCache.MAX_CHARS)
+            preview_seconds = time.perf_counter() - start
+            store.close(); del loaded, get_body, get_preview
+            results[name] = {"file_bytes": os.path.getsize(store.path), "build_ms": round(build * 1000, 1),
+                             "load_ms": round(load_seconds * 1000, 1), "retained_bytes": retained, "peak_bytes": peak,
+                             "body_read_us": round(body_seconds / len(probe) * 1e6, 1) if probe else None,
+                             "preview_read_us": round(preview_seconds / len(probe) * 1e6, 1) if probe else None}
+    plain = results["json"]
+    for stats in results.values():
+        stats["vs_json"] = {field: round(stats[field] / plain[field], 3) if plain[field] else None
+                            for field in ("file_bytes", "load_ms", "retained_bytes", "peak_bytes")}
+    return {"size": size, "stores": results}
+
+def _run_storage_benchmark(sizes: List[int], output: Optional[str]) -> None:
+    import platform
+    report = {"benchmark": "storage", "python": platform.python_version(), "platform": platform.platform(),
+              "results": [benchmark_storage(size) for size in sizes]}
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, "w", encoding="utf-8") as f: f.write(text + "\n")
+    print(text)
+
+class KeystrokeRecorder:
+    # Grava as teclas que chegam ao on_key_press/activate_suggestion_mode num trace gzip de texto:
+    #   cabeçalho "#macro-trace v1 anonymized=0|1"
+    #   uma linha por evento: delta_us \t tipo (k=tecla, h=ctrl+space) \t nome \t applying \t popup \t len(current_typed)
+    # O estado é o do manager quando a tecla chegou; o replay compara com ele para achar divergências.
+    # Anonimizado, letras viram "a" e dígitos "0" fora do modo "/", ou seja, só os atalhos digitados
+    # ficam legíveis. A thread do hook só enfileira; a gravação roda em thread própria.
+    HEADER = "#macro-trace v1"
+
+    def __init__(self, path: str, anonymize: bool = True) -> None:
+        import gzip
+        self.path = path
+        self.anonymize = anonymize
+        self.events = 0
+        self._last: Optional[float] = None
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._file = gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+        self._file.write(f"{self.HEADER} anonymized={int(anonymize)}\n")
+        self._thread = threading.Thread(target=self._run, name="KeystrokeRecorderThread", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _mask(name: str) -> str:
+        if name.isalpha(): return "a"
+        if name.isdigit(): return "0"
+        return name
+
+    def record(self, kind: str, name: Optional[str], now: float, manager: "MacroManager") -> None:
+        typed = manager.current_typed
+        if name is not None and self.anonymize and len(name) == 1 and not manager.suggestion_popup_active and not typed.startswith("/"):
+            name = self._mask(name)
+        delta = 0 if self._last is None else int((now - self._last) * 1_000_000)
+        self._last = now
+        self.events += 1
+        self._queue.put(f"{delta}\t{kind}\t{name or ''}\t{int(manager.is_applying_macro_flag)}\t{int(manager.suggestion_popup_active)}\t{len(typed)}\n")
+
+    def _run(self) -> None:
+        while True:
+            line = self._queue.get()
+            if line is None: break
+            self._file.write(line)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=2.0)
+        self._file.close()
+        logger.info(f"Trace de teclas gravado em {self.path} ({self.events} eventos)")
+
+
+class TraceEvent:
+    __slots__ = ("at", "kind", "name", "applying", "popup", "typed_len")
+
+    def __init__(self, at: float, kind: str, name: str, applying: bool, popup: bool, typed_len: int) -> None:
+        self.at = at
+        self.kind = kind
+        self.name = name
+        self.applying = applying
+        self.popup = popup
+        self.typed_len = typed_len
+
+
+def read_trace(path: str) -> List[TraceEvent]:
+    import gzip
+    events: List[TraceEvent] = []
+    at = 0.0
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = f.readline()
+        if not header.startswith(KeystrokeRecorder.HEADER): raise ValueError(f"{path} não é um trace de teclas")
+        for line in f:
+            delta, kind, name, applying, popup, typed_len = line.rstrip("\n").split("\t")
+            at += int(delta) / 1_000_000
+            events.append(TraceEvent(at, kind, name, applying == "1", popup == "1", int(typed_len)))
+    return events
+
+
+def replay_trace(events: List[TraceEvent], library: Dict[str, str], speed: float = 1.0, sync_timeout: float = 2.0) -> Dict[str, Any]:
+    # Reproduz o trace num manager com backends falsos e o HeadlessSuggestionUI. O relógio passado ao
+    # manager é virtual (instante gravado), então a janela HOTKEY_IGNORE_WINDOW vê os mesmos
+    # intervalos em qualquer velocidade; speed escala só as esperas reais (0 = sem esperas) e a pausa
+    # de foco. Antes de cada evento a fila do popup é drenada (um frame) e, se na gravação não havia
+    # expansão em andamento, espera-se o worker terminar; então o estado é comparado ao gravado.
+    fields = ("applying", "popup", "typed_len")
+    divergences: List[Dict[str, Any]] = []
+    counts: Dict[str, int] = defaultdict(int)
+    with tempfile.TemporaryDirectory(prefix="macro-replay-") as tmp:
+        path = os.path.join(tmp, "expansions.json")
+        _write_json_atomic(path, library, indent=None)
+        manager = MacroManager(expansions_file=path, settings={"hot_reload": False},
+                               injection_policy=HybridInjectionPolicy(FakeInjectionBackend("typing"), FakeInjectionBackend("clipboard")))
+        manager.FOCUS_RETURN_DELAY = MacroManager.FOCUS_RETURN_DELAY / speed if speed > 0 else 0.0
+        manager.PRE_INJECTION_DELAY = MacroManager.PRE_INJECTION_DELAY / speed if speed > 0 else 0.0
+        ui = HeadlessSuggestionUI(manager)
+        wall_start = time.perf_counter()
+        virtual_start = wall_start - (events[0].at if events else 0.0)
+        try:
+            for index, event in enumerate(events):
+                if speed > 0:
+                    delay = wall_start + event.at / speed - time.perf_counter()
+                    if delay > 0: time.sleep(delay)
+                ui.drain()
+                if not event.applying: _wait_injections(manager, timeout=sync_timeout); ui.drain()
+                actual = (manager.is_applying_macro_flag, manager.suggestion_popup_active, len(manager.current_typed))
+                for field, expected, got in zip(fields, (event.applying, event.popup, event.typed_len), actual):
+                    if expected != got:
+                        counts[field] += 1
+                        if len(divergences) < 50:
+                            divergences.append({"event": index, "key": event.name, "field": field, "expected": expected, "actual": got})
+                now = virtual_start + event.at
+                if event.kind == "h": manager.activate_suggestion_mode(now=now)
+                else: manager.on_key_press(keyboard.KeyboardEvent(keyboard.KEY_DOWN, 0, name=event.name or None), now=now)
+            _wait_injections(manager, timeout=sync_timeout); ui.drain()
+            return {"events": len(events), "speed": speed,
+                    "recorded_seconds": round(events[-1].at - events[0].at, 3) if events else 0.0,
+                    "replay_seconds": round(time.perf_counter() - wall_start, 3),
+                    "hook": manager.hook_latency.summary(), "filter": ui.filter_latency.summary(),
+                    "expansion": manager.injection_latency.summary(),
+                    "injections": {"submitted": manager.injection_worker.submitted, "completed": manager.injection_worker.completed,
+                                   "failed": manager.injection_worker.failed},
+                    "divergence_count": sum(counts.values()), "divergences_by_field": dict(counts), "divergences": divergences}
+        finally:
+            manager.cleanup()
+
+def _user_expansions_file() -> str:
+    # Mesmo arquivo que o MacroManager usa por padrão.
+    if hasattr(sys, '_MEIPASS'): return os.path.join(get_user_data_dir(), "expansions.json")
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "expansions.json")
+
+def _run_replay(trace: str, library_path: Optional[str], speed: float, output: Optional[str]) -> None:
+    # A biblioteca é lida (snapshot + journal) e copiada para uma pasta temporária: o replay nunca altera o arquivo real.
+    library = JsonMacroStore(library_path or _user_expansions_file()).load()
+    report = replay_trace(read_trace(trace), library, speed=speed)
+    report["trace"] = trace
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, "w", encoding="utf-8") as f: f.write(text + "\n")
+    print(text)
+
+def _run_transfer(import_path: Optional[str], export_path: Optional[str], fmt: Optional[str], on_conflict: str, dry_run: bool) -> int:
+    # Importação/exportação sem GUI e sem hook de teclado, direto na biblioteca do usuário (settings.json vale: storage etc.).
+    manager = MacroManager()
+    try:
+        result: Dict[str, Any] = {}
+        if import_path: result["import"] = manager.import_macros(import_path, fmt, on_conflict=on_conflict, dry_run=dry_run).to_dict()
+        if export_path: result["export"] = {"path": export_path, "macros": manager.export_macros(export_path, None if import_path else fmt)}
+    except ValueError as e:
+        print(f"Erro: {e}", file=sys.stderr); return 2
+    finally:
+        manager.cleanup()
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 1 if result.get("import", {}).get("error") else 0
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Macro Manager")
+    parser.add_argument("--log-level", default=None, help="Nível de log (DEBUG, INFO, WARNING...). Padrão: INFO ou 'log_level' do settings.json.")
+    parser.add_argument("--bench-injection", action="store_true", help="Compara o tempo de expansão digitando vs. colando (digita na janela em foco!) e sai.")
+    parser.add_argument("--bench-fake", action="store_true", help="Com --bench-injection: roda os backends reais com o teclado e a área de transferência do SO substituídos por stubs (mede só o custo do código).")
+    parser.add_argument("--bench-repeats", type=int, default=5, help="Repetições por combinação no benchmark.")
+    parser.add_argument("--bench-core", action="store_true", help="Benchmark headless do hook, do filtro e da expansão (teclado, área de transferência e popup falsos) e sai.")
+    parser.add_argument("--bench-sizes", default="100,10000,100000", help="Com --bench-core/--bench-stores: tamanhos de biblioteca, separados por vírgula.")
+    parser.add_argument("--bench-storage", default="json", choices=("json", "sqlite", "mmap", "compressed"), help="Com --bench-core: store usado pelo manager.")
+    parser.add_argument("--bench-stores", action="store_true", help="Compara tamanho, tempo de carga e memória de cada formato de armazenamento com o expansions.json puro e sai.")
+    parser.add_argument("--bench-output", default=None, help="Com --bench-core/--bench-stores/--replay-trace: grava o JSON do resultado também neste arquivo.")
+    parser.add_argument("--record-keys", default=None, metavar="ARQUIVO", help="Grava as teclas recebidas pelo hook num trace (.tsv.gz) para replay.")
+    parser.add_argument("--record-raw", action="store_true", help="Com --record-keys: não anonimiza o texto digitado fora dos atalhos.")
+    parser.add_argument("--replay-trace", default=None, metavar="ARQUIVO", help="Reproduz um trace gravado com backends falsos, relata latências e divergências de estado e sai.")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="Com --replay-trace: 1 = ritmo original, 10 = 10x mais rápido, 0 = sem esperas.")
+    parser.add_argument("--replay-library", default=None, help="Com --replay-trace: expansions.json usado no replay (padrão: o do usuário).")
+    parser.add_argument("--metrics", action="store_true", help="Ativa o registro de métricas (equivale a \"metrics\": true no settings.json).")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Com métricas ativas: serve /metrics e /metrics.json em 127.0.0.1 nesta porta.")
+    parser.add_argument("--import", dest="import_path", default=None, metavar="ARQUIVO", help="Importa macros de um .jsonl, .csv ou .json (formato do expansions.json), imprime o relatório e sai.")
+    parser.add_argument("--export", dest="export_path", default=None, metavar="ARQUIVO", help="Exporta todas as macros para um .jsonl, .csv ou .json e sai.")
+    parser.add_argument("--format", dest="transfer_format", default=None, choices=("json", "jsonl", "csv"), help="Com --import/--export: formato do arquivo (padrão: pela extensão).")
+    parser.add_argument("--on-conflict", default="skip", choices=("skip", "overwrite"), help="Com --import: o que fazer com atalhos que já existem com outro texto.")
+    parser.add_argument("--dry-run", action="store_true", help="Com --import: só valida e relata, sem gravar.")
+    parser.add_argument("--profile-startup", action="store_true", help="Imprime o tempo de cada fase da inicialização (imports, manager, tema, janela, listeners).")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+    imports_seconds = time.perf_counter() - _IMPORT_STARTED_AT
+    args = _parse_args(argv)
+    log_level = setup_logging(args.log_level)
+    if args.bench_injection:
+        _run_injection_benchmark(args.bench_fake, args.bench_repeats)
+        return
+    if args.bench_core:
+        _run_core_benchmark([int(n) for n in args.bench_sizes.split(",") if n.strip()], args.bench_storage, args.bench_output)
+        return
+    if args.bench_stores:
+        _run_storage_benchmark([int(n) for n in args.bench_sizes.split(",") if n.strip()], args.bench_output)
+        return
+    if args.replay_trace:
+        _run_replay(args.replay_trace, args.replay_library, args.replay_speed, args.bench_output)
+        return
+    if args.import_path or args.export_path:
+        sys.exit(_run_transfer(args.import_path, args.export_path, args.transfer_format, args.on_conflict, args.dry_run))
+    logger.info(f"Application starting... Running as admin: {is_admin()}. Log level: {log_level}")
+    profiler = StartupProfiler(args.profile_startup)
+    profiler.record("imports", imports_seconds)
     app_instance = None
     try:
         if os.name == 'nt':
@@ -1172,13 +4582,19 @@ def main():
             except Exception as e_dpi:
                  logger.error(f"An unexpected error occurred while setting DPI awareness: {e_dpi}")
 
-        manager = MacroManager()
-        root = ctk.CTk()
-        app_instance = MacroGUI(root, manager)
+        settings = load_settings()
+        if args.metrics: settings["metrics"] = True
+        if args.metrics_port is not None: settings["metrics_port"] = args.metrics_port
+        with profiler.phase("manager init"): manager = MacroManager(load_in_background=True, settings=settings)
+        with profiler.phase("root window"): root = ctk.CTk()
+        app_instance = MacroGUI(root, manager, profiler)
 
         atexit.register(app_instance._perform_full_shutdown)
 
-        manager.start_listener()
+        if args.record_keys: manager.start_recording(args.record_keys, anonymize=not args.record_raw)
+        with profiler.phase("listener registration"): manager.start_listener()
+        manager.start_file_watcher()
+        manager.start_metrics_server()
 
         logger.info("Starting Tkinter mainloop...")
         root.mainloop()
@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import macrov3
+
+
+class SlowStoreStartupTest(unittest.TestCase):
+    # main() cria o manager com load_in_background=True e logo em seguida liga o watcher e o
+    # servidor de métricas; com o store ainda migrando, esses ganchos precisam esperar a carga.
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.expansions = os.path.join(self.tmp.name, "expansions.json")
+        with open(self.expansions, "w", encoding="utf-8") as f: json.dump({"/a": "alpha"}, f)
+        self.release = threading.Event()
+        original_init = macrov3.SqliteMacroStore.__init__
+        release = self.release
+
+        def slow_init(store, *args, **kwargs):
+            release.wait(10)
+            original_init(store, *args, **kwargs)
+
+        patcher = mock.patch.object(macrov3.SqliteMacroStore, "__init__", slow_init)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = macrov3.MacroManager(
+            load_in_background=True, expansions_file=self.expansions,
+            settings={"storage": "sqlite", "hot_reload_interval": 0.05, "metrics": True, "metrics_port": 0},
+            injection_policy=macrov3.HybridInjectionPolicy(macrov3.FakeInjectionBackend("typing"), macrov3.FakeInjectionBackend("clipboard")))
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(self.manager.cleanup)
+        self.addCleanup(self.release.set)
+
+    def _wait_for(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition(): return True
+            time.sleep(0.02)
+        return False
+
+    def test_startup_hooks_wait_for_library(self):
+        self.assertIsNone(self.manager.store)
+        self.manager.start_file_watcher()
+        self.manager.start_metrics_server()
+        self.assertIsNone(self.manager.file_watcher)
+        self.assertIsNone(self.manager.metrics_server)
+
+        self.release.set()
+        self.assertTrue(self.manager.library_ready.wait(5))
+        self.assertTrue(self._wait_for(lambda: self.manager.file_watcher is not None and self.manager._json_baseline is not None))
+        self.assertIsInstance(self.manager.store, macrov3.SqliteMacroStore)
+        self.assertTrue(self._wait_for(lambda: self.manager.metrics_server is not None))
+
+        with open(self.expansions, "w", encoding="utf-8") as f: json.dump({"/a": "alpha", "/b": "beta"}, f)
+        self.assertTrue(self._wait_for(lambda: self.manager.get_body("/b") == "beta"))
+
+
+if __name__ == "__main__":
+    unittest.main()